@@ -0,0 +1,374 @@
+"""Набор микробенчмарков горячих функций бота с JSON-базой для сравнения.
+
+Группы: phones (extract_phone/extract_phones), ocr (preprocess_image, preprocess_fast,
+recognize_code на синтетических скриншотах), routing (ChatTopology на БД из тысяч чатов),
+report (сборка ежедневного отчета как в send_daily_report), keyboards (клавиатура
+handle_photo_reply). Группа пропускается, если нет нужного модуля (cv2, tesseract, aiogram).
+
+Каждый бенчмарк калибруется так, чтобы раунд длился не меньше --min-time, и повторяется
+--rounds раз; в базу пишется медиана, минимум и разброс на одну операцию. Файл базы
+отсортирован и по строке на значение, поэтому изменения видны в git diff.
+
+Запуск: python bench.py [--filter routing] [--save bench_baseline.json]
+        python bench.py --compare bench_baseline.json [--threshold 0.15]
+Со --compare код выхода 1, если медиана хотя бы одного бенчмарка выросла больше порога.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+from db import Database
+
+
+Benchmark = namedtuple("Benchmark", ["name", "group", "setup", "requires"])
+
+BENCHMARKS = []
+
+
+def benchmark(group, requires=()):
+    """setup(fixtures) возвращает (функция без аргументов, число операций в одном вызове)"""
+    def register(setup):
+        BENCHMARKS.append(Benchmark(f"{group}.{setup.__name__}", group, setup, tuple(requires)))
+        return setup
+    return register
+
+
+def missing_requirements(requires):
+    missing = []
+    for requirement in requires:
+        if requirement.startswith("bin:"):
+            if shutil.which(requirement[4:]) is None:
+                missing.append(requirement[4:])
+            continue
+        try:
+            __import__(requirement)
+        except ImportError:
+            missing.append(requirement)
+    return missing
+
+
+# --- данные ---
+
+DROPS_CHATS = 3000
+OFFICES_PER_DROPS = 3
+REPORT_ROWS = 3000
+
+
+class Fixtures:
+    """Общие данные бенчмарков, создаются при первом обращении"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._db = None
+        self._screenshots = None
+
+    @property
+    def db_path(self):
+        if self._db is None:
+            self._db = os.path.join(self.directory, "bench.sqlite")
+            seed_db(self._db)
+        return self._db
+
+    @property
+    def screenshots(self):
+        if self._screenshots is None:
+            from bench_ocr import synth_corpus, telegram_sizes
+            self._screenshots = [(data, telegram_sizes(data)) for _, data in synth_corpus(3)]
+        return self._screenshots
+
+
+def seed_db(path):
+    """DROPS_CHATS чатов дропов с офисами и темами, REPORT_ROWS регистраций за 2024-05-01"""
+    Database(path).open().close_sync()
+    rng = random.Random(1)
+    with sqlite3.connect(path) as conn:
+        for user_id in range(DROPS_CHATS):
+            drops_chat = -1000000 - user_id
+            conn.execute('INSERT INTO drops_chats (user_id, chat_id) VALUES (?, ?)', (user_id, drops_chat))
+            conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, 10, ?, 1)',
+                         (drops_chat, "drops"))
+            conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, 11, ?, 1)',
+                         (drops_chat, "reports"))
+            conn.executemany('INSERT INTO office_chats (user_id, chat_id) VALUES (?, ?)',
+                             [(user_id, -2000000 - user_id * 10 - i) for i in range(OFFICES_PER_DROPS)])
+        conn.executemany('''INSERT INTO phone_messages (phone, user_message_id, chat_id, user_id, username,
+                            first_name, registration_time) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         [(f"+79{i:09d}", i, -1000000 - rng.randrange(200), 10000 + i,
+                           f"user{i}" if i % 3 else None, f"Имя {i}",
+                           f"2024-05-01 {rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}")
+                          for i in range(REPORT_ROWS)])
+
+
+# --- phones ---
+
+@benchmark("phones")
+def extract_phone_corpus(fixtures):
+    from bench_phone import make_corpus
+    from phones import extract_phone
+    texts = [text for _, text in make_corpus(2000)]
+
+    def run():
+        for text in texts:
+            extract_phone(text)
+    return run, len(texts)
+
+
+@benchmark("phones")
+def extract_phones_multi(fixtures):
+    from bench_phone import make_corpus
+    from phones import extract_phones
+    texts = [text for kind, text in make_corpus(5000) if kind == "multi"]
+
+    def run():
+        for text in texts:
+            extract_phones(text)
+    return run, len(texts)
+
+
+# --- ocr ---
+
+@benchmark("ocr", requires=("cv2",))
+def preprocess_image_full(fixtures):
+    from ocr import preprocess_image
+    data = fixtures.screenshots[0][0]
+    return lambda: preprocess_image(data), 1
+
+
+@benchmark("ocr", requires=("cv2",))
+def preprocess_fast_roi(fixtures):
+    from ocr import preprocess_fast
+    data = fixtures.screenshots[0][0]
+    return lambda: preprocess_fast(data), 1
+
+
+@benchmark("ocr", requires=("cv2", "pytesseract", "bin:tesseract"))
+def recognize_code_selected(fixtures):
+    """Размер, который бот скачивает (select_photo), и конфигурация по умолчанию"""
+    from ocr import recognize_code, select_photo
+    data = select_photo(fixtures.screenshots[0][1]).data
+    return lambda: recognize_code(data), 1
+
+
+# --- routing ---
+
+def _topology(fixtures):
+    from routing import ChatTopology
+    db = Database(fixtures.db_path).open()
+    topology = ChatTopology().load(db)
+    db.close_sync()
+    return topology
+
+
+@benchmark("routing")
+def get_drops_chat_for_office(fixtures):
+    topology = _topology(fixtures)
+    rng = random.Random(1)
+    chats = [-2000000 - rng.randrange(DROPS_CHATS) * 10 - rng.randrange(OFFICES_PER_DROPS) for _ in range(1000)]
+
+    def run():
+        for chat_id in chats:
+            topology.get_drops_chat_for_office(chat_id)
+    return run, len(chats)
+
+
+@benchmark("routing")
+def get_office_chats_for_drops(fixtures):
+    topology = _topology(fixtures)
+    rng = random.Random(1)
+    chats = [-1000000 - rng.randrange(DROPS_CHATS) for _ in range(1000)]
+
+    def run():
+        for chat_id in chats:
+            topology.get_office_chats_for_drops(chat_id)
+    return run, len(chats)
+
+
+@benchmark("routing")
+def get_topic_and_checks(fixtures):
+    """Типичный набор проверок обработчика номера: is_drops_chat + get_topic + is_office_chat"""
+    topology = _topology(fixtures)
+    rng = random.Random(1)
+    chats = [-1000000 - rng.randrange(DROPS_CHATS) for _ in range(1000)]
+
+    def run():
+        for chat_id in chats:
+            topology.is_drops_chat(chat_id)
+            topology.get_topic(chat_id, "drops")
+            topology.is_office_chat(chat_id)
+    return run, len(chats)
+
+
+@benchmark("routing")
+def load_snapshot(fixtures):
+    """Полная перезагрузка маршрутизации (refresh_topology, /start, /settings)"""
+    from routing import load_snapshot
+    conn = sqlite3.connect(fixtures.db_path)
+    return lambda: load_snapshot(conn), 1
+
+
+# --- report ---
+
+@benchmark("report")
+def daily_report_build(fixtures):
+    """Часть send_daily_report до отправки: запрос за сутки, строки, разбиение на сообщения"""
+    from reports import chunk_lines, daily_report_lines, load_day_registrations
+    conn = sqlite3.connect(fixtures.db_path)
+    report_date = datetime.date(2024, 5, 1)
+
+    def run():
+        rows = load_day_registrations(conn, "2024-05-01 00:00:00", "2024-05-02 00:00:00")
+        list(chunk_lines(daily_report_lines(rows, report_date, (len(rows), 0, 0))))
+    return run, 1
+
+
+@benchmark("report")
+def daily_report_format(fixtures):
+    from reports import chunk_lines, daily_report_lines, load_day_registrations
+    conn = sqlite3.connect(fixtures.db_path)
+    rows = load_day_registrations(conn, "2024-05-01 00:00:00", "2024-05-02 00:00:00")
+    report_date = datetime.date(2024, 5, 1)
+    return lambda: list(chunk_lines(daily_report_lines(rows, report_date, (len(rows), 0, 0)))), 1
+
+
+# --- keyboards ---
+
+@benchmark("keyboards", requires=("aiogram",))
+def status_keyboard(fixtures):
+    from keyboards import status_keyboard
+    return lambda: status_keyboard(123456), 1
+
+
+@benchmark("keyboards", requires=("aiogram",))
+def status_keyboard_builder(fixtures):
+    """Прежняя сборка через InlineKeyboardBuilder - для сравнения"""
+    from aiogram.types import InlineKeyboardButton
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+    def run():
+        (InlineKeyboardBuilder()
+         .row(InlineKeyboardButton(text="✅ Встал", callback_data="status_ok_123456"),
+              InlineKeyboardButton(text="❌ Не встал", callback_data="status_fail_123456"))
+         .row(InlineKeyboardButton(text="🔁 Повтор", callback_data="status_repeat_123456"))
+         .as_markup())
+    return run, 1
+
+
+# --- запуск ---
+
+def calibrate(func, min_time):
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - started >= min_time:
+            return loops
+        loops *= 2
+
+
+def measure(func, operations, rounds, min_time):
+    """Время одной операции в мкс по раундам"""
+    loops = calibrate(func, min_time)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - started) / loops / operations * 1e6)
+    return {
+        "median_us": round(statistics.median(timings), 3),
+        "min_us": round(min(timings), 3),
+        "stdev_us": round(statistics.stdev(timings), 3) if len(timings) > 1 else 0.0,
+        "rounds": rounds,
+        "loops": loops,
+        "operations": operations,
+    }
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Печать разницы с базой; возвращает имена бенчмарков с регрессией"""
+    regressions = []
+    print(f"\n{'бенчмарк':<40} {'база, мкс':>12} {'сейчас, мкс':>12} {'изменение':>10}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<40} {'-':>12} {result['median_us']:12.3f} {'новый':>10}")
+            continue
+        change = result["median_us"] / old["median_us"] - 1 if old["median_us"] else 0.0
+        mark = ""
+        if change > threshold:
+            regressions.append(name)
+            mark = "  РЕГРЕССИЯ"
+        print(f"{name:<40} {old['median_us']:12.3f} {result['median_us']:12.3f} {change:+9.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", default="", help="подстрока имени бенчмарка или группы")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05, help="минимальная длительность раунда, с")
+    parser.add_argument("--save", help="записать результаты в JSON-базу")
+    parser.add_argument("--compare", help="сравнить с JSON-базой")
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимый рост медианы, доля")
+    args = parser.parse_args()
+
+    results = {}
+    skipped = {}
+    with tempfile.TemporaryDirectory(prefix="bench_") as directory:
+        fixtures = Fixtures(directory)
+        for bench in BENCHMARKS:
+            if args.filter not in bench.name:
+                continue
+            missing = missing_requirements(bench.requires)
+            if missing:
+                skipped[bench.name] = missing
+                continue
+            func, operations = bench.setup(fixtures)
+            results[bench.name] = measure(func, operations, args.rounds, args.min_time)
+            result = results[bench.name]
+            print(f"{bench.name:<40} {result['median_us']:12.3f} мкс  (мин. {result['min_us']:.3f}, "
+                  f"σ {result['stdev_us']:.3f}, {result['loops']}x{result['operations']} за раунд)")
+
+    for name, missing in skipped.items():
+        print(f"{name:<40} пропущен: нет {', '.join(missing)}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine_info(), "benchmarks": results}, f, indent=1, sort_keys=True,
+                      ensure_ascii=False)
+            f.write("\n")
+        print(f"\nБаза записана: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != machine_info():
+            print("\nВнимание: база снята на другой машине или версии Python, сравнение приблизительное")
+        regressions = compare(results, baseline["benchmarks"], args.threshold)
+        if regressions:
+            print(f"\nРегрессий больше {args.threshold:.0%}: {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
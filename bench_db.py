@@ -0,0 +1,130 @@
+"""Бенчмарк задержки обработчиков: синхронный sqlite3 в event loop против потока БД.
+
+Запуск: python bench_db.py [--updates 2000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from db import Database, init_db
+
+
+OFFICES_PER_DROPS = 3
+DROPS_CHATS = 50
+
+
+def seed(conn):
+    init_db(conn)
+    for user_id in range(DROPS_CHATS):
+        drops_chat = -1000000 - user_id
+        conn.execute('INSERT INTO drops_chats (user_id, chat_id) VALUES (?, ?)', (user_id, drops_chat))
+        conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, ?, ?, 1)',
+                     (drops_chat, 10, "drops"))
+        for i in range(OFFICES_PER_DROPS):
+            conn.execute('INSERT INTO office_chats (user_id, chat_id) VALUES (?, ?)',
+                         (user_id, -2000000 - user_id * 10 - i))
+    conn.commit()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def fake_api_call():
+    await asyncio.sleep(0.005)
+
+
+async def sync_update(conn, n):
+    """Повторяет handle_phone_number на синхронном соединении"""
+    cursor = conn.cursor()
+    drops_chat = -1000000 - n % DROPS_CHATS
+    office_chat = -2000000 - (n % DROPS_CHATS) * 10
+    cursor.execute('SELECT COUNT(*) FROM drops_chats WHERE chat_id = ?', (drops_chat,))
+    cursor.fetchone()
+    cursor.execute('''SELECT topic_id FROM number_topics
+                   WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''', (drops_chat,))
+    cursor.fetchone()
+    cursor.execute('''INSERT INTO num_requests (office_chat_id, drops_chat_id, request_message_id, status)
+                   VALUES (?, ?, ?, 'pending')''', (office_chat, drops_chat, n))
+    conn.commit()
+    await fake_api_call()
+    cursor.execute('''INSERT OR REPLACE INTO phone_messages (phone, user_message_id, chat_id, user_id)
+                   VALUES (?, ?, ?, ?)''', (f"+7{9000000000 + n}", n, drops_chat, n))
+    cursor.execute("UPDATE num_requests SET status = 'fulfilled' WHERE request_message_id = ?", (n,))
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM num_requests WHERE status = 'pending' AND drops_chat_id = ?", (drops_chat,))
+    cursor.fetchone()
+
+
+def _accept(conn, n, drops_chat):
+    conn.execute('''INSERT OR REPLACE INTO phone_messages (phone, user_message_id, chat_id, user_id)
+                 VALUES (?, ?, ?, ?)''', (f"+7{9000000000 + n}", n, drops_chat, n))
+    conn.execute("UPDATE num_requests SET status = 'fulfilled' WHERE request_message_id = ?", (n,))
+
+
+async def async_update(db, n):
+    """Тот же сценарий через Database"""
+    drops_chat = -1000000 - n % DROPS_CHATS
+    office_chat = -2000000 - (n % DROPS_CHATS) * 10
+    await db.fetchval('SELECT COUNT(*) FROM drops_chats WHERE chat_id = ?', (drops_chat,))
+    await db.fetchval('''SELECT topic_id FROM number_topics
+                      WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''', (drops_chat,))
+    await db.execute('''INSERT INTO num_requests (office_chat_id, drops_chat_id, request_message_id, status)
+                     VALUES (?, ?, ?, 'pending')''', (office_chat, drops_chat, n))
+    await fake_api_call()
+    await db.transaction(_accept, n, drops_chat)
+    await db.fetchval("SELECT COUNT(*) FROM num_requests WHERE status = 'pending' AND drops_chat_id = ?", (drops_chat,))
+
+
+async def drive(handler, updates, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(n):
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(n)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(updates)))
+    return latencies, time.perf_counter() - started
+
+
+def report(name, latencies, elapsed):
+    ms = [x * 1000 for x in latencies]
+    print(f"{name:<22} p50={statistics.median(ms):7.2f}ms  p95={percentile(ms, 0.95):7.2f}ms  "
+          f"p99={percentile(ms, 0.99):7.2f}ms  {len(ms) / elapsed:8.1f} upd/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "before.sqlite")
+        conn = sqlite3.connect(path)
+        seed(conn)
+        latencies, elapsed = await drive(lambda n: sync_update(conn, n), args.updates, args.concurrency)
+        conn.close()
+        report("before (sync sqlite3)", latencies, elapsed)
+
+        path = os.path.join(tmp, "after.sqlite")
+        conn = sqlite3.connect(path)
+        seed(conn)
+        conn.close()
+        db = Database(path).open()
+        latencies, elapsed = await drive(lambda n: async_update(db, n), args.updates, args.concurrency)
+        await db.close()
+        report("after (db thread, WAL)", latencies, elapsed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
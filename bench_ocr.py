@@ -0,0 +1,164 @@
+"""Бенчмарк OCR: конфигурации предобработки и Tesseract на размеченном корпусе.
+
+Корпус - каталог изображений, метка берется из имени файла (ABCD-1234.png, ABCD-1234_2.jpg).
+Без --corpus генерируется синтетический корпус скриншотов.
+Результаты пишутся в профиль (ocr_profile.json), из которого бот выбирает
+самую быструю конфигурацию с точностью не ниже OCR_TARGET_ACCURACY.
+
+Запуск: python bench_ocr.py [--corpus DIR] [--generate 40] [--preprocess roi,full2x] [--tesseract psm6,psm7]
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import statistics
+import string
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+import ocr
+
+
+LABEL_RE = re.compile(r'([A-Z0-9]{4})-?([A-Z0-9]{4})')
+TELEGRAM_SIDES = (90, 320, 800, 1280)
+
+
+def telegram_sizes(data: bytes):
+    """Набор размеров, как Telegram сохраняет фото: [(PhotoSize-подобный объект, jpeg)]"""
+    img = ocr.decode_image(data)
+    height, width = img.shape[:2]
+    sizes = []
+    for side in TELEGRAM_SIDES:
+        scale = min(1.0, side / max(height, width))
+        resized = cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+        _, jpeg = cv2.imencode(".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, 87])
+        photo = SimpleNamespace(width=resized.shape[1], height=resized.shape[0], data=jpeg.tobytes())
+        sizes.append(photo)
+        if scale == 1.0:
+            break
+    return sizes
+
+
+def load_corpus(path):
+    samples = []
+    for file in sorted(glob.glob(os.path.join(path, "*"))):
+        match = LABEL_RE.search(os.path.splitext(os.path.basename(file))[0].upper())
+        if not match:
+            continue
+        with open(file, "rb") as f:
+            samples.append((f"{match.group(1)}-{match.group(2)}", f.read()))
+    return samples
+
+
+def random_code(rng):
+    alphabet = string.ascii_uppercase + string.digits
+    return "".join(rng.choice(alphabet) for _ in range(4)) + "-" + "".join(rng.choice(alphabet) for _ in range(4))
+
+
+def synth_corpus(count, seed=1):
+    """Скриншоты телефона 1080x2340: фоновый текст и код крупным шрифтом"""
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(count):
+        dark = rng.random() < 0.3
+        background, foreground = (30, 255) if dark else (250, 20)
+        img = np.full((2340, 1080, 3), background, dtype=np.uint8)
+        for y in range(150, 2300, 90):
+            if rng.random() < 0.6:
+                words = " ".join(rng.choice(["Enter", "code", "from", "SMS", "login", "device", "link"]) for _ in range(4))
+                cv2.putText(img, words, (60, y), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (foreground,) * 3, 2)
+        code = random_code(rng)
+        scale = rng.uniform(1.6, 3.0)
+        cv2.putText(img, code, (rng.randint(40, 200), rng.randint(700, 1600)), cv2.FONT_HERSHEY_SIMPLEX,
+                    scale, (foreground,) * 3, int(scale * 2))
+        _, png = cv2.imencode(".png", img)
+        samples.append((code, png.tobytes()))
+    return samples
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(config, samples, pick, repeat):
+    timings = []
+    correct = 0
+    started_all = time.perf_counter()
+    for _ in range(repeat):
+        for label, sizes in samples:
+            data = pick(sizes).data
+            started = time.perf_counter()
+            try:
+                result = ocr.recognize_with(data, config)
+            except Exception:
+                result = ocr.RECOGNITION_ERROR
+            timings.append((time.perf_counter() - started) * 1000)
+            correct += result == label
+    elapsed = time.perf_counter() - started_all
+    return {
+        "preprocess": config[0],
+        "tesseract": config[1],
+        "accuracy": correct / len(timings),
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "p95_ms": percentile(timings, 0.95),
+        "p99_ms": percentile(timings, 0.99),
+        "throughput": len(timings) / elapsed,
+    }
+
+
+def print_result(name, result):
+    print(f"{name:<20} {result['mean_ms']:8.1f} мс  p50={result['p50_ms']:7.1f}  p95={result['p95_ms']:7.1f}  "
+          f"p99={result['p99_ms']:7.1f}  {result['throughput']:6.1f} изобр./с  точность {result['accuracy']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="каталог с размеченными изображениями")
+    parser.add_argument("--generate", type=int, default=40, help="размер синтетического корпуса")
+    parser.add_argument("--preprocess", default=",".join(ocr.PREPROCESSORS), help="предобработки через запятую")
+    parser.add_argument("--tesseract", default=",".join(ocr.TESSERACT_CONFIGS), help="режимы Tesseract через запятую")
+    parser.add_argument("--repeat", type=int, default=1, help="повторов корпуса на конфигурацию")
+    parser.add_argument("--target", type=float, default=0.97, help="целевая точность для выбора")
+    parser.add_argument("--out", default="ocr_profile.json", help="файл профиля")
+    args = parser.parse_args()
+
+    raw = load_corpus(args.corpus) if args.corpus else synth_corpus(args.generate)
+    if not raw:
+        print("Корпус пуст")
+        return
+    samples = [(label, telegram_sizes(data)) for label, data in raw]
+    print(f"Изображений: {len(samples)}, повторов: {args.repeat}")
+
+    baseline = run(ocr.LEGACY_CONFIG, samples, lambda sizes: sizes[-1], args.repeat)
+    print_result("исходный (photo[-1])", baseline)
+
+    results = []
+    for preprocess in args.preprocess.split(","):
+        for tesseract in args.tesseract.split(","):
+            result = run((preprocess, tesseract), samples, ocr.select_photo, args.repeat)
+            print_result(f"{preprocess} + {tesseract}", result)
+            results.append(result)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"corpus": args.corpus or f"synthetic:{args.generate}", "images": len(samples),
+                   "baseline": baseline, "results": results}, f, ensure_ascii=False, indent=2)
+
+    config = ocr.choose_config(args.out, args.target)
+    chosen = next((r for r in results if (r["preprocess"], r["tesseract"]) == config), None)
+    print(f"Профиль записан в {args.out}")
+    if chosen is None:
+        print(f"Ни одна конфигурация не достигла точности {args.target:.0%}, бот использует {' + '.join(config)}")
+    else:
+        print(f"Выбрано: {' + '.join(config)}, {baseline['mean_ms'] / chosen['mean_ms']:.2f}x к исходному")
+
+
+if __name__ == "__main__":
+    main()
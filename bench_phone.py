@@ -0,0 +1,126 @@
+"""Микробенчмарк извлечения номеров на типичных сообщениях чата дропов.
+
+Сравнивает исходный extract_phone (re.findall на каждый вызов) с phones.extract_phones.
+В категории multi новое извлечение медленнее исходного (~0.8x): исходный оформляет только
+первый номер, новый - все 2-4 и убирает повторы. Префильтр DIGIT_RUN_RE тут ни при чем -
+без него multi так же 0.8x, а болтовня (~70% сообщений) в 2.5 раза медленнее.
+С --max-us завершается с кодом 1, если новое извлечение медленнее порога (мкс на сообщение).
+
+Запуск: python bench_phone.py [--messages 20000] [--max-us 3]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+from phones import extract_phones
+
+
+def legacy_extract_phone(text):
+    phone = re.findall(r'(?:\+7|7|8)?[\s\-]?\(?[0-9]{3}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}', text)
+    if not phone:
+        return None
+
+    phone = phone[0].replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+
+    if phone.startswith('+7'):
+        return phone
+    elif phone.startswith('7'):
+        return f'+7{phone[1:]}'
+    elif phone.startswith('8'):
+        return f'+7{phone[1:]}'
+    else:
+        return f'+7{phone}' if len(phone) == 10 else None
+
+
+CHATTER = [
+    "ок", "принял", "жду код", "+", "спасибо", "сейчас скину", "не приходит смс",
+    "в сети", "ушел на перерыв", "код пришел, отправил", "что по номерам?",
+    "Добрый день! Подскажите, сколько еще ждать?",
+]
+WITH_DIGITS = [
+    "буду в 14:30", "осталось 2 номера", "код 4821", "через 15 минут", "оплата 1500р",
+]
+PHONE_FORMATS = [
+    "+7 ({a}) {b}-{c}-{d}", "8{a}{b}{c}{d}", "7{a}{b}{c}{d}", "{a} {b} {c} {d}", "+7{a}{b}{c}{d}",
+    "8-{a}-{b}-{c}-{d}",
+]
+
+
+def random_phone(rng):
+    fmt = rng.choice(PHONE_FORMATS)
+    return fmt.format(a=rng.randint(900, 999), b=rng.randint(100, 999), c=rng.randint(10, 99), d=rng.randint(10, 99))
+
+
+def make_corpus(count, seed=1):
+    """~70% болтовни без номеров, ~15% с цифрами, ~12% один номер, ~3% несколько"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.70:
+            corpus.append(("chatter", rng.choice(CHATTER)))
+        elif roll < 0.85:
+            corpus.append(("digits", rng.choice(WITH_DIGITS)))
+        elif roll < 0.97:
+            corpus.append(("phone", random_phone(rng)))
+        else:
+            corpus.append(("multi", "\n".join(random_phone(rng) for _ in range(rng.randint(2, 4)))))
+    return corpus
+
+
+def measure(func, texts, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for text in texts:
+            func(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-us", type=float, help="порог для нового извлечения, мкс на сообщение")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+
+    mismatches = 0
+    for kind, text in corpus:
+        legacy = legacy_extract_phone(text)
+        phones = extract_phones(text)
+        if kind != "multi" and legacy != (phones[0] if phones else None):
+            mismatches += 1
+            print(f"Расхождение: {text!r}: {legacy} != {phones}")
+        if kind == "multi" and len(phones) < 2:
+            mismatches += 1
+            print(f"Не найдены все номера: {text!r}: {phones}")
+
+    print(f"Сообщений: {len(corpus)}, лучший из {args.rounds} прогонов, мкс на сообщение")
+    print(f"{'категория':<10} {'исходный':>10} {'новый':>10} {'ускорение':>10}")
+    total_new = None
+    for kind in ("chatter", "digits", "phone", "multi", "all"):
+        texts = [text for k, text in corpus if kind in (k, "all")]
+        if not texts:
+            continue
+        old = measure(legacy_extract_phone, texts, args.rounds)
+        new = measure(extract_phones, texts, args.rounds)
+        print(f"{kind:<10} {old:10.2f} {new:10.2f} {old / new:9.1f}x")
+        if kind == "all":
+            total_new = new
+
+    if mismatches:
+        print(f"Расхождений: {mismatches}")
+        sys.exit(1)
+    if args.max_us is not None and total_new > args.max_us:
+        print(f"Регрессия: {total_new:.2f} мкс > {args.max_us} мкс")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Пропускная способность: один процесс против шардов по chat_id.
+
+Обработчик апдейта имитирует работу бота: cpu-ms процессорного времени в event loop
+(разбор, БД, подготовка OCR) и io-ms ожидания (запросы к Bot API). Проверяется, что
+внутри одного чата апдейты обработаны строго по порядку.
+
+Запуск: python bench_shards.py [--updates 4000] [--chats 200] [--shards 1,2,4] [--cpu-ms 2] [--io-ms 20]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sharding import ChatOrderedRunner, ShardRouter, consume_shard, start_workers, stop_workers
+
+
+class StaticTopology:
+    def __init__(self, office_to_drops):
+        self.office_to_drops = office_to_drops
+
+    def get_drops_chat_for_office(self, chat_id):
+        return self.office_to_drops.get(chat_id)
+
+
+def make_updates(count, chats, seed=1):
+    """Апдейты по чатам дропов и их офисам (по 2 офиса на чат дропов)"""
+    rng = random.Random(seed)
+    drops = [-1000 - i for i in range(chats)]
+    office_to_drops = {}
+    for drops_chat in drops:
+        for n in range(2):
+            office_to_drops[drops_chat * 10 - n] = drops_chat
+    all_chats = drops + list(office_to_drops)
+    updates = [{"update_id": i, "message": {"chat": {"id": rng.choice(all_chats)}}} for i in range(count)]
+    return updates, office_to_drops
+
+
+def burn(cpu_ms):
+    deadline = time.perf_counter() + cpu_ms / 1000
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def run_shard(queue, results, cpu_ms, io_ms):
+    seen = {}
+    violations = 0
+
+    async def handle(update):
+        nonlocal violations
+        burn(cpu_ms)
+        await asyncio.sleep(io_ms / 1000)
+        chat_id = update["message"]["chat"]["id"]
+        if update["update_id"] < seen.get(chat_id, -1):
+            violations += 1
+        seen[chat_id] = update["update_id"]
+
+    runner = ChatOrderedRunner(handle)
+    await consume_shard(queue, runner, poll_interval=0.05)
+    results.put((runner.processed, violations))
+
+
+def bench_worker(index, queue, results, cpu_ms, io_ms):
+    asyncio.run(run_shard(queue, results, cpu_ms, io_ms))
+
+
+def measure(updates, office_to_drops, shards, cpu_ms, io_ms):
+    import multiprocessing
+
+    results = multiprocessing.get_context("spawn").Queue()
+    processes, queues = start_workers(bench_worker, shards, results, cpu_ms, io_ms)
+    router = ShardRouter(StaticTopology(office_to_drops), shards)
+    time.sleep(1)  # запуск интерпретаторов не входит в замер
+
+    started = time.perf_counter()
+    for update in updates:
+        shard, key = router.route(update)
+        queues[shard].put((key, update))
+    stop_workers(processes, queues, timeout=600)
+    elapsed = time.perf_counter() - started
+
+    processed = violations = 0
+    for _ in range(shards):
+        done, bad = results.get()
+        processed += done
+        violations += bad
+    return processed / elapsed, processed, violations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--chats", type=int, default=200, help="чатов дропов")
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--cpu-ms", type=float, default=2.0)
+    parser.add_argument("--io-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    updates, office_to_drops = make_updates(args.updates, args.chats)
+    print(f"Апдейтов: {len(updates)}, чатов дропов: {args.chats}, CPU {args.cpu_ms} мс + ожидание {args.io_ms} мс")
+    baseline = None
+    for shards in (int(n) for n in args.shards.split(",")):
+        rate, processed, violations = measure(updates, office_to_drops, shards, args.cpu_ms, args.io_ms)
+        baseline = baseline or rate
+        label = "один процесс" if shards == 1 else f"шардов: {shards}"
+        print(f"{label:<14} {rate:8.1f} апдейтов/с  x{rate / baseline:.2f}  "
+              f"обработано {processed}, нарушений порядка {violations}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+import asyncio
+import contextvars
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = (
+    # действует только на новой БД (до первой таблицы); существующую переводит retention.py --convert
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def _migration_initial(conn):
+    cursor = conn.cursor()
+
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS office_chats (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    chat_id INTEGER,
+                    UNIQUE(user_id, chat_id))''')
+
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS drops_chats (
+                    user_id INTEGER PRIMARY KEY,
+                    chat_id INTEGER)''')
+
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS number_topics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    topic_id INTEGER,
+                    topic_name TEXT,
+                    is_active BOOLEAN DEFAULT 1)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS number_requests (
+                drops_chat INTEGER PRIMARY KEY,
+                required INTEGER DEFAULT 0,
+                fulfilled INTEGER DEFAULT 0)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS num_requests (
+                request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                office_chat_id INTEGER,
+                drops_chat_id INTEGER,
+                request_message_id INTEGER,
+                status TEXT DEFAULT 'pending')''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS last_messages (
+                    chat_id INTEGER PRIMARY KEY,
+                    message_id INTEGER)''')
+
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS phone_messages (
+                phone TEXT PRIMARY KEY,
+                user_message_id INTEGER,
+                confirmation_message_id INTEGER,
+                chat_id INTEGER,
+                user_id INTEGER,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                registration_time TEXT,
+                report_message_id INTEGER,
+                status TEXT)''')
+
+
+def _migration_phone_columns(conn):
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(phone_messages)')}
+    for column, column_type in [('registration_time', 'TEXT'), ('report_message_id', 'INTEGER'), ('status', 'TEXT')]:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE phone_messages ADD COLUMN {column} {column_type}')
+
+
+def _migration_hot_indexes(conn):
+
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_num_requests_pending
+                    ON num_requests (drops_chat_id, status, request_id, office_chat_id, request_message_id)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_num_requests_message
+                    ON num_requests (request_message_id)''')
+
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_phone_messages_registration
+                    ON phone_messages (chat_id, registration_time, phone, user_id, username, first_name, last_name)''')
+
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_office_chats_chat
+                    ON office_chats (chat_id, user_id)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_drops_chats_chat
+                    ON drops_chats (chat_id, user_id)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_number_topics_lookup
+                    ON number_topics (chat_id, topic_name, is_active, topic_id)''')
+
+
+def _migration_ocr_cache(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS ocr_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    result TEXT,
+                    expires_at REAL)''')
+
+
+def _migration_daily_stats(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_stats (
+                    day TEXT,
+                    drops_chat_id INTEGER,
+                    office_chat_id INTEGER,
+                    registered INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    slet INTEGER DEFAULT 0,
+                    PRIMARY KEY (day, drops_chat_id, office_chat_id)) WITHOUT ROWID''')
+
+    # офисный чат для старых регистраций не сохранялся - 0
+    conn.execute('''INSERT OR IGNORE INTO daily_stats (day, drops_chat_id, office_chat_id, registered)
+                    SELECT substr(registration_time, 1, 10), chat_id, 0, COUNT(*)
+                    FROM phone_messages
+                    WHERE registration_time IS NOT NULL
+                    GROUP BY substr(registration_time, 1, 10), chat_id''')
+
+
+def _migration_created_at(conn):
+    now = int(time.time())
+    for table in ('num_requests', 'phone_messages'):
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if 'created_at' not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN created_at INTEGER')
+
+    # registration_time - московское время; без него и для запросов - момент миграции
+    conn.execute('''UPDATE phone_messages
+                    SET created_at = COALESCE(CAST(strftime('%s', registration_time, '-3 hours') AS INTEGER), ?)
+                    WHERE created_at IS NULL''', (now,))
+    conn.execute('UPDATE num_requests SET created_at = ? WHERE created_at IS NULL', (now,))
+
+
+def _migration_status_day(conn):
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(phone_messages)')}
+    if 'status_day' not in existing:
+        conn.execute('ALTER TABLE phone_messages ADD COLUMN status_day TEXT')
+
+
+MIGRATIONS = [
+    (1, "базовая схема", _migration_initial),
+    (2, "поля регистрации в phone_messages", _migration_phone_columns),
+    (3, "индексы для горячих запросов", _migration_hot_indexes),
+    (4, "кэш результатов OCR", _migration_ocr_cache),
+    (5, "суточные агрегаты daily_stats", _migration_daily_stats),
+    (6, "created_at для архивации", _migration_created_at),
+    (7, "день смены статуса в phone_messages", _migration_status_day),
+]
+
+
+def migrate(conn):
+    """Применяет недостающие миграции по порядку; возвращает [(версия, имя, мс)]"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT,
+                    applied_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    duration_ms REAL)''')
+    conn.commit()
+    applied = {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+    results = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        started = time.perf_counter()
+        conn.execute('BEGIN')
+        try:
+            step(conn)
+            duration_ms = (time.perf_counter() - started) * 1000
+            conn.execute('INSERT INTO schema_version (version, name, duration_ms) VALUES (?, ?, ?)',
+                         (version, name, duration_ms))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        results.append((version, name, duration_ms))
+    return results
+
+
+def schema_version(conn):
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def init_db(conn):
+    return migrate(conn)
+
+
+def query_label(func, args) -> str:
+    """Метка запроса для метрик: текст SQL или имя функции, выполняемой в потоке БД"""
+    name = getattr(func, "__name__", "?")
+    if name in ("_execute", "_executemany", "_fetchone", "_fetchall"):
+        return " ".join(args[0].split())[:100]
+    if name == "_transaction":
+        return getattr(args[0], "__name__", "?")
+    return name
+
+
+_current_unit = contextvars.ContextVar("unit_of_work", default=None)
+
+
+def commit_units(conn, units):
+    """Несколько единиц работы одной транзакцией, каждая в своей точке сохранения:
+    ошибка одной откатывает только ее. Возвращает [None или исключение] по единицам"""
+    results = []
+    conn.execute('BEGIN')
+    try:
+        for index, writes in enumerate(units):
+            conn.execute(f'SAVEPOINT unit{index}')
+            try:
+                for func, args in writes:
+                    func(conn, *args)
+            except Exception as e:
+                conn.execute(f'ROLLBACK TO unit{index}')
+                results.append(e)
+            else:
+                results.append(None)
+            conn.execute(f'RELEASE unit{index}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+
+class UnitOfWork:
+    """Записи одного апдейта: db.write() копит их и фиксирует одной транзакцией при выходе.
+    При исключении в обработчике или ошибке фиксации записи отбрасываются, а хуки
+    on_rollback (возврат состояния в памяти) вызываются в обратном порядке"""
+
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+        self.rollback_hooks = []
+        self.task = None
+        self.open = False
+        self.aborted = False
+        self._token = None
+
+    def on_rollback(self, callback, *args):
+        self.rollback_hooks.append((callback, args))
+
+    def rollback(self):
+        self.writes = []
+        for callback, args in reversed(self.rollback_hooks):
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("Ошибка в хуке отката %s", getattr(callback, "__name__", callback))
+        self.rollback_hooks = []
+
+    async def flush(self):
+        """Фиксирует накопленные записи сейчас, не закрывая единицу работы: состояние, от которого
+        зависит следующее действие пользователя, должно быть в БД до ответа в Telegram.
+        Хуки отката зафиксированных записей больше не нужны; ошибка - откат и исключение"""
+        if not self.writes:
+            return
+        writes, self.writes = self.writes, []
+        try:
+            await self.db.commit_unit(writes)
+        except Exception:
+            self.rollback()
+            raise
+        self.rollback_hooks = []
+
+    def abort(self):
+        """Отбросить еще не зафиксированные записи при выходе, без исключения в обработчике"""
+        self.aborted = True
+
+    async def __aenter__(self):
+        self.task = asyncio.current_task()
+        self.open = True
+        self._token = _current_unit.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.open = False
+        _current_unit.reset(self._token)
+        if exc_type is not None or self.aborted:
+            self.rollback()
+            return False
+        if not self.writes:
+            return False
+        try:
+            await self.db.commit_unit(self.writes)
+        except Exception:
+            self.rollback()
+            raise
+        return False
+
+
+class GroupCommit:
+    """Склеивает фиксации единиц работы, пришедшие в течение window секунд, в одну транзакцию.
+    Пока пачка фиксируется в потоке БД, следующие единицы копятся в новую"""
+
+    def __init__(self, db, window: float):
+        self.db = db
+        self.window = window
+        self._batch = []
+        self.batches = 0
+        self.units = 0
+
+    def submit(self, writes):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((writes, future))
+        if len(self._batch) == 1:
+            loop.call_later(self.window, lambda: asyncio.ensure_future(self._flush()))
+        return future
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        try:
+            results = await self.db.run(commit_units, [writes for writes, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        self.batches += 1
+        self.units += len(batch)
+        for (_, future), error in zip(batch, results):
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+
+class Database:
+    """Асинхронный доступ к SQLite: все запросы выполняются в отдельном потоке БД.
+    observer(seconds, label) - необязательный сбор времени выполнения запросов;
+    group_commit_window > 0 - фиксации единиц работы разных апдейтов склеиваются за это окно (с)"""
+
+    def __init__(self, path: str, observer=None, group_commit_window: float = 0):
+        self.path = path
+        self.observer = observer
+        self.group_commit = GroupCommit(self, group_commit_window) if group_commit_window > 0 else None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+        self.applied_migrations = []
+        self.schema_version = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.path)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        self.applied_migrations = migrate(conn)
+        self.schema_version = schema_version(conn)
+        return conn
+
+    def open(self):
+        """Открытие соединения в потоке БД (синхронно, при старте)"""
+        self._conn = self._executor.submit(self._open).result()
+        return self
+
+    def run_sync(self, func, *args):
+        """Выполнение func(conn, *args) в потоке БД с ожиданием результата (вне event loop)"""
+        return self._executor.submit(func, self._conn, *args).result()
+
+    def _timed(self, func, conn, *args):
+        started = time.perf_counter()
+        try:
+            return func(conn, *args)
+        finally:
+            self.observer(time.perf_counter() - started, query_label(func, args))
+
+    async def run(self, func, *args):
+        """Выполнение func(conn, *args) в потоке БД"""
+        loop = asyncio.get_running_loop()
+        if self.observer is None:
+            return await loop.run_in_executor(self._executor, func, self._conn, *args)
+        return await loop.run_in_executor(self._executor, self._timed, func, self._conn, *args)
+
+    @staticmethod
+    def _execute(conn, sql, params):
+        cur = conn.execute(sql, params)
+        conn.commit()
+        return cur.lastrowid
+
+    @staticmethod
+    def _executemany(conn, sql, seq_of_params):
+        cur = conn.executemany(sql, seq_of_params)
+        conn.commit()
+        return cur.rowcount
+
+    @staticmethod
+    def _fetchone(conn, sql, params):
+        return conn.execute(sql, params).fetchone()
+
+    @staticmethod
+    def _fetchall(conn, sql, params):
+        return conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _transaction(conn, func, args):
+        with conn:
+            return func(conn, *args)
+
+    async def execute(self, sql: str, params=()):
+        """Изменяющий запрос с фиксацией; возвращает lastrowid"""
+        return await self.run(self._execute, sql, params)
+
+    async def executemany(self, sql: str, seq_of_params):
+        return await self.run(self._executemany, sql, list(seq_of_params))
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(self._fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(self._fetchall, sql, params)
+
+    async def fetchval(self, sql: str, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        return row[0] if row else default
+
+    async def transaction(self, func, *args):
+        """Выполнение func(conn, *args) в одной транзакции (commit/rollback)"""
+        return await self.run(self._transaction, func, args)
+
+    def unit_of_work(self):
+        return UnitOfWork(self)
+
+    def current_unit(self):
+        """Открытая единица работы текущей задачи; задачи, запущенные из обработчика, ее не наследуют"""
+        unit = _current_unit.get()
+        if unit is not None and unit.open and unit.db is self and unit.task is asyncio.current_task():
+            return unit
+        return None
+
+    async def write(self, func, *args):
+        """func(conn, *args) в транзакции текущей единицы работы при ее фиксации;
+        вне единицы работы - сразу отдельной транзакцией"""
+        unit = self.current_unit()
+        if unit is None:
+            await self.transaction(func, *args)
+            return
+        unit.writes.append((func, args))
+
+    def on_rollback(self, callback, *args):
+        """Откат состояния в памяти, если записи текущей единицы работы не будут зафиксированы"""
+        unit = self.current_unit()
+        if unit is not None:
+            unit.on_rollback(callback, *args)
+
+    async def flush(self):
+        """Фиксация записей текущей единицы работы до выхода из нее (см. UnitOfWork.flush)"""
+        unit = self.current_unit()
+        if unit is not None:
+            await unit.flush()
+
+    def abort(self):
+        """Откат записей текущей единицы работы при выходе из нее"""
+        unit = self.current_unit()
+        if unit is not None:
+            unit.abort()
+
+    async def commit_unit(self, writes):
+        if self.group_commit is not None:
+            await self.group_commit.submit(writes)
+            return
+        error = (await self.run(commit_units, [writes]))[0]
+        if error is not None:
+            raise error
+
+    def close_sync(self):
+        if self._conn is not None:
+            self._executor.submit(self._conn.close).result()
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    async def close(self):
+        if self._conn is not None:
+            await self.run(lambda conn: conn.close())
+            self._conn = None
+        self._executor.shutdown(wait=False)
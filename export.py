@@ -0,0 +1,78 @@
+import csv
+import gzip
+import json
+import os
+import sqlite3
+
+
+EXPORT_COLUMNS = ("phone", "chat_id", "user_id", "username", "first_name", "last_name",
+                  "registration_time", "status", "user_message_id", "report_message_id")
+EXPORT_FORMATS = ("csv", "jsonl")
+FETCH_SIZE = 500
+
+
+def _open_readonly(db_path, archive_path=None):
+    """Отдельное соединение только для чтения: в WAL не блокирует поток БД бота.
+    archive_path - файл архива retention.py, подключается как archive, если существует"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    if archive_path and os.path.exists(archive_path):
+        conn.execute("ATTACH DATABASE ? AS archive", (f"file:{archive_path}?mode=ro",))
+    conn.execute("PRAGMA query_only=1")
+    return conn
+
+
+def _has_archive(conn):
+    return conn.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone() is not None
+
+
+def iter_registrations(conn, start, end):
+    """Построчный обход регистраций за [start, end) курсором SQLite, без fetchall.
+    Порядок совпадает с idx_phone_messages_registration, поэтому сортировка в памяти не нужна.
+    С подключенным архивом - объединение с archive.phone_messages (UNION убирает строки,
+    оставшиеся в обоих файлах после сбоя переноса)"""
+    columns = ", ".join(EXPORT_COLUMNS)
+    where = "WHERE registration_time >= ? AND registration_time < ?"
+    if _has_archive(conn):
+        sql = f'''SELECT {columns} FROM main.phone_messages {where}
+                  UNION
+                  SELECT {columns} FROM archive.phone_messages {where}
+                  ORDER BY chat_id, registration_time'''
+        params = (start, end, start, end)
+    else:
+        sql = f'''SELECT {columns} FROM phone_messages {where}
+                  ORDER BY chat_id, registration_time'''
+        params = (start, end)
+    cursor = conn.execute(sql, params)
+    cursor.arraysize = FETCH_SIZE
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        yield from rows
+
+
+def write_export(db_path, path, fmt, start, end, compress=False, archive_path=None) -> int:
+    """Потоковая выгрузка в CSV/JSONL (опционально .gz); возвращает число строк. Выполняется в потоке.
+    archive_path - добавить строки, перенесенные в архив"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"неизвестный формат {fmt}")
+
+    conn = _open_readonly(db_path, archive_path)
+    try:
+        opener = gzip.open if compress else open
+        count = 0
+        with opener(path, "wt", encoding="utf-8", newline="") as f:
+            if fmt == "csv":
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_COLUMNS)
+                for row in iter_registrations(conn, start, end):
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in iter_registrations(conn, start, end):
+                    f.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+                    f.write("\n")
+                    count += 1
+        return count
+    finally:
+        conn.close()
@@ -0,0 +1,368 @@
+"""Локальная замена Telegram Bot API для нагрузочного тестирования.
+
+Бот подключается к нему через API_SERVER (или BOT_API_SERVER в окружении), например
+"http://127.0.0.1:8081". Реализованы getUpdates, sendMessage, editMessageText, deleteMessage,
+sendPhoto, answerCallbackQuery, а также getMe, getFile и выдача файлов - без них бот
+не запускается и не скачивает фото. Каждый ответ задерживается на latency + случайные
+0..jitter секунд, доля rate_429 запросов получает 429 Too Many Requests с retry_after.
+
+Отдельный запуск: python fake_api.py [--port 8081] [--latency-ms 30] [--jitter-ms 20] [--rate-429 0.01]
+Апдейты добавляются POST /_updates (Update или список), последние вызовы бота - GET /_sent.
+"""
+import argparse
+import asyncio
+import html
+import json
+import random
+import re
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+
+DEFAULT_TOKEN = "123456:LOADTEST"
+# без задержки и 429: служебные методы, не ограничиваемые Telegram по частоте
+SERVICE_METHODS = ("getUpdates", "getMe", "getFile")
+# бот может вызвать их при запуске и остановке; достаточно ответить true
+TRIVIAL_METHODS = ("deleteWebhook", "setWebhook", "setMyCommands", "close", "logOut")
+JSON_FIELDS = ("reply_markup", "reply_parameters", "allowed_updates", "entities", "caption_entities",
+               "link_preview_options")
+
+
+class ApiError(Exception):
+    def __init__(self, code, description, retry_after=None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+
+def _plain(params, field):
+    """Текст так, как его увидит клиент: без HTML-разметки при parse_mode=HTML"""
+    text = params[field]
+    if params.get("parse_mode", "").upper() == "HTML":
+        text = html.unescape(re.sub(r"<[^>]+>", "", text))
+    return text
+
+
+def _int(params, name, default=None):
+    value = params.get(name)
+    return default if value in (None, "") else int(value)
+
+
+class FakeBotApi:
+    """Состояние поддельного Bot API: очередь апдейтов, сообщения по чатам, файлы и журнал вызовов.
+
+    Для генератора нагрузки в том же процессе: user_message/callback_query создают апдейты,
+    expect(predicate) возвращает future, который завершится первым подходящим вызовом бота"""
+
+    def __init__(self, token=DEFAULT_TOKEN, latency=0.03, jitter=0.0, rate_429=0.0, retry_after=1, seed=None):
+        self.token = token
+        self.bot_id = int(token.split(":")[0])
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.updates = deque()
+        self.next_update_id = 1
+        self.messages = {}
+        self.files = {}
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.errors = Counter()
+        self.sent = deque(maxlen=1000)
+        self.polled = asyncio.Event()
+        self._has_updates = asyncio.Event()
+        self._last_message_id = {}
+        self._watchers = []
+
+    # --- апдейты от пользователей ---
+
+    def add_update(self, **payload):
+        update = {"update_id": self.next_update_id, **payload}
+        self.next_update_id += 1
+        self.updates.append(update)
+        self._has_updates.set()
+        return update
+
+    def _new_message(self, chat_id, sender, thread_id=None, reply_to=None, **content):
+        message_id = self._last_message_id.get(chat_id, 0) + 1
+        self._last_message_id[chat_id] = message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": sender,
+            **content,
+        }
+        if thread_id:
+            message["message_thread_id"] = thread_id
+            message["is_topic_message"] = True
+        if reply_to:
+            original = self.messages.get((chat_id, reply_to))
+            if original:
+                message["reply_to_message"] = {k: v for k, v in original.items() if k != "reply_to_message"}
+        self.messages[(chat_id, message_id)] = message
+        return message
+
+    def user_message(self, chat_id, user, text=None, photo=None, thread_id=None, reply_to=None):
+        """Сообщение пользователя в чат; photo - список PhotoSize из add_photo"""
+        content = {}
+        if text is not None:
+            content["text"] = text
+            if text.startswith("/"):
+                content["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if photo is not None:
+            content["photo"] = photo
+        message = self._new_message(chat_id, user, thread_id, reply_to, **content)
+        self.add_update(message=message)
+        return message
+
+    def callback_query(self, chat_id, message_id, user, data):
+        """Нажатие inline-кнопки под сообщением бота в его текущем виде"""
+        message = self.messages[(chat_id, message_id)]
+        query = {"id": str(self.next_update_id), "from": user, "chat_instance": str(chat_id),
+                 "message": message, "data": data}
+        self.add_update(callback_query=query)
+        return query
+
+    def add_photo(self, sizes):
+        """sizes - [(ширина, высота, bytes)] от меньшего к большему; возвращает список PhotoSize"""
+        photo = []
+        for width, height, data in sizes:
+            file_id = f"file{len(self.files) + 1}"
+            self.files[file_id] = data
+            photo.append({"file_id": file_id, "file_unique_id": f"u{file_id}", "width": width,
+                          "height": height, "file_size": len(data)})
+        return photo
+
+    # --- наблюдение за вызовами бота ---
+
+    def expect(self, predicate):
+        """Future с первым вызовом {method, params, result}, для которого predicate(call) истинно.
+        Регистрировать до отправки апдейта, иначе ответ бота можно пропустить"""
+        future = asyncio.get_running_loop().create_future()
+        self._watchers.append((predicate, future))
+        return future
+
+    def _notify(self, call):
+        self.sent.append(call)
+        remaining = []
+        for predicate, future in self._watchers:
+            if future.done():
+                continue
+            if predicate(call):
+                future.set_result(call)
+            else:
+                remaining.append((predicate, future))
+        self._watchers = remaining
+
+    # --- методы Bot API ---
+
+    def _bot_user(self):
+        return {"id": self.bot_id, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    def _get_message(self, params):
+        chat_id = _int(params, "chat_id")
+        message_id = _int(params, "message_id")
+        return self.messages.get((chat_id, message_id))
+
+    @staticmethod
+    def reply_to(params):
+        """id сообщения, на которое отвечает бот (reply_to_message_id или reply_parameters)"""
+        return _int(params, "reply_to_message_id") or (params.get("reply_parameters") or {}).get("message_id")
+
+    async def get_updates(self, params):
+        offset = _int(params, "offset")
+        if offset is not None:
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()
+        self.polled.set()
+        timeout = min(_int(params, "timeout", 0), 50)
+        if not self.updates and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)[:_int(params, "limit", 100)]
+
+    async def send_message(self, params):
+        content = {"text": _plain(params, "text")}
+        if params.get("reply_markup"):
+            content["reply_markup"] = params["reply_markup"]
+        return self._new_message(_int(params, "chat_id"), self._bot_user(), _int(params, "message_thread_id"),
+                                 self.reply_to(params), **content)
+
+    async def send_photo(self, params):
+        photo = params["photo"]
+        if not isinstance(photo, str):
+            photo = self.add_photo([(0, 0, photo)])[-1]["file_id"]
+        if photo not in self.files:
+            raise ApiError(400, "Bad Request: wrong file identifier/HTTP URL specified")
+        data = self.files[photo]
+        content = {"photo": [{"file_id": photo, "file_unique_id": f"u{photo}", "width": 0, "height": 0,
+                              "file_size": len(data)}]}
+        if params.get("caption"):
+            content["caption"] = _plain(params, "caption")
+        return self._new_message(_int(params, "chat_id"), self._bot_user(), _int(params, "message_thread_id"),
+                                 self.reply_to(params), **content)
+
+    async def edit_message_text(self, params):
+        message = self._get_message(params)
+        if message is None:
+            raise ApiError(400, "Bad Request: message to edit not found")
+        text = _plain(params, "text")
+        markup = params.get("reply_markup")
+        if message.get("text") == text and message.get("reply_markup") == markup:
+            raise ApiError(400, "Bad Request: message is not modified")
+        message["text"] = text
+        if markup:
+            message["reply_markup"] = markup
+        else:
+            message.pop("reply_markup", None)
+        message["edit_date"] = int(time.time())
+        return message
+
+    async def delete_message(self, params):
+        if self.messages.pop((_int(params, "chat_id"), _int(params, "message_id")), None) is None:
+            raise ApiError(400, "Bad Request: message to delete not found")
+        return True
+
+    async def answer_callback_query(self, params):
+        return True
+
+    async def get_me(self, params):
+        return {**self._bot_user(), "can_join_groups": True, "can_read_all_group_messages": True,
+                "supports_inline_queries": False}
+
+    async def get_file(self, params):
+        file_id = params["file_id"]
+        if file_id not in self.files:
+            raise ApiError(400, "Bad Request: invalid file_id")
+        return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(self.files[file_id]),
+                "file_path": f"photos/{file_id}.jpg"}
+
+    # --- HTTP ---
+
+    def handlers(self):
+        return {
+            "getUpdates": self.get_updates,
+            "sendMessage": self.send_message,
+            "sendPhoto": self.send_photo,
+            "editMessageText": self.edit_message_text,
+            "deleteMessage": self.delete_message,
+            "answerCallbackQuery": self.answer_callback_query,
+            "getMe": self.get_me,
+            "getFile": self.get_file,
+        }
+
+    async def _read_params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for name, value in (await request.post()).items():
+            if isinstance(value, web.FileField):
+                params[name] = value.file.read()
+            elif name in JSON_FIELDS:
+                params[name] = json.loads(value)
+            else:
+                params[name] = value
+        return params
+
+    async def handle_method(self, request):
+        if request.match_info["token"] != self.token:
+            return web.json_response({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        self.calls[method] += 1
+
+        if method in TRIVIAL_METHODS:
+            return web.json_response({"ok": True, "result": True})
+        handler = self.handlers().get(method)
+        if handler is None:
+            self.errors[method] += 1
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found: method not found"},
+                                     status=404)
+
+        if method not in SERVICE_METHODS:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+            if self.rng.random() < self.rate_429:
+                self.throttled[method] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+
+        try:
+            result = await handler(params)
+        except ApiError as e:
+            self.errors[method] += 1
+            return web.json_response({"ok": False, "error_code": e.code, "description": e.description}, status=e.code)
+        if method not in SERVICE_METHODS:
+            self._notify({"method": method, "params": params, "result": result, "at": time.perf_counter()})
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request):
+        file_id = request.match_info["path"].rsplit("/", 1)[-1].split(".", 1)[0]
+        if request.match_info["token"] != self.token or file_id not in self.files:
+            return web.Response(status=404)
+        return web.Response(body=self.files[file_id], content_type="image/jpeg")
+
+    async def handle_inject(self, request):
+        data = await request.json()
+        for update in data if isinstance(data, list) else [data]:
+            update.pop("update_id", None)
+            self.add_update(**update)
+        return web.json_response({"ok": True, "queued": len(self.updates)})
+
+    async def handle_sent(self, request):
+        limit = int(request.query.get("limit", 100))
+        calls = [{k: v for k, v in call.items() if k != "params"} for call in list(self.sent)[-limit:]]
+        return web.json_response({"calls": calls, "counts": self.calls, "throttled": self.throttled})
+
+    def app(self):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        app.router.add_post("/_updates", self.handle_inject)
+        app.router.add_get("/_sent", self.handle_sent)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8081):
+        """Запуск сервера в текущем event loop; возвращает runner для остановки"""
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--token", default=DEFAULT_TOKEN)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.token, args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_429, args.retry_after)
+    runner = await api.start(args.host, args.port)
+    print(f"Fake Bot API: http://{args.host}:{args.port}, токен {args.token}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
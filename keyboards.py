@@ -0,0 +1,36 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+# Разметка собирается напрямую, без InlineKeyboardBuilder: он проверяет и копирует кнопки
+# на каждой строке, а клавиатуры здесь фиксированные и строятся на каждое фото и нажатие
+
+
+def status_keyboard(message_id):
+    """Кнопки результата регистрации под сообщением с номером"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Встал", callback_data=f"status_ok_{message_id}"),
+            InlineKeyboardButton(text="❌ Не встал", callback_data=f"status_fail_{message_id}"),
+        ],
+        [InlineKeyboardButton(text="🔁 Повтор", callback_data=f"status_repeat_{message_id}")],
+    ])
+
+
+def registered_keyboard(phone):
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="📱 Запросить номер", callback_data="request_number"),
+        InlineKeyboardButton(text="🔴 Слёт", callback_data=f"slet_{phone}"),
+    ]])
+
+
+def request_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="📱 Запросить номер", callback_data="request_number"),
+    ]])
+
+
+def request_more_keyboard(count):
+    """Под ответом на /n N - повторить такой же пакет запросов одним нажатием"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=f"📱 Запросить ещё {count}", callback_data=f"request_number_{count}"),
+    ]])
@@ -0,0 +1,243 @@
+"""Нагрузочный тест бота против локального fake Bot API (fake_api.py).
+
+Создает БД с чатами дропов и офисов, запускает main.py с BOT_API_SERVER на поддельный API
+и прогоняет сценарии: /n в офисе -> номер в теме приемки -> фото с кодом ответом на
+"Новый номер" -> кнопка "Встал" -> кнопка "Слёт". Каждый этап считается завершенным,
+когда бот сделал соответствующий вызов API. Печатает пропускную способность и задержки
+этапов и всего сценария, число вызовов API и выданных 429.
+Код выхода 1 - бот не запустился или хотя бы один сценарий не завершился (регрессия).
+
+Запуск: python loadtest.py [--flows 300] [--drops 20] [--offices 2] [--concurrency 40]
+                           [--latency-ms 30] [--jitter-ms 20] [--rate-429 0.01] [--external]
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from db import Database
+from fake_api import DEFAULT_TOKEN, FakeBotApi
+
+
+DROPS_TOPIC = 10
+REPORTS_TOPIC = 11
+STAGES = ("request", "phone", "photo", "status", "slet")
+
+
+def seed(path, drops, offices):
+    """Чаты дропов -100100000-i и их офисы -100200000-i*100-n с темами приемки и отчетов"""
+    Database(path).open().close_sync()
+    topology = []
+    with sqlite3.connect(path) as conn:
+        for i in range(drops):
+            user_id = 500000 + i
+            drops_chat = -100100000 - i
+            office_chats = [-100200000 - i * 100 - n for n in range(offices)]
+            conn.execute('INSERT OR REPLACE INTO drops_chats (user_id, chat_id) VALUES (?, ?)', (user_id, drops_chat))
+            for topic_id, topic_name in ((DROPS_TOPIC, "drops"), (REPORTS_TOPIC, "reports")):
+                conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, ?, ?, 1)',
+                             (drops_chat, topic_id, topic_name))
+            for office_chat in office_chats:
+                conn.execute('INSERT OR IGNORE INTO office_chats (user_id, chat_id) VALUES (?, ?)', (user_id, office_chat))
+                conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, ?, ?, 1)',
+                             (office_chat, REPORTS_TOPIC, "reports"))
+            topology.append((drops_chat, office_chats))
+    return topology
+
+
+def make_photos(count):
+    """Синтетические скриншоты с кодом в размерах Telegram; без OpenCV - пустые jpeg-заглушки"""
+    try:
+        from bench_ocr import synth_corpus, telegram_sizes
+    except ImportError:
+        print("OpenCV недоступен, вместо скриншотов отправляются заглушки")
+        return [[(1080, 2340, b"\xff\xd8\xff\xd9")]]
+    return [[(size.width, size.height, size.data) for size in telegram_sizes(data)]
+            for _, data in synth_corpus(count)]
+
+
+def user(user_id, name):
+    return {"id": user_id, "is_bot": False, "first_name": name, "username": f"{name.lower()}{user_id}"}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Flow:
+    """Один номер от запроса до слёта; время этапов в секундах"""
+
+    def __init__(self, api, index, drops_chat, office_chat, photo, timeout):
+        self.api = api
+        self.index = index
+        self.drops_chat = drops_chat
+        self.office_chat = office_chat
+        self.photo = photo
+        self.timeout = timeout
+        self.phone = f"+79{index:09d}"
+        self.office_user = user(700000 + index, "Office")
+        self.drops_user = user(800000 + index, "Drop")
+        self.stages = {}
+        self.error = None
+
+    async def step(self, name, predicate, action):
+        """action() отправляет апдейт; этап длится до первого подходящего вызова бота"""
+        expected = self.api.expect(predicate)
+        started = time.perf_counter()
+        action()
+        try:
+            call = await asyncio.wait_for(expected, self.timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"этап {name}: нет ответа бота за {self.timeout} с")
+        self.stages[name] = call["at"] - started
+        return call
+
+    @staticmethod
+    def _chat(call):
+        return int(call["params"].get("chat_id", 0))
+
+    def _is_edit(self, call, chat_id, message_id, marker):
+        return (call["method"] == "editMessageText" and self._chat(call) == chat_id
+                and int(call["params"]["message_id"]) == message_id and marker in call["params"]["text"])
+
+    async def run(self):
+        api = self.api
+        holder = {}
+
+        def send_request():
+            holder["request"] = api.user_message(self.office_chat, self.office_user, text="/n")
+
+        await self.step("request", lambda c: (
+            c["method"] == "sendMessage" and self._chat(c) == self.office_chat
+            and api.reply_to(c["params"]) == holder["request"]["message_id"]), send_request)
+
+        # номер достается самому старому запросу чата дропов - офис может оказаться другим
+        call = await self.step("phone", lambda c: (
+            c["method"] == "sendMessage" and "Новый номер" in c["params"]["text"]
+            and self.phone in c["params"]["text"]),
+            lambda: api.user_message(self.drops_chat, self.drops_user, text=f"Номер {self.phone}",
+                                     thread_id=DROPS_TOPIC))
+        office_chat = self._chat(call)
+        number_message_id = call["result"]["message_id"]
+
+        await self.step("photo", lambda c: self._is_edit(c, office_chat, number_message_id, "Код отправлен"),
+                        lambda: api.user_message(office_chat, self.office_user, photo=api.add_photo(self.photo),
+                                                 reply_to=number_message_id))
+
+        await self.step("status", lambda c: self._is_edit(c, office_chat, number_message_id, "Зарегистрирован"),
+                        lambda: api.callback_query(office_chat, number_message_id, self.office_user,
+                                                   f"status_ok_{number_message_id}"))
+
+        await self.step("slet", lambda c: self._is_edit(c, office_chat, number_message_id, "Слетел"),
+                        lambda: api.callback_query(office_chat, number_message_id, self.office_user,
+                                                   f"slet_{self.phone}"))
+
+
+def start_bot(args, db_path):
+    env = dict(os.environ, BOT_DB=db_path, BOT_TOKEN=args.token,
+               BOT_API_SERVER=f"http://{args.host}:{args.port}")
+    return asyncio.create_subprocess_exec(sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                                          env=env, stdout=None if args.bot_output else asyncio.subprocess.DEVNULL,
+                                          stderr=None if args.bot_output else asyncio.subprocess.DEVNULL)
+
+
+def print_report(flows, elapsed, api, updates):
+    done = [flow for flow in flows if flow.error is None]
+    failed = [flow for flow in flows if flow.error is not None]
+    print(f"\nСценариев: {len(flows)}, завершено {len(done)}, с ошибкой {len(failed)} за {elapsed:.1f} с")
+    print(f"Пропускная способность: {len(done) / elapsed:.2f} сценариев/с, {updates / elapsed:.1f} апдейтов/с")
+
+    print(f"\n{'этап':<10} {'ср., мс':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'макс.':>9}")
+    rows = [(stage, [flow.stages[stage] for flow in done]) for stage in STAGES]
+    rows.append(("сценарий", [sum(flow.stages.values()) for flow in done]))
+    for name, values in rows:
+        if values:
+            print(f"{name:<10} {statistics.mean(values) * 1000:9.1f} {percentile(values, 0.5) * 1000:9.1f} "
+                  f"{percentile(values, 0.95) * 1000:9.1f} {percentile(values, 0.99) * 1000:9.1f} "
+                  f"{max(values) * 1000:9.1f}")
+
+    print("\nВызовы Bot API (всего / 429 / ошибок):")
+    for method, count in api.calls.most_common():
+        print(f"  {method}: {count} / {api.throttled.get(method, 0)} / {api.errors.get(method, 0)}")
+    for flow in failed[:10]:
+        print(f"Сценарий {flow.index} ({flow.phone}): {flow.error}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=int, default=300, help="сценариев (номеров)")
+    parser.add_argument("--drops", type=int, default=20, help="чатов дропов")
+    parser.add_argument("--offices", type=int, default=2, help="офисов на чат дропов")
+    parser.add_argument("--concurrency", type=int, default=40, help="одновременных сценариев")
+    parser.add_argument("--photos", type=int, default=20, help="разных скриншотов (повторы попадают в кэш OCR)")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60, help="ожидание ответа бота на этап, с")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--token", default=DEFAULT_TOKEN)
+    parser.add_argument("--db", help="БД бота (по умолчанию временная)")
+    parser.add_argument("--external", action="store_true",
+                        help="бот уже запущен с BOT_API_SERVER, BOT_TOKEN и БД --db, засеянной этим скриптом")
+    parser.add_argument("--bot-output", action="store_true", help="показывать вывод бота")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="loadtest_"), "bot_db.sqlite")
+    topology = seed(db_path, args.drops, args.offices)
+    photos = make_photos(args.photos)
+    print(f"БД {db_path}: чатов дропов {args.drops}, офисов {args.drops * args.offices}, скриншотов {len(photos)}")
+
+    api = FakeBotApi(args.token, args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_429, args.retry_after, seed=1)
+    runner = await api.start(args.host, args.port)
+    bot_process = None if args.external else await start_bot(args, db_path)
+    try:
+        try:
+            await asyncio.wait_for(api.polled.wait(), 60)
+        except asyncio.TimeoutError:
+            print("Бот не начал получать апдейты за 60 с")
+            return False
+
+        rng = random.Random(1)
+        flows = []
+        for index in range(args.flows):
+            drops_chat, office_chats = rng.choice(topology)
+            flows.append(Flow(api, index, drops_chat, rng.choice(office_chats), photos[index % len(photos)],
+                              args.timeout))
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def run(flow):
+            async with slots:
+                try:
+                    await flow.run()
+                except Exception as e:
+                    flow.error = str(e)
+
+        print(f"Сценариев: {args.flows}, одновременно {args.concurrency}, задержка API {args.latency_ms:.0f}"
+              f"+{args.jitter_ms:.0f} мс, 429: {args.rate_429:.1%}")
+        started = time.perf_counter()
+        await asyncio.gather(*(run(flow) for flow in flows))
+        elapsed = time.perf_counter() - started
+        print_report(flows, elapsed, api, api.next_update_id - 1)
+        return not any(flow.error for flow in flows)
+    finally:
+        if bot_process is not None and bot_process.returncode is None:
+            bot_process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot_process.wait(), 30)
+            except asyncio.TimeoutError:
+                bot_process.kill()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    if not asyncio.run(main()):
+        sys.exit(1)
@@ -0,0 +1,31 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLock:
+    """asyncio.Lock на ключ (чат дропов): один ключ - строго по очереди, разные - параллельно.
+    Запись удаляется, когда ключ никто не держит и не ждет, поэтому словарь не растет"""
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def locked(self, key) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    def __len__(self):
+        return len(self._locks)
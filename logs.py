@@ -0,0 +1,115 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# поля контекста апдейта, которые попадают в JSON-строку, если заданы
+CONTEXT_FIELDS = ("chat_id", "handler", "update_type", "latency_ms")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+
+
+def bind(**fields):
+    """Добавляет поля к записям текущей задачи (апдейта); возвращает токен для unbind"""
+    return _context.set({**_context.get(), **fields})
+
+
+def unbind(token):
+    _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля контекста апдейта в запись; выполняется в потоке, где вызван логгер"""
+
+    def filter(self, record):
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """В event loop только подставляет аргументы в сообщение; трассировка исключения
+    форматируется и пишется в поток слушателя"""
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON Lines: время, уровень, логгер, сообщение, поля контекста апдейта и трассировка"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _output_handler(json_lines, path):
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def setup_logging(level="INFO", json_lines=False, path="", library_level="WARNING"):
+    """Корневой логгер пишет в очередь, вывод - в фоновом потоке QueueListener.
+    library_level - уровень для aiogram/aiohttp (aiogram.event пишет строку на каждый апдейт)"""
+    global _listener
+    stop_logging()
+    output = _output_handler(json_lines, path)
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    for name in ("aiogram", "aiohttp", "asyncio"):
+        logging.getLogger(name).setLevel(library_level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+    def direct_output_in_child():
+        # процессы пула OCR создаются fork'ом без потока слушателя - пишут напрямую
+        global _listener
+        _listener = None
+        root.handlers = [output]
+
+    os.register_at_fork(after_in_child=direct_output_in_child)
+    return _listener
+
+
+def stop_logging():
+    """Дописывает очередь и останавливает поток слушателя; повторный вызов ничего не делает"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(stop_logging)
@@ -1,307 +1,310 @@
+import logging
 import os
 import re
 import sqlite3
 from datetime import datetime, timedelta
 import pytz
 from aiogram import Bot, Dispatcher, F, Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.types import Message, InlineKeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, InlineKeyboardMarkup
-import cv2
-import pytesseract
-from PIL import Image
-from typing import Union
-import traceback
-from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import Message, InlineKeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, InlineKeyboardMarkup, FSInputFile
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 import signal
 import sys
 import asyncio
-
+import tempfile
+import time
+from db import Database
+from routing import ChatTopology
+from pending import PendingRequests
+from phones import extract_phones
+from retention import archive_path_for, report_line, run_retention
+from reports import bump_daily_stat, chunk_lines, daily_report_lines, load_day_registrations, load_day_stats, sum_stats, unbump_daily_stat
+from export import EXPORT_FORMATS, write_export
+from locks import KeyedLock
+from logs import setup_logging, stop_logging
+from keyboards import registered_keyboard, request_keyboard, request_more_keyboard, status_keyboard
+from ocr import OcrCache, OcrPool, choose_config, is_code, select_photo
+from metrics import DB_QUERY_SECONDS, REGISTRY, RETENTION_RECLAIMED_BYTES, RETENTION_ROWS, Gauge, start_metrics_server, summary_lines
+from middlewares import ApiMetricsMiddleware, HandlerMetricsMiddleware, ProfilingMiddleware, UnitOfWorkMiddleware
+from profiling import StackSampler
+from sharding import ChatOrderedRunner, ShardRouter, consume_shard, poll_updates, serve_webhook, start_workers, stop_workers
+from sender import GLOBAL_RATE, OutboundDispatcher, PRIORITY_COUNTER, PRIORITY_NAMES, PRIORITY_NORMAL, PRIORITY_REPORT
+
+
+logger = logging.getLogger("bot")
 
 is_shutting_down = False
+# процесс-шард: апдейты приходят через feed_raw_update, возвращенный обработчиком метод не отправляется
+is_shard_worker = False
 
 async def shutdown(dispatcher: Dispatcher, bot: Bot):
     """Корректное завершение работы бота"""
     global is_shutting_down
     is_shutting_down = True
     
-    print("\nПолучен сигнал на завершение работы...")
+    logger.info("Получен сигнал на завершение работы...")
     
     
     try:
-        if 'conn' in globals() and conn:
-            conn.close()
-            print("Соединение с базой данных закрыто")
+        await db.close()
+        logger.info("Соединение с базой данных закрыто")
     except Exception as e:
-        print(f"Ошибка при закрытии базы данных: {e}")
+        logger.error("Ошибка при закрытии базы данных: %s", e)
     
     
     try:
         tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
         [task.cancel() for task in tasks]
-        print(f"Отменено {len(tasks)} задач")
+        logger.info("Отменено %d задач", len(tasks))
         await asyncio.gather(*tasks, return_exceptions=True)
     except Exception as e:
-        print(f"Ошибка при отмене задач: {e}")
+        logger.error("Ошибка при отмене задач: %s", e)
+    
     
+    ocr_pool.shutdown()
     
     try:
         await bot.session.close()
-        print("Сессия бота закрыта")
+        logger.info("Сессия бота закрыта")
     except Exception as e:
-        print(f"Ошибка при закрытии сессии бота: {e}")
+        logger.error("Ошибка при закрытии сессии бота: %s", e)
     
-    print("Бот успешно завершил работу")
+    logger.info("Бот успешно завершил работу")
 
 def handle_sigint(signum, frame):
     """Обработчик сигнала SIGINT (Ctrl+C)"""
     if sys.platform == 'win32':
-        print("\nПолучен сигнал на завершение работы (Ctrl+C)...")
+        logger.info("Получен сигнал на завершение работы (Ctrl+C)...")
         sys.exit(0)
 
 async def safe_send_message(chat_id, text, **kwargs):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            return await bot.send_message(chat_id, text, **kwargs)
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after)
+            return await outbound.send_message(chat_id, text, **kwargs)
         except Exception as e:
             if attempt == max_retries - 1:
                 raise
             await asyncio.sleep(1 + attempt)
 
-def init_db():
-    conn = sqlite3.connect('bot_db.sqlite')
-    cursor = conn.cursor()
-
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS office_chats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    chat_id INTEGER,
-                    UNIQUE(user_id, chat_id))''')
+# BOT_DB, BOT_TOKEN и BOT_API_SERVER в окружении переопределяют настройки (нагрузочный тест loadtest.py)
+DB_NAME = os.environ.get("BOT_DB", "bot_db.sqlite")
+# Записи апдейта фиксируются одной транзакцией; >0 - фиксации параллельных апдейтов склеиваются за столько мс
+DB_GROUP_COMMIT_MS = 0
 
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS drops_chats (
-                    user_id INTEGER PRIMARY KEY,
-                    chat_id INTEGER)''')
-
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS number_topics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    topic_id INTEGER,
-                    topic_name TEXT,
-                    is_active BOOLEAN DEFAULT 1)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS number_requests (
-                drops_chat INTEGER PRIMARY KEY,
-                required INTEGER DEFAULT 0,
-                fulfilled INTEGER DEFAULT 0)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS num_requests (
-                request_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                office_chat_id INTEGER,
-                drops_chat_id INTEGER,
-                request_message_id INTEGER,
-                status TEXT DEFAULT 'pending')''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS last_messages (
-                    chat_id INTEGER PRIMARY KEY,
-                    message_id INTEGER)''')
-
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS phone_messages (
-                phone TEXT PRIMARY KEY,
-                user_message_id INTEGER,
-                confirmation_message_id INTEGER,
-                chat_id INTEGER,
-                user_id INTEGER,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                registration_time TEXT,
-                report_message_id INTEGER,
-                status TEXT)''')
-
-    
-    for column in ['registration_time', 'report_message_id', 'status']:
-        try:
-            cursor.execute(f'ALTER TABLE phone_messages ADD COLUMN {column} {("TEXT" if column in ["registration_time", "status"] else "INTEGER")}')
-        except sqlite3.OperationalError:
-            pass
-
-    conn.commit()
-    return conn
-
-conn = init_db()
-cursor = conn.cursor()
+db = Database(DB_NAME, observer=DB_QUERY_SECONDS.observe, group_commit_window=DB_GROUP_COMMIT_MS / 1000).open()
+topology = ChatTopology().load(db)
+pending = PendingRequests(db).load()
 
 ALLOWED_USERS = []  
 
-BOT_TOKEN = ""  
-
-REPORT_USER_ID = 0  
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "")  
+
+# Адрес локального Bot API (fake_api.py, telegram-bot-api); пусто - api.telegram.org
+API_SERVER = os.environ.get("BOT_API_SERVER", "")
+
+# получатель ежедневного отчета
+REPORT_USER_ID = 7037364839
+
+# "polling" или "webhook"
+RUN_MODE = "polling"
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+# Публичный адрес (https://example.com) для setWebhook; пусто - вебхук регистрируется вручную
+WEBHOOK_URL = ""
+WEBHOOK_SECRET = ""
+
+# >1: процесс приема раздает апдейты по SHARDS процессам-обработчикам по chat_id
+# (офисные чаты - на шард своего чата дропов); 1 - все в одном процессе
+SHARDS = 1
+SHARD_TOPOLOGY_REFRESH = 10
+
+# Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics (шард N - порт METRICS_PORT + 1 + N); 0 - выключено
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9101
+
+# Профилирование включается /profile on или SIGUSR1 (повторный SIGUSR1 - выключить с выгрузкой, SIGUSR2 - выгрузка)
+PROFILE_SAMPLE_RATE = 0.1
+PROFILE_INTERVAL = 0.005
+PROFILE_TRACE_MEMORY = True
+PROFILE_DIR = "profiles"
+
+# Логи пишутся из очереди фоновым потоком. DEBUG - построчная трассировка обработчиков (в INFO не форматируется);
+# LOG_JSON - JSON Lines с полями chat_id, handler, latency_ms; LOG_FILE пусто - stderr
+LOG_LEVEL = "INFO"
+LOG_JSON = False
+LOG_FILE = ""
+
+COUNTER_DEBOUNCE = 1.0
+# /n N и кнопка «Запросить ещё N»: не больше стольких запросов за раз
+MAX_BULK_REQUESTS = 50
+
+# Строки num_requests (кроме ожидающих) и phone_messages старше RETENTION_DAYS суток раз в RETENTION_INTERVAL с
+# переносятся в ARCHIVE_DB пачками по RETENTION_BATCH; 0 - выключено
+RETENTION_DAYS = 30
+RETENTION_INTERVAL = 6 * 60 * 60
+RETENTION_BATCH = 500
+ARCHIVE_DB = archive_path_for(DB_NAME)
+
+OCR_WORKERS = 2
+OCR_MAX_PENDING = 8
+OCR_CACHE_SIZE = 2000
+OCR_CACHE_TTL = 24 * 60 * 60
+OCR_CACHE_PERSIST = True
+OCR_PROFILE = "ocr_profile.json"
+OCR_TARGET_ACCURACY = 0.97
+
+setup_logging(LOG_LEVEL, LOG_JSON, LOG_FILE)
 
 router = Router()
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN,
+          session=AiohttpSession(api=TelegramAPIServer.from_base(API_SERVER)) if API_SERVER else None)
+# лимит Bot API общий для бота - делится между шардами
+outbound = OutboundDispatcher(bot, global_rate=GLOBAL_RATE / SHARDS)
+ocr_pool = OcrPool(OCR_WORKERS, OCR_MAX_PENDING,
+                   cache=OcrCache(OCR_CACHE_SIZE, OCR_CACHE_TTL, db if OCR_CACHE_PERSIST else None).load(),
+                   config=choose_config(OCR_PROFILE, OCR_TARGET_ACCURACY))
+profiler = StackSampler()
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
+router.message.middleware(ProfilingMiddleware(profiler))
+router.callback_query.middleware(ProfilingMiddleware(profiler))
+router.message.middleware(UnitOfWorkMiddleware(db))
+router.callback_query.middleware(UnitOfWorkMiddleware(db))
+bot.session.middleware(ApiMetricsMiddleware())
+REGISTRY.register(Gauge("bot_outbound_queue", "Запросы в очереди исходящих по приоритетам", ("priority",),
+                        collect=lambda: {(PRIORITY_NAMES[p],): n for p, n in outbound.queue_depth().items()}))
+REGISTRY.register(Gauge("bot_pending_requests", "Ожидающие запросы номеров по чатам дропов", ("drops_chat",),
+                        collect=lambda: {(chat,): pending.count(chat) for chat in topology.drops_chats()}))
 number_processing_enabled = True
 pending_numbers = {}
 accepted_numbers = {}
 
+async def respond(method):
+    """Последний ответ обработчика. В режиме webhook метод возвращается телом ответа на апдейт
+    (без отдельного запроса к API), в режиме polling и в шардах уходит через очередь исходящих"""
+    if RUN_MODE == "webhook" and not is_shard_worker:
+        return method
+    if isinstance(method, AnswerCallbackQuery):
+        await bot(method)
+    else:
+        await outbound(method)
+
 class Form(StatesGroup):
     wait_for_chat_ids = State()
 
-def get_user_data(user_id):
+async def get_user_data(user_id):
     
-    cursor.execute('SELECT chat_id FROM office_chats WHERE user_id = ?', (user_id,))
-    office_chats = [row[0] for row in cursor.fetchall()]
+    rows = await db.fetchall('SELECT chat_id FROM office_chats WHERE user_id = ?', (user_id,))
+    office_chats = [row[0] for row in rows]
     
     
-    cursor.execute('SELECT chat_id FROM drops_chats WHERE user_id = ?', (user_id,))
-    drops_chat = cursor.fetchone()
-    drops_chat = drops_chat[0] if drops_chat else None
+    drops_chat = await db.fetchval('SELECT chat_id FROM drops_chats WHERE user_id = ?', (user_id,))
     
     return office_chats, drops_chat
 
-def save_user_data(user_id, chat_ids):
+def _save_user_data(conn, user_id, chat_ids):
     
     drops_chat = chat_ids[-1]
     office_chats = chat_ids[:-1]
     
     
-    cursor.execute('DELETE FROM office_chats WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM drops_chats WHERE user_id = ?', (user_id,))
-    
+    conn.execute('DELETE FROM office_chats WHERE user_id = ?', (user_id,))
+    conn.execute('DELETE FROM drops_chats WHERE user_id = ?', (user_id,))
     
-    for chat_id in office_chats:
-        cursor.execute('INSERT INTO office_chats (user_id, chat_id) VALUES (?, ?)',
-                      (user_id, chat_id))
     
+    conn.executemany('INSERT INTO office_chats (user_id, chat_id) VALUES (?, ?)',
+                     [(user_id, chat_id) for chat_id in office_chats])
     
-    cursor.execute('INSERT INTO drops_chats (user_id, chat_id) VALUES (?, ?)',
-                  (user_id, drops_chat))
     
-    conn.commit()
+    conn.execute('INSERT INTO drops_chats (user_id, chat_id) VALUES (?, ?)',
+                 (user_id, drops_chat))
+
+async def save_user_data(user_id, chat_ids):
+    await db.transaction(_save_user_data, user_id, chat_ids)
+    await topology.reload(db)
 
 def is_office_chat(chat_id):
-    cursor.execute('SELECT COUNT(*) FROM office_chats WHERE chat_id = ?', (chat_id,))
-    return cursor.fetchone()[0] > 0
+    return topology.is_office_chat(chat_id)
 
 def is_drops_chat(chat_id):
-    cursor.execute('SELECT COUNT(*) FROM drops_chats WHERE chat_id = ?', (chat_id,))
-    return cursor.fetchone()[0] > 0
+    return topology.is_drops_chat(chat_id)
 
 def get_drops_chat_for_office(office_chat_id):
-    cursor.execute('''SELECT dc.chat_id 
-                    FROM drops_chats dc
-                    JOIN office_chats oc ON dc.user_id = oc.user_id
-                    WHERE oc.chat_id = ?''', (office_chat_id,))
-    result = cursor.fetchone()
-    return result[0] if result else None
+    return topology.get_drops_chat_for_office(office_chat_id)
 
 def get_office_chats_for_drops(drops_chat_id):
-    cursor.execute('''SELECT oc.chat_id 
-                    FROM office_chats oc
-                    JOIN drops_chats dc ON oc.user_id = dc.user_id
-                    WHERE dc.chat_id = ?''', (drops_chat_id,))
-    return [row[0] for row in cursor.fetchall()]
-
-def extract_phone(text: str) -> Union[str, None]:
-    phone = re.findall(r'(?:\+7|7|8)?[\s\-]?\(?[0-9]{3}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}', text)
-    if not phone:
-        return None
-    
-    phone = phone[0].replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-    
-    if phone.startswith('+7'):
-        return phone
-    elif phone.startswith('7'):
-        return f'+7{phone[1:]}'
-    elif phone.startswith('8'):
-        return f'+7{phone[1:]}'
-    else:
-        return f'+7{phone}' if len(phone) == 10 else None
+    return topology.get_office_chats_for_drops(drops_chat_id)
+
+def get_topic(chat_id, topic_name):
+    return topology.get_topic(chat_id, topic_name)
 
 def get_settings(chat_id):
-    cursor.execute('SELECT topic_id FROM number_topics WHERE chat_id = ? AND topic_name = "reports" AND is_active = 1', (chat_id,))
-    reports_topic = cursor.fetchone()
-    return reports_topic[0] if reports_topic else None
+    return get_topic(chat_id, "reports")
+
+def _replace_topic(conn, chat_id, topic_name, topic_id):
+    conn.execute('DELETE FROM number_topics WHERE chat_id = ? AND topic_name = ?', (chat_id, topic_name))
+    conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, ?, ?, 1)',
+                 (chat_id, topic_id, topic_name))
 
-def save_settings(chat_id, reports_topic=None):
+async def set_topic(chat_id, topic_name, topic_id):
+    await db.transaction(_replace_topic, chat_id, topic_name, topic_id)
+    await topology.reload(db)
+
+def _save_settings(conn, chat_id, reports_topic):
+    conn.execute('UPDATE number_topics SET is_active = 0 WHERE chat_id = ? AND topic_name = "reports"', (chat_id,))
+    conn.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, ?, ?, 1)',
+                 (chat_id, reports_topic, "reports"))
+
+async def save_settings(chat_id, reports_topic=None):
     if reports_topic is not None:
-        cursor.execute('UPDATE number_topics SET is_active = 0 WHERE chat_id = ? AND topic_name = "reports"', (chat_id,))
-        cursor.execute('INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) VALUES (?, ?, ?, 1)',
-                      (chat_id, reports_topic, "reports"))
-    conn.commit()
-
-def preprocess_image(image_path: str) -> str:
-    img = cv2.imread(image_path)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    img_resized = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-    _, binary = cv2.threshold(img_resized, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-    processed_path = f"processed_{image_path}"
-    cv2.imwrite(processed_path, binary)
-    return processed_path
-
-def recognize_code(image_path: str) -> str:
-    try:
-        processed_path = preprocess_image(image_path)
-        img = Image.open(processed_path)
-        custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
-        text = pytesseract.image_to_string(img, config=custom_config).strip().upper()
-        match = re.search(r'([A-Z0-9]{4})[-\s]*([A-Z0-9]{4})', text)
-        if match:
-            return f"{match.group(1)}-{match.group(2)}"
-        return "Код не распознан"
-    except Exception as e:
-        print(f"Ошибка распознавания: {e}")
-        return "Ошибка распознавания"
-    finally:
-        for f in [image_path, processed_path]:
-            if os.path.exists(f):
-                os.remove(f)
+        await db.transaction(_save_settings, chat_id, reports_topic)
+        await topology.reload(db)
 
 @router.message(Command("resetdb"))
 async def cmd_resetdb(message: Message, state: FSMContext):
-    print(f"Received /resetdb from user {message.from_user.id} in chat {message.chat.id}")
+    logger.debug("Received /resetdb from user %s in chat %s", message.from_user.id, message.chat.id)
     try:
         if message.chat.type != 'private':
-            await message.answer("❌ Команда доступна только в личных сообщениях.")
-            return
+            return await respond(message.answer("❌ Команда доступна только в личных сообщениях."))
         if message.from_user.id not in ALLOWED_USERS:
-            await message.answer("❌ У вас нет прав для выполнения этой команды.")
-            return
+            return await respond(message.answer("❌ У вас нет прав для выполнения этой команды."))
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Да", callback_data="resetdb_confirm"),
              InlineKeyboardButton(text="Нет", callback_data="resetdb_cancel")]
         ])
-        await message.answer("⚠️ Вы уверены, что хотите очистить базу данных и перезапустить бота?", reply_markup=keyboard)
+        await outbound(message.answer("⚠️ Вы уверены, что хотите очистить базу данных и перезапустить бота?", reply_markup=keyboard))
     except Exception as e:
-        print(f"Error in /resetdb: {e}")
+        logger.error("Error in /resetdb: %s", e)
 
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     if message.chat.type == 'private':
         if message.from_user.id in ALLOWED_USERS:
-            await message.answer(
+            await outbound(message.answer(
                 "👋 Добро пожаловать! Для настройки:\n"
                 "1. Узнайте ID чатов через @username_to_id_bot\n"
                 "2. Введите ID офисных чатов и ID дроп-чата через запятую\n"
                 "Формат: <code>ID_офис1, ID_офис2, ..., ID_дропы</code>\n\n"
                 "Пример:\n<code>-100111, -100222, -100333, -100444</code>",
                 parse_mode="HTML"
-            )
+            ))
             await state.set_state(Form.wait_for_chat_ids)
         else:
-            await message.answer(
+            await outbound(message.answer(
                 "🔒 Это приватный бот\n\n"
                 "❌ Сторонние пользователи не могут использовать данного бота.\n\n",
                 parse_mode="HTML"
-            )
+            ))
     elif message.chat.type in ['group', 'supergroup']:
         user_id = message.from_user.id
         member = await bot.get_chat_member(message.chat.id, user_id)
@@ -309,24 +312,192 @@ async def cmd_start(message: Message, state: FSMContext):
         is_allowed = user_id in ALLOWED_USERS
 
         if not (is_admin or is_allowed):
-            await message.answer("❌ Только администраторы могут использовать эту команду!")
-            return
+            return await respond(message.answer("❌ Только администраторы могут использовать эту команду!"))
 
         number_processing_enabled = True
-        await message.answer(
+        await outbound(message.answer(
             "👋 Welcome to the mediator bot!\n\n"
             "This bot helps manage phone numbers and codes between office and drops groups.\n"
             "To configure the bot, use the /settings command (admins and allowed users only)."
-        )
+        ))
 
 @router.message(Command("stop"))
 async def cmd_stop(message: Message):
     global number_processing_enabled
     if message.from_user.id not in ALLOWED_USERS:
-        await message.answer("Только разрешенные пользователи могут использовать эту команду.")
-        return
+        return await respond(message.answer("Только разрешенные пользователи могут использовать эту команду."))
     number_processing_enabled = False
-    await message.answer("Прием номеров остановлен. Используйте /start для возобновления.")
+    return await respond(message.answer("Прием номеров остановлен. Используйте /start для возобновления."))
+
+def outbound_stats_text():
+    depth = outbound.queue_depth()
+    waits = outbound.wait_stats()
+    lines = ["<b>Исходящая очередь Bot API</b>",
+             f"Отправлено: {outbound.stats['sent']}, ошибок: {outbound.stats['errors']}, "
+             f"429: {outbound.stats['retry_after']} (пауза {outbound.stats['paused_seconds']:.0f} с)"]
+    for priority, name in PRIORITY_NAMES.items():
+        line = f"{name}: в очереди {depth[priority]}"
+        if priority in waits:
+            avg, p95, worst = waits[priority]
+            line += f", ожидание ср. {avg * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс, макс. {worst * 1000:.0f} мс"
+        lines.append(line)
+    return "\n".join(lines)
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ALLOWED_USERS:
+        return await respond(message.answer("❌ Только разрешенные пользователи могут использовать эту команду!"))
+    counter_stats = counter_updater.stats
+    registered, failed, slet = sum_stats(await db.run(load_day_stats, moscow_today()))
+    await outbound(message.answer(
+        "📊 <b>Статистика</b>\n\n"
+        "<b>Сегодня</b>\n"
+        f"Встало: {registered}, не встало: {failed}, слётов: {slet}\n\n"
+        "<b>Счетчик «Требуется номеров»</b>\n"
+        f"Событий: {counter_stats['events']}\n"
+        f"Правок: {counter_stats['edits']}, новых сообщений: {counter_stats['sends']}, "
+        f"пропущено без изменений: {counter_stats['skipped']}\n"
+        f"Сэкономлено запросов к API: {counter_updater.calls_saved} из {counter_stats['legacy_calls']}\n\n"
+        f"{outbound_stats_text()}\n\n"
+        "<b>Кэш OCR</b>\n"
+        f"Записей: {len(ocr_pool.cache)}, попаданий: {ocr_pool.cache.hits}, промахов: {ocr_pool.cache.misses}",
+        parse_mode="HTML"
+    ))
+
+def parse_export_args(args):
+    """/export [с] [по] [csv|jsonl] [gz]; даты ГГГГ-ММ-ДД или ДД.ММ.ГГГГ, по умолчанию сегодня"""
+    dates = []
+    fmt = "csv"
+    compress = False
+    for arg in args:
+        arg = arg.lower()
+        if arg in EXPORT_FORMATS:
+            fmt = arg
+        elif arg in ("gz", "gzip"):
+            compress = True
+        else:
+            for pattern in ('%Y-%m-%d', '%d.%m.%Y'):
+                try:
+                    dates.append(datetime.strptime(arg, pattern).date())
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"не понят аргумент «{arg}»")
+    if not dates:
+        dates = [datetime.now(pytz.timezone('Europe/Moscow')).date()]
+    return dates[0], dates[-1], fmt, compress
+
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    if message.from_user.id not in ALLOWED_USERS:
+        return await respond(message.answer("❌ Только разрешенные пользователи могут использовать эту команду!"))
+    try:
+        date_from, date_to, fmt, compress = parse_export_args(message.text.split()[1:])
+    except ValueError as e:
+        await outbound(message.answer(
+            f"❌ {e}\n\nФормат: <code>/export [с] [по] [csv|jsonl] [gz]</code>\n"
+            "Пример: <code>/export 01.10.2026 31.10.2026 jsonl gz</code>",
+            parse_mode="HTML"
+        ))
+        return
+
+    filename = f"registrations_{date_from}_{date_to}.{fmt}" + (".gz" if compress else "")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, filename)
+        try:
+            started = time.perf_counter()
+            count = await asyncio.get_running_loop().run_in_executor(
+                None, write_export, DB_NAME, path, fmt,
+                date_from.strftime('%Y-%m-%d 00:00:00'),
+                (date_to + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00'),
+                compress, ARCHIVE_DB
+            )
+            size = os.path.getsize(path)
+            logger.info("Выгрузка %s: %d строк, %d байт за %.2f с", filename, count, size, time.perf_counter() - started)
+            if size > 50 * 1024 * 1024:
+                return await respond(message.answer("❌ Файл больше 50 МБ - сократите период или включите gz"))
+            await outbound.send_document(
+                message.chat.id,
+                FSInputFile(path, filename=filename),
+                caption=f"📄 Регистрации {date_from.strftime('%d.%m.%Y')} - {date_to.strftime('%d.%m.%Y')}: {count}"
+            )
+        except Exception as e:
+            logger.exception("Ошибка выгрузки")
+            await outbound(message.answer(f"❌ Ошибка выгрузки: {e}"))
+
+@router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    if message.from_user.id not in ALLOWED_USERS:
+        return await respond(message.answer("❌ Только разрешенные пользователи могут использовать эту команду!"))
+    for chunk in chunk_lines(["📈 Метрики процесса", ""] + summary_lines()):
+        await outbound(message.answer(chunk))
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """/profile [on [доля] | off | dump] - сэмплирование обработчиков без перезапуска"""
+    if message.from_user.id not in ALLOWED_USERS:
+        return await respond(message.answer("❌ Только разрешенные пользователи могут использовать эту команду!"))
+    args = message.text.split()[1:]
+    action = args[0].lower() if args else "status"
+
+    if action == "on":
+        rate = PROFILE_SAMPLE_RATE
+        if len(args) > 1:
+            try:
+                rate = float(args[1].rstrip('%'))
+            except ValueError:
+                return await respond(message.answer("❌ Доля апдейтов: число от 0 до 1 или процент, например /profile on 20%"))
+            if args[1].endswith('%'):
+                rate /= 100
+        profiler.start(min(max(rate, 0.0), 1.0), PROFILE_INTERVAL, PROFILE_TRACE_MEMORY)
+        logger.info("Профилирование включено командой, доля %.0f%%", profiler.rate * 100)
+        return await respond(message.answer(f"🔬 Профилирование включено, доля апдейтов {profiler.rate:.0%}"))
+
+    if action in ("off", "dump"):
+        if profiler.started_at is None:
+            return await respond(message.answer("Профилирование еще не включалось"))
+        paths = profiler.dump(PROFILE_DIR)
+        if action == "off":
+            profiler.stop()
+        logger.info("Профиль выгружен: %s", ", ".join(paths))
+        for path in paths:
+            await outbound.send_document(message.chat.id, FSInputFile(path))
+        return
+
+    await outbound(message.answer("\n".join(profiler.summary_lines() if profiler.started_at else
+                                            ["Профилирование выключено. /profile on [доля] - включить"])))
+
+def toggle_profiling():
+    if profiler.enabled:
+        paths = profiler.dump(PROFILE_DIR)
+        profiler.stop()
+        logger.info("Профилирование выключено (SIGUSR1), профиль: %s", ", ".join(paths))
+    else:
+        profiler.start(PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILE_TRACE_MEMORY)
+        logger.info("Профилирование включено (SIGUSR1), доля %.0f%%", PROFILE_SAMPLE_RATE * 100)
+
+def dump_profile():
+    if profiler.started_at is None:
+        logger.info("Профилирование еще не включалось")
+        return
+    logger.info("Профиль выгружен (SIGUSR2): %s", ", ".join(profiler.dump(PROFILE_DIR)))
+
+def install_profile_signals():
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, toggle_profiling)
+    loop.add_signal_handler(signal.SIGUSR2, dump_profile)
+
+async def start_metrics(port):
+    if not METRICS_PORT:
+        return
+    try:
+        await start_metrics_server(METRICS_HOST, port)
+        logger.info("Метрики: http://%s:%s/metrics", METRICS_HOST, port)
+    except OSError as e:
+        logger.error("Не удалось запустить сервер метрик на порту %s: %s", port, e)
 
 @router.message(Form.wait_for_chat_ids)
 async def process_chat_ids(message: Message, state: FSMContext):
@@ -337,13 +508,13 @@ async def process_chat_ids(message: Message, state: FSMContext):
         ids = [x.strip() for x in cleaned_text.split(',')]
         
         if len(ids) < 2:
-            await message.answer(
+            await outbound(message.answer(
                 "❌ Неверный формат!\n\n"
                 "Нужно ввести минимум 2 ID через запятую (хотя бы один офисный чат и дроп-чат):\n"
                 "<code>ID_офис1,ID_офис2,...,ID_дропы</code>\n\n"
                 "Пример:\n<code>-100111,-100222,-100444</code>",
                 parse_mode="HTML"
-            )
+            ))
             await state.clear()  
             return
             
@@ -351,18 +522,18 @@ async def process_chat_ids(message: Message, state: FSMContext):
             
             ids = [int(x) for x in ids]
         except ValueError:
-            await message.answer(
+            await outbound(message.answer(
                 "❌ Ошибка в формате ID!\n\n"
                 "Каждый ID должен быть числом.\n"
                 "Пример:\n<code>-100111,-100222,-100444</code>",
                 parse_mode="HTML"
-            )
+            ))
             await state.clear()  
             return
             
         try:
             
-            save_user_data(message.from_user.id, ids)
+            await save_user_data(message.from_user.id, ids)
             
             
             office_chats = ids[:-1]
@@ -373,53 +544,47 @@ async def process_chat_ids(message: Message, state: FSMContext):
                 confirmation_text += f"Офис {i}: <code>{chat_id}</code>\n"
             confirmation_text += f"Дропы: <code>{drops_chat}</code>"
             
-            await message.answer(
+            await outbound(message.answer(
                 confirmation_text,
                 parse_mode="HTML",
                 reply_markup=ReplyKeyboardRemove()
-            )
+            ))
             await state.clear()
         except sqlite3.Error as sql_error:
-            print(f"SQL Error: {sql_error}")
-            await message.answer("❌ Ошибка при сохранении в БД.")
+            logger.error("SQL Error: %s", sql_error)
+            await outbound(message.answer("❌ Ошибка при сохранении в БД."))
             await state.clear()
 
-    except Exception as e:
-        print(f"Error: {traceback.format_exc()}")
-        await message.answer("❌ Критическая ошибка.")
+    except Exception:
+        logger.exception("Error in process_chat_ids")
+        await outbound(message.answer("❌ Критическая ошибка."))
         await state.clear()
 
 @router.message(Command("settings"))
 async def cmd_settings(message: Message):
-    print(f"Получена команда /settings от пользователя {message.from_user.id} в чате {message.chat.id}")
+    logger.debug("Получена команда /settings от пользователя %s в чате %s", message.from_user.id, message.chat.id)
     
     
     user_id = message.from_user.id
     if user_id not in ALLOWED_USERS:
-        print(f"Пользователь {user_id} не имеет прав")
-        await message.answer("❌ Только разрешенные пользователи могут использовать эту команду!")
-        return
+        logger.debug("Пользователь %s не имеет прав", user_id)
+        return await respond(message.answer("❌ Только разрешенные пользователи могут использовать эту команду!"))
 
     
-    cursor.execute('SELECT COUNT(*) FROM office_chats WHERE user_id = ?', (user_id,))
-    has_office_chats = cursor.fetchone()[0] > 0
+    has_office_chats = await db.fetchval('SELECT COUNT(*) FROM office_chats WHERE user_id = ?', (user_id,)) > 0
     
-    cursor.execute('SELECT COUNT(*) FROM drops_chats WHERE user_id = ?', (user_id,))
-    has_drops_chat = cursor.fetchone()[0] > 0
+    has_drops_chat = await db.fetchval('SELECT COUNT(*) FROM drops_chats WHERE user_id = ?', (user_id,)) > 0
     
     if not (has_office_chats and has_drops_chat):
-        await message.answer("❌ Сначала настройте чаты через команду /start в личных сообщениях с ботом!")
-        return
+        return await respond(message.answer("❌ Сначала настройте чаты через команду /start в личных сообщениях с ботом!"))
 
     
     try:
-        cursor.execute('SELECT COUNT(*) FROM drops_chats WHERE chat_id = ?', (message.chat.id,))
-        is_drops = cursor.fetchone()[0] > 0
-        print(f"Чат {message.chat.id} является дроп-чатом: {is_drops}")
+        is_drops = is_drops_chat(message.chat.id)
+        logger.debug("Чат %s является дроп-чатом: %s", message.chat.id, is_drops)
     except Exception as e:
-        print(f"Ошибка при проверке типа чата: {e}")
-        await message.answer("❌ Ошибка при проверке типа чата")
-        return
+        logger.error("Ошибка при проверке типа чата: %s", e)
+        return await respond(message.answer("❌ Ошибка при проверке типа чата"))
     
     if is_drops:
         try:
@@ -435,37 +600,27 @@ async def cmd_settings(message: Message):
                     callback_data=f"set_reports_{message.message_thread_id}"
                 )
             )
-            await message.answer(
+            await outbound(message.answer(
                 "⚙️ <b>Настройки тем</b>\n\nВыберите тип темы для текущего чата:",
                 parse_mode="HTML",
                 reply_markup=builder.as_markup()
-            )
-            print("Настройки успешно отправлены")
+            ))
+            logger.debug("Настройки успешно отправлены")
         except Exception as e:
-            print(f"Ошибка при отправке настроек: {e}")
-            await message.answer("❌ Ошибка при отправке настроек")
+            logger.error("Ошибка при отправке настроек: %s", e)
+            await outbound(message.answer("❌ Ошибка при отправке настроек"))
     else:
-        print(f"Чат {message.chat.id} не является дроп-чатом")
-        await message.answer("❌ Эта команда доступна только в чатах дропов!")
+        logger.debug("Чат %s не является дроп-чатом", message.chat.id)
+        await outbound(message.answer("❌ Эта команда доступна только в чатах дропов!"))
 
 @router.callback_query(F.data.startswith("set_drops_"))
 async def set_drops_topic(callback: types.CallbackQuery):
     try:
         topic_id = int(callback.data.split("_")[2])
         
-        cursor.execute(
-            'DELETE FROM number_topics WHERE chat_id = ? AND topic_name = "drops"',
-            (callback.message.chat.id,)
-        )
-        
-        cursor.execute(
-            'INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) '
-            'VALUES (?, ?, ?, 1)',
-            (callback.message.chat.id, topic_id, "drops")
-        )
-        conn.commit()
+        await set_topic(callback.message.chat.id, "drops", topic_id)
         await callback.answer("✅ Тема приемки успешно установлена!")
-        await callback.message.delete()
+        await outbound(callback.message.delete())
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {str(e)}")
 
@@ -474,71 +629,49 @@ async def set_reports_topic(callback: types.CallbackQuery):
     try:
         topic_id = int(callback.data.split("_")[2])
         
-        cursor.execute(
-            'DELETE FROM number_topics WHERE chat_id = ? AND topic_name = "reports"',
-            (callback.message.chat.id,)
-        )
-        
-        cursor.execute(
-            'INSERT INTO number_topics (chat_id, topic_id, topic_name, is_active) '
-            'VALUES (?, ?, ?, 1)',
-            (callback.message.chat.id, topic_id, "reports")
-        )
-        conn.commit()
+        await set_topic(callback.message.chat.id, "reports", topic_id)
         await callback.answer("✅ Тема отчетов успешно установлена!")
-        await callback.message.delete()
+        await outbound(callback.message.delete())
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {str(e)}")
 
+def _save_forwarded_phone(conn, request, office_message, phone, message, registration_time):
+    conn.execute('''UPDATE num_requests 
+                    SET status = 'fulfilled' 
+                    WHERE request_id = ?''', (request.request_id,))
+    conn.execute('''INSERT OR REPLACE INTO phone_messages
+                   (phone, user_message_id, chat_id, user_id, username, first_name, last_name, registration_time, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (phone, message.message_id, message.chat.id,
+                    message.from_user.id, message.from_user.username,
+                    message.from_user.first_name, message.from_user.last_name, registration_time, int(time.time())))
+
 async def forward_number_to_office(phone, original_message, drops_chat_id):
     try:
         
-        cursor.execute('''SELECT request_id, office_chat_id, request_message_id 
-                        FROM num_requests 
-                        WHERE status = 'pending' 
-                        AND drops_chat_id = ? 
-                        LIMIT 1''', (drops_chat_id,))  
-        
-        request = cursor.fetchone()
-        
-        if not request:
-            await original_message.reply("⚠️ Нет активных запросов!")
-            return
-            
-        request_id, office_chat_id, request_message_id = request
-        
-        
-        msg = await bot.send_message(
-            chat_id=office_chat_id,
-            text=f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ</i>",
-            parse_mode="HTML",
-            reply_to_message_id=request_message_id  
-        )
-        
-        
-        cursor.execute('''UPDATE num_requests 
-                        SET status = 'fulfilled' 
-                        WHERE request_id = ?''', (request_id,))
-        conn.commit()  
+        async def send(request):
+            return await outbound.send_message(
+                chat_id=request.office_chat_id,
+                text=f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ</i>",
+                parse_mode="HTML",
+                reply_to_message_id=request.request_message_id  
+            )
         
+        assigned = await pending.assign(drops_chat_id, send, _save_forwarded_phone, phone, original_message,
+                                        datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d %H:%M:%S'))
         
-        cursor.execute('''INSERT INTO phone_messages VALUES 
-                       (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                       (phone, original_message.message_id, original_message.chat.id,
-                        original_message.from_user.id, original_message.from_user.username,
-                        original_message.from_user.first_name, original_message.from_user.last_name,
-                        datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d %H:%M:%S')))
-        conn.commit()
+        if not assigned:
+            await outbound(original_message.reply("⚠️ Нет активных запросов!"))
         
     except Exception as e:
-        print(f"Error forwarding number: {e}")
+        logger.error("Error forwarding number: %s", e)
 
 async def safe_handle_error(error: Exception, context: dict = None):
     """Безопасная обработка ошибок с очисткой проблемных данных"""
     try:
-        print(f"Ошибка: {str(error)}")
+        logger.warning("Ошибка: %s", error)
         if context:
-            print(f"Контекст: {context}")
+            logger.debug("Контекст: %s", context)
             
         
         if isinstance(error, TelegramBadRequest):
@@ -546,125 +679,155 @@ async def safe_handle_error(error: Exception, context: dict = None):
             
             
             if "message to reply not found" in error_text or "message can't be deleted" in error_text:
-                if context and 'message_id' in context:
+                if context and 'message_id' in context and 'office_chat_id' in context:
                     
-                    cursor.execute('''DELETE FROM num_requests 
-                                   WHERE request_message_id = ?''', 
-                                   (context['message_id'],))
-                    conn.commit()
-                    print(f"Удален проблемный запрос с message_id: {context['message_id']}")
+                    await pending.discard_message(context['office_chat_id'], context['message_id'],
+                                                  context.get('request_id'))
+                    logger.info("Удален проблемный запрос: чат %s, message_id %s, request_id %s",
+                                context['office_chat_id'], context['message_id'], context.get('request_id'))
                     
                     
                     if 'drops_chat_id' in context:
-                        cursor.execute('''SELECT COUNT(*) FROM num_requests 
-                                       WHERE status = 'pending' 
-                                       AND drops_chat_id = ?''', 
-                                       (context['drops_chat_id'],))
-                        new_count = cursor.fetchone()[0]
-                        
-                        
-                        cursor.execute('SELECT message_id FROM last_messages WHERE chat_id = ?', 
-                                     (context['drops_chat_id'],))
-                        last_msg = cursor.fetchone()
-                        
-                        if last_msg:
-                            try:
-                                await bot.edit_message_text(
-                                    chat_id=context['drops_chat_id'],
-                                    message_id=last_msg[0],
-                                    text=f"📱 Требуется номеров: {new_count}\n\n⚠️ Требуются номера!",
-                                    parse_mode="HTML"
-                                )
-                            except Exception as e:
-                                print(f"Ошибка обновления счетчика: {e}")
+                        counter_updater.schedule(context['drops_chat_id'], legacy_calls=1)
                                 
             
             elif "message is not modified" in error_text:
-                print("Сообщение не требует изменений")
+                logger.debug("Сообщение не требует изменений")
                 return True
                 
         return False
     except Exception as e:
-        print(f"Ошибка в обработчике ошибок: {e}")
+        logger.error("Ошибка в обработчике ошибок: %s", e)
         return False
 
+def parse_request_count(args):
+    """Аргумент /n: пусто - 1 номер, иначе целое 1..MAX_BULK_REQUESTS"""
+    if not args:
+        return 1
+    try:
+        count = int(args.split()[0])
+    except ValueError:
+        raise ValueError(f"не понято количество «{args.split()[0]}»")
+    if not 1 <= count <= MAX_BULK_REQUESTS:
+        raise ValueError(f"количество должно быть от 1 до {MAX_BULK_REQUESTS}")
+    return count
+
+def requested_text(count):
+    if count == 1:
+        return "✅ Запрос на номер отправлен в группу приемки"
+    return f"✅ Запрос на {count} номеров отправлен в группу приемки"
+
 @router.message(Command("n"))
-async def handle_numbers_request(message: Message):
+async def handle_numbers_request(message: Message, command: CommandObject):
     try:
         
         if not is_office_chat(message.chat.id):
-            await message.reply("❌ Запрашивать номера можно только из разрешённых офисных чатов! Обратитесь к администратору для добавления этого чата.")
-            return
+            return await respond(message.reply("❌ Запрашивать номера можно только из разрешённых офисных чатов! Обратитесь к администратору для добавления этого чата."))
         
         
         drops_chat = get_drops_chat_for_office(message.chat.id)
         
         if not drops_chat:
-            await message.reply("❌ Чат дропов не настроен для этого офиса!")
-            return
+            return await respond(message.reply("❌ Чат дропов не настроен для этого офиса!"))
 
-        
-        cursor.execute('''INSERT INTO num_requests 
-                    (office_chat_id, drops_chat_id, request_message_id, status)
-                    VALUES (?, ?, ?, 'pending')''',
-                  (message.chat.id, drops_chat, message.message_id))
-        conn.commit()
+        try:
+            count = parse_request_count(command.args)
+        except ValueError as e:
+            return await respond(message.reply(f"❌ {e}\nФормат: <code>/n [количество]</code>", parse_mode="HTML"))
 
-        
-        cursor.execute(
-            '''SELECT topic_id FROM number_topics 
-            WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''',
-            (drops_chat,)
-        )
-        drops_topic = cursor.fetchone()
-        
-        if not drops_topic:
-            await message.reply("⚠️ Тема для приемки не настроена! Используйте /settings в чате дропов")
-            return
+        # N запросов - одна транзакция и одно обновление счетчика вместо N команд
+        await pending.push_many(message.chat.id, drops_chat, message.message_id, count)
 
         
-        cursor.execute('SELECT message_id FROM last_messages WHERE chat_id = ?', (drops_chat,))
-        last_message = cursor.fetchone()
+        drops_topic = get_topic(drops_chat, "drops")
         
-        if last_message:
-            try:
-                await bot.delete_message(drops_chat, last_message[0])
-            except Exception as e:
-                if not await safe_handle_error(e, {'message_id': last_message[0], 'drops_chat_id': drops_chat}):
-                    print(f"Ошибка удаления сообщения: {e}")
+        if not drops_topic:
+            return await respond(message.reply("⚠️ Тема для приемки не настроена! Используйте /settings в чате дропов"))
 
         
         try:
+            counter_updater.schedule(drops_chat, legacy_calls=2 * count)
             
-            cursor.execute('''SELECT COUNT(*) FROM num_requests 
-                            WHERE status = 'pending' AND drops_chat_id = ?''',
-                          (drops_chat,))
-            pending_count = cursor.fetchone()[0]
-
-            new_message = await bot.send_message(
-                chat_id=drops_chat,
-                text=f"📱 Требуется номеров: {pending_count}\n\n⚠️ Требуются номера!",
-                parse_mode="HTML",
-                message_thread_id=drops_topic[0]
-            )
-            
-            
-            cursor.execute(
-                'INSERT OR REPLACE INTO last_messages (chat_id, message_id) VALUES (?, ?)',
-                (drops_chat, new_message.message_id)
-            )
-            conn.commit()
-            
-            await message.reply("✅ Запрос на номер отправлен в группу приемки")
+            await outbound(message.reply(requested_text(count),
+                                         reply_markup=request_more_keyboard(count) if count > 1 else None))
             
         except Exception as e:
-            if not await safe_handle_error(e, {'message_id': message.message_id, 'drops_chat_id': drops_chat}):
-                await message.reply(f"❌ Ошибка отправки запроса: {str(e)}")
+            if not await safe_handle_error(e, {'office_chat_id': message.chat.id, 'message_id': message.message_id,
+                                               'drops_chat_id': drops_chat}):
+                await outbound(message.reply(f"❌ Ошибка отправки запроса: {str(e)}"))
                 
     except Exception as e:
-        print(f"Critical error in handle_numbers_request: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        await message.reply("❌ Произошла критическая ошибка при обработке запроса")
+        logger.exception("Critical error in handle_numbers_request: %s", e)
+        await outbound(message.reply("❌ Произошла критическая ошибка при обработке запроса"))
+
+def _save_accepted_phone(conn, request, office_message, phone, message):
+    conn.execute('''INSERT OR REPLACE INTO phone_messages 
+                   (phone, user_message_id, confirmation_message_id, chat_id, 
+                    user_id, username, first_name, last_name, registration_time, report_message_id, created_at)
+                   VALUES (?, ?, NULL, ?, ?, ?, ?, ?, NULL, NULL, ?)''',
+                   (phone, message.message_id, message.chat.id,
+                    message.from_user.id, message.from_user.username,
+                    message.from_user.first_name, message.from_user.last_name, int(time.time())))
+    
+    
+    conn.execute('''UPDATE num_requests 
+                    SET status = 'fulfilled' 
+                    WHERE request_id = ?''', (request.request_id,))
+
+def _save_confirmation(conn, phone, confirmation_message_id):
+    conn.execute('UPDATE phone_messages SET confirmation_message_id = ? WHERE phone = ?',
+                 (confirmation_message_id, phone))
+
+async def accept_phone(message: Message, phone: str) -> bool:
+    """Передача одного номера в офис по самому старому запросу; False - запросов нет или ошибка.
+    Выбор запроса, отправка в офис и фиксация записи идут под блокировкой чата дропов (pending.assign);
+    подтверждение в чат дропов (лимит 20 сообщений в минуту на группу) - уже после нее"""
+    try:
+        
+        async def send(request):
+            try:
+                return await outbound.send_message(
+                    chat_id=request.office_chat_id,
+                    text=f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ</i>",
+                    parse_mode="HTML",
+                    reply_to_message_id=request.request_message_id
+                )
+            except TelegramBadRequest as e:
+                if not await safe_handle_error(e, {'office_chat_id': request.office_chat_id,
+                                                   'message_id': request.request_message_id,
+                                                   'request_id': request.request_id,
+                                                   'drops_chat_id': message.chat.id}):
+                    
+                    return await outbound.send_message(
+                        chat_id=request.office_chat_id,
+                        text=f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ</i>",
+                        parse_mode="HTML"
+                    )
+                raise
+        
+        
+        if await pending.assign(message.chat.id, send, _save_accepted_phone, phone, message) is None:
+            return False
+    except Exception as e:
+        if not await safe_handle_error(e, {'message_id': message.message_id, 'drops_chat_id': message.chat.id}):
+            await outbound(message.reply(
+                f"❌ Ошибка обработки: {str(e)}",
+                reply_to_message_id=message.message_id
+            ))
+            logger.exception("Critical error in accept_phone")
+        return False
+
+    # номер уже выдан и зафиксирован: ошибка подтверждения не отменяет прием
+    try:
+        confirmation = await outbound(message.reply(
+            f"✅ Номер <code>{phone}</code> принят!\n\n"
+            "⚠️ Оставайтесь в сети до завершения регистрации.\n",
+            parse_mode="HTML"
+        ))
+        await db.write(_save_confirmation, phone, confirmation.message_id)
+    except Exception as e:
+        logger.error("Ошибка подтверждения номера %s: %s", phone, e)
+    return True
 
 @router.message(F.text)
 async def handle_phone_number(message: Message):
@@ -674,106 +837,28 @@ async def handle_phone_number(message: Message):
             return
 
         
-        cursor.execute('''SELECT topic_id FROM number_topics 
-                       WHERE chat_id = ? 
-                       AND topic_name = "drops" 
-                       AND is_active = 1''', (message.chat.id,))
-        drops_topic = cursor.fetchone()
+        drops_topic = get_topic(message.chat.id, "drops")
         
-        if not drops_topic or message.message_thread_id != drops_topic[0]:
+        if not drops_topic or message.message_thread_id != drops_topic:
             return
 
         
-        phone = extract_phone(message.text)
-        if not phone:
+        phones = extract_phones(message.text)
+        if not phones:
             return
 
-        try:
-            
-            cursor.execute('''SELECT request_id, office_chat_id, request_message_id 
-                            FROM num_requests 
-                            WHERE status = 'pending' 
-                            AND drops_chat_id = ?
-                            LIMIT 1''', (message.chat.id,))
-            request = cursor.fetchone()
-            
-            if not request:
-                return  
-                
-            request_id, office_chat_id, request_message_id = request
-            
-            
-            try:
-                msg = await bot.send_message(
-                    chat_id=office_chat_id,
-                    text=f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ</i>",
-                    parse_mode="HTML",
-                    reply_to_message_id=request_message_id
-                )
-            except TelegramBadRequest as e:
-                if not await safe_handle_error(e, {'message_id': request_message_id, 'drops_chat_id': message.chat.id}):
-                    
-                    msg = await bot.send_message(
-                        chat_id=office_chat_id,
-                        text=f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ</i>",
-                        parse_mode="HTML"
-                    )
-            
-            
-            confirmation = await message.reply(
-                f"✅ Номер <code>{phone}</code> принят!\n\n"
-                "⚠️ Оставайтесь в сети до завершения регистрации.\n",
-                parse_mode="HTML"
-            )
-            
-            
-            cursor.execute('''INSERT OR REPLACE INTO phone_messages 
-                           (phone, user_message_id, confirmation_message_id, chat_id, 
-                            user_id, username, first_name, last_name, registration_time, report_message_id)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)''',
-                           (phone, message.message_id, confirmation.message_id, message.chat.id,
-                            message.from_user.id, message.from_user.username,
-                            message.from_user.first_name, message.from_user.last_name))
-            
-            
-            cursor.execute('''UPDATE num_requests 
-                            SET status = 'fulfilled' 
-                            WHERE request_id = ?''', (request_id,))
-            conn.commit()
-
-            
-            cursor.execute('''SELECT COUNT(*) FROM num_requests 
-                            WHERE status = 'pending' 
-                            AND drops_chat_id = ?''', (message.chat.id,))
-            new_count = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT message_id FROM last_messages WHERE chat_id = ?', (message.chat.id,))
-            last_msg = cursor.fetchone()
-            
-            if last_msg:
-                try:
-                    await bot.edit_message_text(
-                        chat_id=message.chat.id,
-                        message_id=last_msg[0],
-                        text=f"📱 Требуется номеров: {new_count}\n\n⚠️ Требуются номера!",
-                        parse_mode="HTML"
-                    )
-                except Exception as e:
-                    if not await safe_handle_error(e, {'message_id': last_msg[0], 'drops_chat_id': message.chat.id}):
-                        print(f"Ошибка обновления счетчика: {e}")
+        accepted = 0
+        for phone in phones:
+            if not await accept_phone(message, phone):
+                break
+            accepted += 1
 
-        except Exception as e:
-            if not await safe_handle_error(e, {'message_id': message.message_id, 'drops_chat_id': message.chat.id}):
-                await message.reply(
-                    f"❌ Ошибка обработки: {str(e)}",
-                    reply_to_message_id=message.message_id
-                )
-                print(f"Critical error: {traceback.format_exc()}")
+        if accepted:
+            counter_updater.schedule(message.chat.id, legacy_calls=accepted)
                 
     except Exception as e:
-        print(f"Critical error in handle_phone_number: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        await message.reply("❌ Произошла критическая ошибка при обработке номера")
+        logger.exception("Critical error in handle_phone_number: %s", e)
+        await outbound(message.reply("❌ Произошла критическая ошибка при обработке номера"))
 
 @router.message(F.photo)
 async def handle_photo_reply(message: Message):
@@ -798,71 +883,63 @@ async def handle_photo_reply(message: Message):
     drops_chat = get_drops_chat_for_office(message.chat.id)
     
     if not drops_chat:
-        await message.reply("❌ Ошибка: не найден связанный чат дропов")
-        return
+        return await respond(message.reply("❌ Ошибка: не найден связанный чат дропов"))
         
     try:
-        cursor.execute('''SELECT topic_id FROM number_topics 
-                        WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''',
-                        (drops_chat,))
-        drops_topic = cursor.fetchone()
+        drops_topic = get_topic(drops_chat, "drops")
         
         if not drops_topic:
-            await message.reply("❌ Ошибка: не настроена тема для приема в чате дропов")
-            return
+            return await respond(message.reply("❌ Ошибка: не настроена тема для приема в чате дропов"))
 
-        cursor.execute('SELECT user_message_id FROM phone_messages WHERE phone = ? AND chat_id = ?', 
+        user_message = await db.fetchone('SELECT user_message_id FROM phone_messages WHERE phone = ? AND chat_id = ?', 
                       (phone, drops_chat))
-        user_message = cursor.fetchone()
 
-        sent_msg = await bot.send_photo(
+        photo = message.photo[-1]
+        code = await ocr_pool.recognize_photo(bot, select_photo(message.photo))
+        caption = f"📱 {phone}"
+        if is_code(code):
+            caption += f"\n🔑 <code>{code}</code>"
+
+        sent_msg = await outbound.send_photo(
             chat_id=drops_chat,
-            photo=message.photo[-1].file_id,
-            caption=f"📱 {phone}",
+            photo=photo.file_id,
+            caption=caption,
             parse_mode="HTML",
-            message_thread_id=drops_topic[0],
+            message_thread_id=drops_topic,
             reply_to_message_id=user_message[0] if user_message else None
         )
         
-        await original_msg.edit_text(
+        await outbound(original_msg.edit_text(
             f"📲 Номер: <code>{phone}</code>\n✅ Код отправлен",
             parse_mode="HTML",
-            reply_markup=InlineKeyboardBuilder()
-                .row(
-                    InlineKeyboardButton(text="✅ Встал", callback_data=f"status_ok_{original_msg.message_id}"),
-                    InlineKeyboardButton(text="❌ Не встал", callback_data=f"status_fail_{original_msg.message_id}"),
-                )
-                .row(
-                    InlineKeyboardButton(text="🔁 Повтор", callback_data=f"status_repeat_{original_msg.message_id}"),
-                )
-                .as_markup()
-        )
+            reply_markup=status_keyboard(original_msg.message_id)
+        ))
         
     except Exception as e:
-        await message.reply(f"❌ Ошибка при отправке фото: {str(e)}")
+        await outbound(message.reply(f"❌ Ошибка при отправке фото: {str(e)}"))
 
 async def safe_delete_message(chat_id, message_id):
     try:
-        await bot.delete_message(chat_id, message_id)
+        await outbound.delete_message(chat_id, message_id)
         return True
     except TelegramBadRequest as e:
         if "message to delete not found" in str(e).lower():
-            print(f"Сообщение {message_id} уже удалено или недоступно")
+            logger.debug("Сообщение %s уже удалено или недоступно", message_id)
         elif "message can't be deleted" in str(e).lower():
-            print(f"Невозможно удалить сообщение {message_id}")
+            logger.warning("Невозможно удалить сообщение %s", message_id)
         else:
-            print(f"Ошибка при удалении сообщения: {e}")
+            logger.error("Ошибка при удалении сообщения: %s", e)
         return False
     except TelegramForbiddenError:
-        print(f"Недостаточно прав для удаления сообщения {message_id}")
+        logger.warning("Недостаточно прав для удаления сообщения %s", message_id)
         return False
     except Exception as e:
-        print(f"Неожиданная ошибка при удалении сообщения: {e}")
+        logger.error("Неожиданная ошибка при удалении сообщения: %s", e)
         return False
 
 async def safe_edit_message(chat_id, message_id, new_text, **kwargs):
     try:
-        await bot.edit_message_text(
+        await outbound.edit_message_text(
             chat_id=chat_id,
             message_id=message_id,
             text=new_text,
@@ -874,37 +951,161 @@ async def safe_edit_message(chat_id, message_id, new_text, **kwargs):
             
             return True
         elif "message to edit not found" in str(e).lower():
-            print(f"Сообщение {message_id} для редактирования не найдено")
+            logger.warning("Сообщение %s для редактирования не найдено", message_id)
         else:
-            print(f"Ошибка при редактировании сообщения: {e}")
+            logger.error("Ошибка при редактировании сообщения: %s", e)
         return False
     except Exception as e:
-        print(f"Неожиданная ошибка при редактировании сообщения: {e}")
+        logger.error("Неожиданная ошибка при редактировании сообщения: %s", e)
         return False
 
+def counter_text(count):
+    return f"📱 Требуется номеров: {count}\n\n⚠️ Требуются номера!"
+
+class CounterUpdater:
+    """Склеивает изменения счетчика за окно delay и применяет только последнее значение"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._tasks = {}
+        self._locks = KeyedLock()
+        self._shown = {}
+        self.stats = {"events": 0, "legacy_calls": 0, "edits": 0, "sends": 0, "skipped": 0}
+
+    def schedule(self, drops_chat, legacy_calls=1):
+        """legacy_calls - сколько запросов к Bot API сделал бы прежний код на это событие"""
+        self.stats["events"] += 1
+        self.stats["legacy_calls"] += legacy_calls
+        if drops_chat not in self._tasks:
+            self._tasks[drops_chat] = asyncio.create_task(self._flush_later(drops_chat))
+
+    @property
+    def api_calls(self):
+        return self.stats["edits"] + self.stats["sends"]
+
+    @property
+    def calls_saved(self):
+        return self.stats["legacy_calls"] - self.api_calls
+
+    async def _flush_later(self, drops_chat):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._tasks.pop(drops_chat, None)
+        async with self._locks(drops_chat):
+            try:
+                await self._apply(drops_chat)
+            except Exception as e:
+                logger.error("Ошибка обновления счетчика: %s", e)
+
+    async def _apply(self, drops_chat):
+        count = pending.count(drops_chat)
+        last_message = await db.fetchone('SELECT message_id FROM last_messages WHERE chat_id = ?', (drops_chat,))
+
+        if last_message:
+            if self._shown.get(drops_chat) == count:
+                self.stats["skipped"] += 1
+                return
+            self.stats["edits"] += 1
+            if await safe_edit_message(drops_chat, last_message[0], counter_text(count),
+                                       parse_mode="HTML", priority=PRIORITY_COUNTER):
+                self._shown[drops_chat] = count
+                return
+
+        drops_topic = get_topic(drops_chat, "drops")
+        if not drops_topic:
+            return
+
+        self.stats["sends"] += 1
+        new_message = await outbound.send_message(
+            chat_id=drops_chat,
+            text=counter_text(count),
+            parse_mode="HTML",
+            message_thread_id=drops_topic,
+            priority=PRIORITY_COUNTER
+        )
+        self._shown[drops_chat] = count
+
+        await db.execute(
+            'INSERT OR REPLACE INTO last_messages (chat_id, message_id) VALUES (?, ?)',
+            (drops_chat, new_message.message_id)
+        )
+
+counter_updater = CounterUpdater(COUNTER_DEBOUNCE)
+
+def moscow_today():
+    return datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d')
+
+def _phone_state(conn, phone):
+    """(чат дропов, статус, время регистрации, день смены статуса) номера"""
+    row = conn.execute('SELECT chat_id, status, registration_time, status_day FROM phone_messages WHERE phone = ?',
+                       (phone,)).fetchone()
+    return row or (None, None, None, None)
+
+# Счетчики daily_stats меняются только при смене статуса: «🔁 Повтор» снова показывает кнопки,
+# и повторное нажатие не должно считать номер дважды. Отмена уменьшает счетчик того дня,
+# в который он был увеличен: регистрации - день registration_time, отказа - status_day
+
+def _mark_registered(conn, phone, office_chat_id, registration_time):
+    drops_chat, status, _, status_day = _phone_state(conn, phone)
+    if not conn.execute('''UPDATE phone_messages SET registration_time = ?, status = ?, status_day = ?
+                           WHERE phone = ? AND status IS NOT ?''',
+                        (registration_time, 'ok', registration_time[:10], phone, 'ok')).rowcount:
+        return
+    bump_daily_stat(conn, registration_time[:10], drops_chat, office_chat_id, "registered")
+    if status == 'fail':
+        # у отказов до миграции 7 дня нет - остается прежнее приближение днем регистрации
+        unbump_daily_stat(conn, status_day or registration_time[:10], drops_chat, office_chat_id, "failed")
+
+def _save_report_message(conn, phone, report_message_id):
+    conn.execute('UPDATE phone_messages SET report_message_id = ? WHERE phone = ?', (report_message_id, phone))
+
+def _mark_failed(conn, phone, office_chat_id, day):
+    drops_chat, status, registration_time, _ = _phone_state(conn, phone)
+    if not conn.execute('UPDATE phone_messages SET status = ?, status_day = ? WHERE phone = ? AND status IS NOT ?',
+                        ('fail', day, phone, 'fail')).rowcount:
+        return
+    bump_daily_stat(conn, day, drops_chat, office_chat_id, "failed")
+    if status == 'ok' and registration_time:
+        unbump_daily_stat(conn, registration_time[:10], drops_chat, office_chat_id, "registered")
+
+def _mark_slet(conn, phone, drops_chat_id, office_chat_id, day):
+    if conn.execute('UPDATE phone_messages SET status = ?, status_day = ? WHERE phone = ? AND status IS NOT ?',
+                    ('slet', day, phone, 'slet')).rowcount:
+        bump_daily_stat(conn, day, drops_chat_id, office_chat_id, "slet")
+
+async def send_office_report(office_chat_id, text):
+    report_topic = get_settings(office_chat_id)
+    logger.debug("Report topic: %s", report_topic)
+    if not report_topic:
+        return
+    try:
+        await outbound.send_message(office_chat_id, text, message_thread_id=report_topic, priority=PRIORITY_NORMAL)
+        logger.debug("Sent message to report topic")
+    except Exception as e:
+        logger.error("Error sending message to report topic: %s", e)
+
 @router.callback_query(F.data.startswith("status_"))
 async def handle_registration_status(callback: types.CallbackQuery):
     try:
-        print(f"Processing callback data: {callback.data}")
+        logger.debug("Processing callback data: %s", callback.data)
         _, status, msg_id = callback.data.split("_")
         msg_id = int(msg_id)
         
         current_text = callback.message.text
-        print(f"Current message text: {current_text}")
+        logger.debug("Current message text: %s", current_text)
         
         phone_match = re.search(r'\+7\d{10}', current_text)
         if not phone_match:
-            print("No phone number found in message text")
-            await callback.answer("❌ Номер не найден")
-            return
+            logger.debug("No phone number found in message text")
+            return await respond(callback.answer("❌ Номер не найден"))
             
         phone = phone_match.group(0)
-        print(f"Found phone number: {phone}")
+        logger.debug("Found phone number: %s", phone)
         
-        cursor.execute('''SELECT user_id, username, first_name, last_name 
+        user_info = await db.fetchone('''SELECT user_id, username, first_name, last_name 
                         FROM phone_messages WHERE phone = ?''', (phone,))
-        user_info = cursor.fetchone()
-        print(f"User info from database: {user_info}")
+        logger.debug("User info from database: %s", user_info)
         
         if user_info:
             user_id, username, first_name, last_name = user_info
@@ -922,106 +1123,89 @@ async def handle_registration_status(callback: types.CallbackQuery):
                 user_mention = f"ID: {user_id}"
         else:
             user_mention = "Неизвестный пользователь"
-            print(f"No user info found for phone {phone}")
+            logger.debug("No user info found for phone %s", phone)
         
         if status == "ok":
-            print("Processing status_ok")
+            logger.debug("Processing status_ok")
             moscow_time = datetime.now(pytz.timezone('Europe/Moscow')).strftime('%H:%M')
             
             
             try:
-                cursor.execute('''UPDATE phone_messages 
-                                SET registration_time = ? 
-                                WHERE phone = ?''', 
-                                (datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d %H:%M:%S'), phone))
-                conn.commit()
-                print("Updated registration time")
+                await db.write(_mark_registered, phone, callback.message.chat.id,
+                                     datetime.now(pytz.timezone('Europe/Moscow')).strftime('%Y-%m-%d %H:%M:%S'))
+                logger.debug("Updated registration time")
             except Exception as e:
-                print(f"Error updating registration time: {e}")
-                await callback.answer("❌ Ошибка при обновлении времени регистрации")
-                return
-            
-            report_topic = get_settings(callback.message.chat.id)
-            print(f"Report topic: {report_topic}")
-            
-            if report_topic:
-                try:
-                    await bot.send_message(
-                        callback.message.chat.id,
-                        f"{phone} {moscow_time}",
-                        message_thread_id=report_topic
-                    )
-                    print("Sent message to report topic")
-                except Exception as e:
-                    print(f"Error sending message to report topic: {e}")
+                logger.error("Error updating registration time: %s", e)
+                return await respond(callback.answer("❌ Ошибка при обновлении времени регистрации"))
             
             try:
                 
                 drops_chat = get_drops_chat_for_office(callback.message.chat.id)
-                print(f"Drops chat: {drops_chat}")
+                logger.debug("Drops chat: %s", drops_chat)
                 
                 if drops_chat:
-                    cursor.execute('''SELECT topic_id FROM number_topics 
-                                    WHERE chat_id = ? AND topic_name = "reports" AND is_active = 1''', 
-                                    (drops_chat,))
-                    drops_reports_topic = cursor.fetchone()
-                    print(f"Drops reports topic: {drops_reports_topic}")
+                    drops_reports_topic = get_topic(drops_chat, "reports")
+                    logger.debug("Drops reports topic: %s", drops_reports_topic)
                     
                     if drops_reports_topic:
                         
                         try:
                             
                             message_text = f"{phone} {moscow_time} {user_mention}"
-                            report_msg = await bot.send_message(
+                            # офис ждет этот отчет на нажатой кнопке - приоритет ответа
+                            report_msg = await outbound.send_message(
                                 drops_chat,
                                 message_text,
-                                message_thread_id=drops_reports_topic[0]
+                                message_thread_id=drops_reports_topic
                             )
-                            print("Sent report message")
+                            logger.debug("Sent report message")
                             
                             
-                            cursor.execute('''UPDATE phone_messages 
-                                            SET report_message_id = ? 
-                                            WHERE phone = ?''', 
-                                            (report_msg.message_id, phone))
-                            conn.commit()
-                            print("Saved report message ID")
+                            await db.write(_save_report_message, phone, report_msg.message_id)
+                            logger.debug("Saved report message ID")
                         except Exception as e:
-                            print(f"Error sending/saving report message: {e}")
-                            await callback.answer("❌ Ошибка при отправке отчета")
-                            return
+                            logger.error("Error sending/saving report message: %s", e)
+                            return await respond(callback.answer("❌ Ошибка при отправке отчета"))
             except Exception as e:
-                print(f"Error processing drops chat: {e}")
-                await callback.answer("❌ Ошибка при обработке чата дропов")
-                return
+                logger.error("Error processing drops chat: %s", e)
+                return await respond(callback.answer("❌ Ошибка при обработке чата дропов"))
+
+            # кнопка «Слёт» читает report_message_id - фиксируем до того, как она появится
+            try:
+                await db.flush()
+            except Exception as e:
+                logger.error("Error committing registration: %s", e)
+                return await respond(callback.answer("❌ Ошибка при обновлении времени регистрации"))
 
             try:
                 message_text = f"📲 Номер: {phone}\n✅ Зарегистрирован"
-                reply_markup = InlineKeyboardBuilder()
-                reply_markup.row(
-                    InlineKeyboardButton(text="📱 Запросить номер", callback_data="request_number"),
-                    InlineKeyboardButton(text="🔴 Слёт", callback_data=f"slet_{phone}")
-                )
                 
                 success = await safe_edit_message(
                     chat_id=callback.message.chat.id,
                     message_id=callback.message.message_id,
                     new_text=message_text,
                     parse_mode="HTML",
-                    reply_markup=reply_markup.as_markup()
+                    reply_markup=registered_keyboard(phone)
                 )
+                # тема отчетов офиса кнопке «Слёт» не нужна - ее сообщение не задерживает статус
+                await send_office_report(callback.message.chat.id, f"{phone} {moscow_time}")
                 
                 if success:
-                    print("Updated message with registration status")
-                    await callback.answer("✅ Статус обновлен: Зарегистрирован")
+                    logger.debug("Updated message with registration status")
+                    return await respond(callback.answer("✅ Статус обновлен: Зарегистрирован"))
                 else:
-                    await callback.answer("⚠️ Не удалось обновить сообщение")
+                    return await respond(callback.answer("⚠️ Не удалось обновить сообщение"))
             except Exception as e:
-                print(f"Error updating message with status: {e}")
-                await callback.answer("❌ Ошибка при обновлении статуса")
-                return
+                logger.error("Error updating message with status: %s", e)
+                return await respond(callback.answer("❌ Ошибка при обновлении статуса"))
             
         elif status == "fail":
+            try:
+                await db.write(_mark_failed, phone, callback.message.chat.id, moscow_today())
+                await db.flush()
+            except Exception as e:
+                logger.error("Error saving fail status: %s", e)
+
             try:
                 message_text = f"📲 Номер: {phone}\n❌ Не зарегистрирован"
                 success = await safe_edit_message(
@@ -1035,164 +1219,91 @@ async def handle_registration_status(callback: types.CallbackQuery):
                 else:
                     await callback.answer("⚠️ Не удалось обновить сообщение")
             except Exception as e:
-                print(f"Error updating fail status: {e}")
-                await callback.answer("❌ Ошибка при обновлении статуса")
-                return
+                logger.error("Error updating fail status: %s", e)
+                return await respond(callback.answer("❌ Ошибка при обновлении статуса"))
             
             
             drops_chat = get_drops_chat_for_office(callback.message.chat.id)
             
             if drops_chat:
-                cursor.execute('''SELECT topic_id FROM number_topics 
-                                WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''',
-                                (drops_chat,))
-                drops_topic = cursor.fetchone()
-                
-                if drops_topic:
-                    cursor.execute('''SELECT COUNT(*) FROM num_requests 
-                                    WHERE status = 'pending' 
-                                    AND drops_chat_id = ?''', (drops_chat,))
-                    required_count = cursor.fetchone()[0] or 0
-                    
-                    cursor.execute('SELECT message_id FROM last_messages WHERE chat_id = ?', (drops_chat,))
-                    last_message = cursor.fetchone()
-                    
-                    if last_message:
-                        await safe_delete_message(drops_chat, last_message[0])
-                    
-                    new_message = await bot.send_message(
-                        drops_chat,
-                        f"📱 Требуется номеров: {required_count}\n\n⚠️ Требуются номера!",
-                        parse_mode="HTML",
-                        message_thread_id=drops_topic[0]
-                    )
-                    
-                    cursor.execute('INSERT OR REPLACE INTO last_messages (chat_id, message_id) VALUES (?, ?)',
-                                 (drops_chat, new_message.message_id))
-                    conn.commit()
+                counter_updater.schedule(drops_chat, legacy_calls=2)
             
         elif status == "repeat":
             
             drops_chat = get_drops_chat_for_office(callback.message.chat.id)
             
             if drops_chat:
-                cursor.execute('''SELECT topic_id FROM number_topics 
-                                WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''',
-                                (drops_chat,))
-                drops_topic = cursor.fetchone()
+                drops_topic = get_topic(drops_chat, "drops")
                 
                 if drops_topic:
-                    cursor.execute('SELECT user_message_id FROM phone_messages WHERE phone = ? AND chat_id = ?', 
+                    user_message = await db.fetchone('SELECT user_message_id FROM phone_messages WHERE phone = ? AND chat_id = ?', 
                                  (phone, drops_chat))
-                    user_message = cursor.fetchone()
                     
-                    await bot.send_message(
+                    await outbound.send_message(
                         drops_chat,
                         f"📱 {phone}\n🔄 Ожидайте повторной отправки кода. Пожалуйста, оставайтесь в сети",
                         parse_mode="HTML",
-                        message_thread_id=drops_topic[0],
+                        message_thread_id=drops_topic,
                         reply_to_message_id=user_message[0] if user_message else None
                     )
                     
                     try:
                         message_text = f"📱 Новый номер: <code>{phone}</code>\n<i>Отправьте фото с кодом в ответ на это сообщение</i>"
-                        reply_markup = InlineKeyboardBuilder()
-                        reply_markup.row(
-                            InlineKeyboardButton(text="✅ Встал", callback_data=f"status_ok_{msg_id}"),
-                            InlineKeyboardButton(text="❌ Не встал", callback_data=f"status_fail_{msg_id}")
-                        )
-                        reply_markup.row(
-                            InlineKeyboardButton(text="🔁 Повтор", callback_data=f"status_repeat_{msg_id}")
-                        )
                         
                         success = await safe_edit_message(
                             chat_id=callback.message.chat.id,
                             message_id=callback.message.message_id,
                             new_text=message_text,
                             parse_mode="HTML",
-                            reply_markup=reply_markup.as_markup()
+                            reply_markup=status_keyboard(msg_id)
                         )
                         if success:
-                            await callback.answer("Отправлен повторный запрос")
+                            return await respond(callback.answer("Отправлен повторный запрос"))
                         else:
-                            await callback.answer("⚠️ Не удалось обновить сообщение")
+                            return await respond(callback.answer("⚠️ Не удалось обновить сообщение"))
                     except Exception as e:
-                        print(f"Error updating repeat status: {e}")
-                        await callback.answer("❌ Ошибка при обновлении статуса")
-                        return
+                        logger.error("Error updating repeat status: %s", e)
+                        return await respond(callback.answer("❌ Ошибка при обновлении статуса"))
             
     except Exception as e:
-        print(f"Critical error in handle_registration_status: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        await callback.answer(f"❌ Критическая ошибка: {str(e)}")
+        logger.exception("Critical error in handle_registration_status: %s", e)
+        return await respond(callback.answer(f"❌ Критическая ошибка: {str(e)}"))
 
-@router.callback_query(F.data == "request_number")
+@router.callback_query(F.data.startswith("request_number"))
 async def handle_request_number(callback: types.CallbackQuery):
+    """request_number - один номер, request_number_N - N номеров (кнопка под ответом на /n N)"""
     try:
+        try:
+            count = parse_request_count(callback.data[len("request_number_"):])
+        except ValueError as e:
+            return await respond(callback.answer(f"❌ {e}"))
         
         if not is_office_chat(callback.message.chat.id):
-            await callback.answer("❌ Эта команда доступна только в офисном чате!")
-            return
+            return await respond(callback.answer("❌ Эта команда доступна только в офисном чате!"))
         
         
         drops_chat = get_drops_chat_for_office(callback.message.chat.id)
         
         if not drops_chat:
-            await callback.answer("❌ Чат дропов не настроен для этого офиса!")
-            return
+            return await respond(callback.answer("❌ Чат дропов не настроен для этого офиса!"))
 
         
-        cursor.execute('''INSERT INTO num_requests 
-                    (office_chat_id, drops_chat_id, request_message_id, status)
-                    VALUES (?, ?, ?, 'pending')''',
-                  (callback.message.chat.id, drops_chat, callback.message.message_id))
-        conn.commit()
+        await pending.push_many(callback.message.chat.id, drops_chat, callback.message.message_id, count)
 
         
-        cursor.execute(
-            '''SELECT topic_id FROM number_topics 
-            WHERE chat_id = ? AND topic_name = "drops" AND is_active = 1''',
-            (drops_chat,)
-        )
-        drops_topic = cursor.fetchone()
+        drops_topic = get_topic(drops_chat, "drops")
         
         if not drops_topic:
-            await callback.answer("⚠️ Тема для приемки не настроена! Используйте /settings в чате дропов")
-            return
-
-        
-        cursor.execute('SELECT message_id FROM last_messages WHERE chat_id = ?', (drops_chat,))
-        last_message = cursor.fetchone()
-        
-        if last_message:
-            await safe_delete_message(drops_chat, last_message[0])
+            return await respond(callback.answer("⚠️ Тема для приемки не настроена! Используйте /settings в чате дропов"))
 
         
-        cursor.execute('''SELECT COUNT(*) FROM num_requests 
-                        WHERE status = 'pending' AND drops_chat_id = ?''',
-                      (drops_chat,))
-        pending_count = cursor.fetchone()[0]
-
+        counter_updater.schedule(drops_chat, legacy_calls=2 * count)
         
-        new_message = await bot.send_message(
-            chat_id=drops_chat,
-            text=f"📱 Требуется номеров: {pending_count}\n\n⚠️ Требуются номера!",
-            parse_mode="HTML",
-            message_thread_id=drops_topic[0]
-        )
-        
-        
-        cursor.execute(
-            'INSERT OR REPLACE INTO last_messages (chat_id, message_id) VALUES (?, ?)',
-            (drops_chat, new_message.message_id)
-        )
-        conn.commit()
-        
-        await callback.answer("✅ Запрос на номер отправлен в группу приемки")
+        return await respond(callback.answer(requested_text(count)))
             
     except Exception as e:
-        await callback.answer(f"❌ Ошибка: {str(e)}")
-        print(f"Error in handle_request_number: {traceback.format_exc()}")
+        logger.exception("Error in handle_request_number")
+        return await respond(callback.answer(f"❌ Ошибка: {str(e)}"))
 
 @router.callback_query(F.data.startswith("slet_"))
 async def handle_slet(callback: types.CallbackQuery):
@@ -1200,20 +1311,17 @@ async def handle_slet(callback: types.CallbackQuery):
         phone = callback.data.split("_")[1]
         
         
-        cursor.execute('''SELECT registration_time, user_id, username, first_name, last_name, 
+        reg_info = await db.fetchone('''SELECT registration_time, user_id, username, first_name, last_name, 
                          chat_id, report_message_id 
                          FROM phone_messages WHERE phone = ?''', (phone,))
-        reg_info = cursor.fetchone()
         
         if not reg_info:
-            await callback.answer("❌ Информация о регистрации не найдена")
-            return
+            return await respond(callback.answer("❌ Информация о регистрации не найдена"))
             
         reg_time, user_id, username, first_name, last_name, drops_chat, report_message_id = reg_info
         
         if not report_message_id:
-            await callback.answer("❌ Не найдено сообщение отчета")
-            return
+            return await respond(callback.answer("❌ Не найдено сообщение отчета"))
             
         user_mention = f"@{username}" if username else f"[{first_name} {last_name}](tg://user?id={user_id})"
         
@@ -1233,13 +1341,12 @@ async def handle_slet(callback: types.CallbackQuery):
         current_time_str = current_time.strftime('%H:%M')
         
         
-        cursor.execute('''SELECT topic_id FROM number_topics 
-                         WHERE chat_id = ? AND topic_name = "reports" AND is_active = 1''', 
-                         (drops_chat,))
-        drops_reports_topic = cursor.fetchone()
+        drops_reports_topic = get_topic(drops_chat, "reports")
         
         if drops_reports_topic:
             try:
+                await db.write(_mark_slet, phone, drops_chat, callback.message.chat.id,
+                                     current_time.strftime('%Y-%m-%d'))
                 
                 new_text = f"{phone} {reg_time_str}-{current_time_str} ({minutes:02d}:{seconds:02d}) {user_mention}"
                 
@@ -1250,120 +1357,82 @@ async def handle_slet(callback: types.CallbackQuery):
                     new_text=new_text
                 )
                 
-                if success:
-                    
-                    button_message_success = await safe_edit_message(
-                        chat_id=callback.message.chat.id,
-                        message_id=callback.message.message_id,
-                        new_text=f"{callback.message.text}\n🔴 Слетел через {minutes:02d}:{seconds:02d}",
-                        parse_mode="HTML",
-                        reply_markup=InlineKeyboardBuilder()
-                            .row(InlineKeyboardButton(text="📱 Запросить номер", callback_data="request_number"))
-                            .as_markup()
-                    )
-                    
-                    if button_message_success:
-                        await callback.answer("✅ Отчет о слёте обновлен")
-                    else:
-                        await callback.answer("⚠️ Частично обновлено (ошибка с кнопками)")
+                if not success:
+                    # отчет в Telegram не изменился - статус «слёт» не сохраняем
+                    db.abort()
+                    return await respond(callback.answer("❌ Не удалось обновить отчет"))
+
+                button_message_success = await safe_edit_message(
+                    chat_id=callback.message.chat.id,
+                    message_id=callback.message.message_id,
+                    new_text=f"{callback.message.text}\n🔴 Слетел через {minutes:02d}:{seconds:02d}",
+                    parse_mode="HTML",
+                    reply_markup=request_keyboard()
+                )
+                
+                if button_message_success:
+                    return await respond(callback.answer("✅ Отчет о слёте обновлен"))
                 else:
-                    await callback.answer("❌ Не удалось обновить отчет")
+                    return await respond(callback.answer("⚠️ Частично обновлено (ошибка с кнопками)"))
             except Exception as e:
-                print(f"Error updating message: {str(e)}")
-                await callback.answer("❌ Ошибка при обновлении сообщения")
+                logger.error("Error updating message: %s", e)
+                db.abort()
+                return await respond(callback.answer("❌ Ошибка при обновлении сообщения"))
         else:
-            await callback.answer("❌ Тема для отчетов не настроена!")
+            return await respond(callback.answer("❌ Тема для отчетов не настроена!"))
             
     except Exception as e:
-        await callback.answer(f"❌ Ошибка: {str(e)}")
-        print(f"Error in handle_slet: {traceback.format_exc()}")
+        logger.exception("Error in handle_slet")
+        return await respond(callback.answer(f"❌ Ошибка: {str(e)}"))
 
 @router.callback_query(lambda c: c.data == "resetdb_confirm")
 async def resetdb_confirm(callback_query: types.CallbackQuery):
     if callback_query.from_user.id not in ALLOWED_USERS:
-        await callback_query.answer("❌ Команда доступна только разрешённым пользователям.")
-        return
+        return await respond(callback_query.answer("❌ Команда доступна только разрешённым пользователям."))
     try:
-        await callback_query.message.edit_text("⏳ Очистка базы данных... Бот будет перезапущен.")
-        conn.close()
-        os.remove('bot_db.sqlite')
+        await outbound(callback_query.message.edit_text("⏳ Очистка базы данных... Бот будет перезапущен."))
+        db.close_sync()
+        for path in (DB_NAME, f"{DB_NAME}-wal", f"{DB_NAME}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
         
         os.execv(sys.executable, [sys.executable] + sys.argv)
     except Exception as e:
-        await callback_query.message.edit_text(f"❌ Ошибка при очистке базы данных: {e}")
+        await outbound(callback_query.message.edit_text(f"❌ Ошибка при очистке базы данных: {e}"))
 
 @router.callback_query(lambda c: c.data == "resetdb_cancel")
 async def resetdb_cancel(callback_query: types.CallbackQuery):
-    await callback_query.message.edit_text("❌ Очистка базы данных отменена.")
+    return await respond(callback_query.message.edit_text("❌ Очистка базы данных отменена."))
 
 async def send_daily_report():
     """Отправка ежедневного отчета пользователю"""
     try:
-        REPORT_USER_ID = 7037364839  
-        
-        
+        started = time.perf_counter()
         moscow_tz = pytz.timezone('Europe/Moscow')
         current_date = datetime.now(moscow_tz).date()
-        
-        
-        cursor.execute('SELECT DISTINCT chat_id FROM drops_chats')
-        drops_chats = cursor.fetchall()
-        
-        
-        total_report = f"📊 Сводный отчет за {current_date.strftime('%d.%m.%Y')}:\n\n"
-        total_registrations = 0
-        
-        for (drops_chat_id,) in drops_chats:
+        day_start = current_date.strftime('%Y-%m-%d 00:00:00')
+        day_end = (current_date + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+
+        registrations = await db.run(load_day_registrations, day_start, day_end)
+        totals = sum_stats(await db.run(load_day_stats, current_date.strftime('%Y-%m-%d')))
+        chunks = list(chunk_lines(daily_report_lines(registrations, current_date, totals)))
+        logger.info("Отчет за %s: %d регистраций, %d сообщ., сформирован за %.1f мс",
+                    current_date, len(registrations), len(chunks), (time.perf_counter() - started) * 1000)
+
+        for index, chunk in enumerate(chunks, 1):
             try:
-                
-                cursor.execute('''SELECT phone, registration_time, username, first_name, last_name, user_id 
-                                FROM phone_messages 
-                                WHERE chat_id = ? 
-                                AND date(registration_time) = ?''',
-                                (drops_chat_id, current_date.strftime('%Y-%m-%d')))
-                registrations = cursor.fetchall()
-                
-                if registrations:
-                    for phone, reg_time, username, first_name, last_name, user_id in registrations:
-                        
-                        reg_datetime = datetime.strptime(reg_time, '%Y-%m-%d %H:%M:%S')
-                        reg_time_str = reg_datetime.strftime('%H:%M')
-                        
-                        
-                        if username:
-                            user_mention = f"@{username}"
-                        elif first_name:
-                            user_mention = f"{first_name}"
-                        else:
-                            user_mention = f"ID: {user_id}"
-                        
-                        total_report += f"📱 {phone} {reg_time_str} {user_mention}\n"
-                    
-                    total_registrations += len(registrations)
-                
+                await outbound.send_message(
+                    chat_id=REPORT_USER_ID,
+                    text=chunk,
+                    parse_mode="HTML",
+                    priority=PRIORITY_REPORT
+                )
             except Exception as e:
-                print(f"Ошибка при обработке чата {drops_chat_id}: {e}")
-                continue
-        
-        
-        if total_registrations > 0:
-            total_report += f"\n📈 Всего регистраций: {total_registrations}"
-        else:
-            total_report = "📊 Отчет за день:\nРегистраций не было"
-        
-        
-        try:
-            await bot.send_message(
-                chat_id=REPORT_USER_ID,
-                text=total_report,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Ошибка при отправке отчета пользователю {REPORT_USER_ID}: {e}")
+                logger.error("Ошибка при отправке части %d/%d отчета пользователю %s: %s", index, len(chunks), REPORT_USER_ID, e)
+                break
                 
     except Exception as e:
-        print(f"Критическая ошибка в send_daily_report: {e}")
-        print(traceback.format_exc())
+        logger.exception("Критическая ошибка в send_daily_report: %s", e)
 
 async def schedule_daily_report():
     """Планировщик ежедневных отчетов"""
@@ -1389,10 +1458,123 @@ async def schedule_daily_report():
             await asyncio.sleep(60)
             
         except Exception as e:
-            print(f"Ошибка в планировщике отчетов: {e}")
+            logger.error("Ошибка в планировщике отчетов: %s", e)
             
             await asyncio.sleep(300)
 
+async def schedule_retention():
+    """Архивация старых строк: первый проход через минуту после старта, затем раз в RETENTION_INTERVAL"""
+    delay = 60
+    while not is_shutting_down:
+        await asyncio.sleep(delay)
+        delay = RETENTION_INTERVAL
+        try:
+            report = await run_retention(db, ARCHIVE_DB, RETENTION_DAYS * 24 * 60 * 60, RETENTION_BATCH)
+            for table, moved in report["moved"].items():
+                RETENTION_ROWS.inc(table, amount=moved)
+            RETENTION_RECLAIMED_BYTES.inc(amount=report["reclaimed_bytes"])
+            logger.info(report_line(report))
+        except Exception as e:
+            logger.exception("Ошибка архивации: %s", e)
+
+async def run_webhook(dp: Dispatcher):
+    """Прием апдейтов через aiohttp; обработчик выполняется до ответа, чтобы вернуть метод в теле ответа"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Webhook слушает http://%s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info("Webhook зарегистрирован: %s%s", WEBHOOK_URL.rstrip('/'), WEBHOOK_PATH)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def refresh_topology(interval, shard=None):
+    """Шарды и процесс приема не видят правок /start и /settings из других процессов - перечитываем.
+    Шард shard также подхватывает запросы своих чатов дропов, созданные другими шардами"""
+    shard_router = ShardRouter(topology, SHARDS)
+    while not is_shutting_down:
+        await asyncio.sleep(interval)
+        try:
+            await topology.reload(db)
+            if shard is not None:
+                for drops_chat in await pending.sync(lambda chat: shard_router.shard(chat) == shard):
+                    counter_updater.schedule(drops_chat, legacy_calls=0)
+        except Exception as e:
+            logger.error("Ошибка обновления маршрутизации: %s", e)
+
+def run_worker(index, queue):
+    """Точка входа процесса-шарда; SIGINT получает процесс приема и останавливает шарды через очередь"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(worker_main(index, queue))
+    finally:
+        # процесс multiprocessing завершается без atexit - дописываем очередь логов явно
+        stop_logging()
+
+async def worker_main(index, queue):
+    global is_shard_worker
+    is_shard_worker = True
+    dp = Dispatcher()
+    dp.include_router(router)
+    logger.info("Шард %d запущен (pid %d)", index, os.getpid())
+    try:
+        await start_metrics(METRICS_PORT + 1 + index)
+        install_profile_signals()
+        if index == 0:
+            asyncio.create_task(schedule_daily_report())
+            if RETENTION_DAYS:
+                asyncio.create_task(schedule_retention())
+        asyncio.create_task(refresh_topology(SHARD_TOPOLOGY_REFRESH, index))
+        runner = ChatOrderedRunner(lambda update: dp.feed_raw_update(bot, update))
+        await consume_shard(queue, runner)
+        logger.info("Шард %d: обработано %d апдейтов", index, runner.processed)
+    finally:
+        await shutdown(dp, bot)
+
+async def run_sharded(dp: Dispatcher):
+    processes, queues = start_workers(run_worker, SHARDS)
+    shard_router = ShardRouter(topology, SHARDS)
+
+    def dispatch(update):
+        shard, key = shard_router.route(update)
+        queues[shard].put((key, update))
+
+    asyncio.create_task(refresh_topology(SHARD_TOPOLOGY_REFRESH))
+    await start_metrics(METRICS_PORT)
+    try:
+        if RUN_MODE == "webhook":
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET or None,
+                    allowed_updates=dp.resolve_used_update_types()
+                )
+            logger.info("Прием через webhook http://%s:%s%s, шардов: %d", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, SHARDS)
+            await serve_webhook(dispatch, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET or None)
+        else:
+            logger.info("Прием через polling, шардов: %d", SHARDS)
+            await poll_updates(bot, dispatch, dp.resolve_used_update_types())
+    finally:
+        stop_workers(processes, queues)
+
 async def main():
     
     signal.signal(signal.SIGINT, handle_sigint)
@@ -1401,12 +1583,26 @@ async def main():
     dp.include_router(router)
     
     try:
-        print("Бот запущен. Для завершения нажмите Ctrl+C")
-        
+        for version, name, duration_ms in db.applied_migrations:
+            logger.info("Применена миграция %d (%s) за %.1f мс", version, name, duration_ms)
+        logger.info("Версия схемы БД: %d", db.schema_version)
+        logger.info("Конфигурация OCR: %s", " + ".join(ocr_pool.config))
+        logger.info("Бот запущен. Для завершения нажмите Ctrl+C")
+        
+        if SHARDS > 1:
+            await run_sharded(dp)
+            return
         asyncio.create_task(schedule_daily_report())
-        await dp.start_polling(bot)
+        if RETENTION_DAYS:
+            asyncio.create_task(schedule_retention())
+        await start_metrics(METRICS_PORT)
+        install_profile_signals()
+        if RUN_MODE == "webhook":
+            await run_webhook(dp)
+        else:
+            await dp.start_polling(bot)
     except Exception as e:
-        print(f"Ошибка в главном цикле: {e}")
+        logger.exception("Ошибка в главном цикле: %s", e)
     finally:
         await shutdown(dp, bot)
 
@@ -1414,12 +1610,12 @@ if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\nПолучен сигнал завершения работы")
+        logger.info("Получен сигнал завершения работы")
     except Exception as e:
-        print(f"Критическая ошибка: {e}")
+        logger.exception("Критическая ошибка: %s", e)
     finally:
         
-        if 'conn' in globals() and conn:
-            conn.close()
-            print("Соединение с базой данных закрыто")
+        if 'db' in globals() and db:
+            db.close_sync()
+            logger.info("Соединение с базой данных закрыто")
         sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,181 @@
+import bisect
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Gauge:
+    """Значение снимается при выдаче метрик: collect() -> {значения меток: число}"""
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in (self.collect() if self.collect else {}).items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """{значения меток: (число, сумма, счетчики по корзинам)}"""
+        with self._lock:
+            return {labels: (count, total, list(counts)) for labels, (counts, total, count) in self.series.items()}
+
+    def quantile(self, counts, q):
+        """Оценка квантиля по корзинам с линейной интерполяцией"""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (count, total, counts) in self.snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Время выполнения обработчика апдейта", ("handler",)))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках", ("handler",)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_query_seconds", "Время выполнения запроса SQLite в потоке БД", ("query",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)))
+API_CALLS = REGISTRY.register(Counter(
+    "bot_api_calls_total", "Запросы к Bot API по методам и результату", ("method", "result")))
+API_SECONDS = REGISTRY.register(Histogram(
+    "bot_api_seconds", "Время запроса к Bot API", ("method",)))
+RETRY_AFTER_SECONDS = REGISTRY.register(Counter(
+    "bot_api_retry_after_seconds_total", "Суммарное ожидание по 429 Too Many Requests", ("method",)))
+RETENTION_ROWS = REGISTRY.register(Counter(
+    "bot_retention_archived_rows_total", "Строки, перенесенные в архив", ("table",)))
+RETENTION_RECLAIMED_BYTES = REGISTRY.register(Counter(
+    "bot_retention_reclaimed_bytes_total", "Место, возвращенное incremental_vacuum"))
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """GET /metrics в формате Prometheus; возвращает runner для остановки"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def summary_lines(top=5):
+    """Текстовая сводка для команды /metrics"""
+    lines = ["Обработчики (вызовов, ср., p95):"]
+    handlers = sorted(HANDLER_SECONDS.snapshot().items(), key=lambda item: -item[1][0])
+    for (name,), (count, total, counts) in handlers:
+        errors = HANDLER_ERRORS.values.get((name,), 0)
+        lines.append(f"  {name}: {count}, {total / count * 1000:.0f} мс, "
+                     f"{HANDLER_SECONDS.quantile(counts, 0.95) * 1000:.0f} мс" + (f", ошибок {errors}" if errors else ""))
+
+    lines.append(f"SQLite, топ-{top} по суммарному времени (вызовов, ср., p95):")
+    queries = sorted(DB_QUERY_SECONDS.snapshot().items(), key=lambda item: -item[1][1])[:top]
+    for (query,), (count, total, counts) in queries:
+        lines.append(f"  {query[:60]}: {count}, {total / count * 1000:.2f} мс, "
+                     f"{DB_QUERY_SECONDS.quantile(counts, 0.95) * 1000:.2f} мс")
+
+    lines.append("Bot API (ок / ошибок / 429):")
+    methods = {}
+    for (method, result), value in list(API_CALLS.values.items()):
+        methods.setdefault(method, {})[result] = value
+    for method, results in sorted(methods.items(), key=lambda item: -sum(item[1].values())):
+        lines.append(f"  {method}: {results.get('ok', 0)} / {results.get('error', 0)} / {results.get('retry_after', 0)}")
+    waited = sum(RETRY_AFTER_SECONDS.values.values())
+    if waited:
+        lines.append(f"Ожидание по 429: {waited} с")
+    return lines
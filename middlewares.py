@@ -0,0 +1,90 @@
+import logging
+import sys
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from logs import bind, unbind
+from metrics import API_CALLS, API_SECONDS, HANDLER_ERRORS, HANDLER_SECONDS, RETRY_AFTER_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+
+def event_chat_id(event):
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    return chat.id if chat else None
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: время и ошибки по имени функции-обработчика.
+    Записи лога внутри обработчика получают поля chat_id и handler"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        token = bind(chat_id=event_chat_id(event), handler=name, update_type=type(event).__name__)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, name)
+            logger.debug("%s обработан за %.1f мс", name, elapsed * 1000, extra={"latency_ms": round(elapsed * 1000, 2)})
+            unbind(token)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: число запросов, ошибки и 429 по методам Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            result = await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            API_CALLS.inc(name, "retry_after")
+            RETRY_AFTER_SECONDS.inc(name, amount=e.retry_after)
+            raise
+        except Exception:
+            API_CALLS.inc(name, "error")
+            raise
+        else:
+            API_CALLS.inc(name, "ok")
+            return result
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Отмечает кадр выбранных для профилирования апдейтов, по нему StackSampler относит сэмплы к обработчику"""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    async def __call__(self, handler, event, data):
+        if not self.profiler.should_sample():
+            return await handler(event, data)
+        handler_object = data.get("handler")
+        frame = sys._getframe()
+        self.profiler.enter(frame, handler_object.callback.__name__ if handler_object else type(event).__name__)
+        try:
+            return await handler(event, data)
+        finally:
+            self.profiler.exit(frame)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """Все db.write() обработчика фиксируются одной транзакцией после его завершения"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(self, handler, event, data):
+        async with self.db.unit_of_work():
+            return await handler(event, data)
@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pytesseract
+
+
+logger = logging.getLogger(__name__)
+
+WHITELIST = '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+TESSERACT_CONFIGS = {
+    "psm6": f'--oem 3 --psm 6 {WHITELIST}',
+    "psm7": f'--oem 3 --psm 7 {WHITELIST}',
+    "psm13": f'--oem 3 --psm 13 {WHITELIST}',
+}
+CODE_RE = re.compile(r'([A-Z0-9]{4})[-\s]*([A-Z0-9]{4})')
+RESULT_RE = re.compile(r'^[A-Z0-9]{4}-[A-Z0-9]{4}$')
+
+NOT_RECOGNIZED = "Код не распознан"
+RECOGNITION_ERROR = "Ошибка распознавания"
+
+MIN_PHOTO_WIDTH = 540
+MIN_GLYPH_HEIGHT = 32
+ROI_MARGIN = 0.25
+
+
+def decode_image(data: bytes):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("не удалось декодировать изображение")
+    return img
+
+
+def preprocess_image(data: bytes):
+    img = decode_image(data)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img_resized = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    _, binary = cv2.threshold(img_resized, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    return binary
+
+
+def find_code_region(gray):
+    """Поиск строки текста, похожей на код: широкий блок с наибольшей высотой глифов"""
+    height, width = gray.shape[:2]
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 40), 1))
+    lines = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    best = None
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < 8 or h > height // 5 or not 3 <= w / h <= 15:
+            continue
+        if best is None or (h, w) > (best[3], best[2]):
+            best = (x, y, w, h)
+    return best
+
+
+def _code_crop(data: bytes):
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("не удалось декодировать изображение")
+    region = find_code_region(gray)
+    if region is None:
+        return None
+
+    x, y, w, h = region
+    margin = int(h * ROI_MARGIN) + 2
+    crop = gray[max(0, y - margin):y + h + margin, max(0, x - margin):x + w + margin]
+    if h < MIN_GLYPH_HEIGHT:
+        scale = MIN_GLYPH_HEIGHT / h
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    return crop
+
+
+def preprocess_fast(data: bytes):
+    """Обрезка до области кода; увеличение только для мелких глифов. None - область не найдена"""
+    crop = _code_crop(data)
+    if crop is None:
+        return None
+    _, binary = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    if cv2.mean(binary)[0] < 127:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+
+def preprocess_roi_gray(data: bytes):
+    """Область кода без бинаризации - Tesseract сам порогует изображение"""
+    crop = _code_crop(data)
+    if crop is None:
+        return None
+    if cv2.mean(crop)[0] < 127:
+        crop = cv2.bitwise_not(crop)
+    return crop
+
+
+PREPROCESSORS = {
+    "full2x": preprocess_image,
+    "roi": preprocess_fast,
+    "roi_gray": preprocess_roi_gray,
+}
+
+LEGACY_CONFIG = ("full2x", "psm6")
+DEFAULT_CONFIG = ("roi", "psm6")
+
+
+def all_configs():
+    return [(preprocess, tesseract) for preprocess in PREPROCESSORS for tesseract in TESSERACT_CONFIGS]
+
+
+def _read_code(image, tesseract: str = "psm6") -> str:
+    text = pytesseract.image_to_string(image, config=TESSERACT_CONFIGS[tesseract]).strip().upper()
+    match = CODE_RE.search(text)
+    if match:
+        return f"{match.group(1)}-{match.group(2)}"
+    return NOT_RECOGNIZED
+
+
+def recognize_with(data: bytes, config) -> str:
+    """Один проход OCR конфигурацией (предобработка, режим Tesseract), без запасного варианта"""
+    preprocess, tesseract = config
+    image = PREPROCESSORS[preprocess](data)
+    if image is None:
+        return NOT_RECOGNIZED
+    return _read_code(image, tesseract)
+
+
+def recognize_code(data: bytes, config=DEFAULT_CONFIG) -> str:
+    """Распознавание кода XXXX-XXXX из байтов изображения (выполняется в процессе пула)"""
+    try:
+        result = recognize_with(data, config)
+        if result == NOT_RECOGNIZED and tuple(config) != LEGACY_CONFIG:
+            result = recognize_with(data, LEGACY_CONFIG)
+        return result
+    except Exception as e:
+        logger.error("Ошибка распознавания: %s", e)
+        return RECOGNITION_ERROR
+
+
+def choose_config(profile_path: str, target_accuracy: float):
+    """Самая быстрая конфигурация из профиля bench_ocr.py с точностью не ниже целевой"""
+    if not os.path.exists(profile_path):
+        return DEFAULT_CONFIG
+    try:
+        with open(profile_path, encoding="utf-8") as f:
+            results = json.load(f)["results"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Не удалось прочитать профиль OCR %s: %s", profile_path, e)
+        return DEFAULT_CONFIG
+
+    suitable = [r for r in results
+                if r["accuracy"] >= target_accuracy
+                and r["preprocess"] in PREPROCESSORS and r["tesseract"] in TESSERACT_CONFIGS]
+    if not suitable:
+        logger.warning("В профиле OCR нет конфигурации с точностью >= %.0f%%, используется по умолчанию", target_accuracy * 100)
+        return DEFAULT_CONFIG
+    best = min(suitable, key=lambda r: r["mean_ms"])
+    return best["preprocess"], best["tesseract"]
+
+
+def select_photo(photos, min_width: int = MIN_PHOTO_WIDTH):
+    """Наименьший размер фото, достаточный для OCR (иначе самый большой)"""
+    for photo in sorted(photos, key=lambda p: p.width * p.height):
+        if photo.width >= min_width:
+            return photo
+    return max(photos, key=lambda p: p.width * p.height)
+
+
+def is_code(result: str) -> bool:
+    return bool(RESULT_RE.match(result))
+
+
+def _load_cache(conn, now, limit):
+    conn.execute('DELETE FROM ocr_cache WHERE expires_at < ?', (now,))
+    conn.commit()
+    return conn.execute('''SELECT cache_key, result, expires_at FROM ocr_cache
+                        ORDER BY expires_at DESC LIMIT ?''', (limit,)).fetchall()
+
+
+class OcrCache:
+    """LRU-кэш распознанных кодов с TTL; ключи - file_unique_id и хэш изображения"""
+
+    def __init__(self, max_size: int, ttl: float, db=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db = db
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Прогрев кэша из SQLite при старте"""
+        if self.db is not None:
+            for cache_key, result, expires_at in reversed(self.db.run_sync(_load_cache, time.time(), self.max_size)):
+                self._entries[cache_key] = (result, expires_at)
+        return self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            result, expires_at = entry
+            if expires_at >= time.time():
+                self._entries.move_to_end(key)
+                return result
+            del self._entries[key]
+        return None
+
+    async def put(self, keys, result):
+        expires_at = time.time() + self.ttl
+        for key in keys:
+            self._entries[key] = (result, expires_at)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        if self.db is not None:
+            await self.db.executemany('INSERT OR REPLACE INTO ocr_cache (cache_key, result, expires_at) VALUES (?, ?, ?)',
+                                      [(key, result, expires_at) for key in keys])
+
+
+class OcrPool:
+    """Пул процессов для OCR; max_pending ограничивает число одновременных задач"""
+
+    def __init__(self, workers: int, max_pending: int, cache: OcrCache = None, config=DEFAULT_CONFIG):
+        self.workers = workers
+        self.cache = cache
+        self.config = config
+        self._executor = None
+        self._slots = asyncio.Semaphore(max_pending)
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: fork копировал бы процесс с работающими потоками БД, логирования и профилировщика
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def recognize(self, data: bytes) -> str:
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool(), recognize_code, data, self.config)
+
+    async def recognize_photo(self, bot, photo) -> str:
+        """Скачивание фото в память и распознавание без временных файлов"""
+        try:
+            keys = [f"uid:{photo.file_unique_id}"]
+            if self.cache is not None:
+                cached = self.cache.get(keys[0])
+                if cached is not None:
+                    self.cache.hits += 1
+                    return cached
+
+            buffer = await bot.download(photo.file_id)
+            data = buffer.getvalue()
+
+            if self.cache is not None:
+                keys.append(f"sha1:{hashlib.sha1(data).hexdigest()}")
+                cached = self.cache.get(keys[1])
+                if cached is not None:
+                    self.cache.hits += 1
+                    await self.cache.put(keys[:1], cached)
+                    return cached
+                self.cache.misses += 1
+
+            result = await self.recognize(data)
+            if self.cache is not None and is_code(result):
+                await self.cache.put(keys, result)
+            return result
+        except Exception as e:
+            logger.error("Ошибка распознавания фото %s: %s", photo.file_id, e)
+            return RECOGNITION_ERROR
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,173 @@
+import bisect
+import time
+from collections import deque, namedtuple
+
+from locks import KeyedLock
+
+
+PendingRequest = namedtuple("PendingRequest", ["request_id", "office_chat_id", "drops_chat_id", "request_message_id"])
+
+
+def load_pending(conn):
+    return conn.execute('''SELECT request_id, office_chat_id, drops_chat_id, request_message_id
+                        FROM num_requests
+                        WHERE status = 'pending'
+                        ORDER BY request_id''').fetchall()
+
+
+def insert_requests(conn, office_chat_id, drops_chat_id, request_message_id, count):
+    """count запросов одним executemany внутри транзакции; возвращает их request_id по порядку.
+    executemany не отдает lastrowid - id выбираются по сообщению запроса (запись идет только из потока БД)"""
+    conn.executemany('''INSERT INTO num_requests
+                    (office_chat_id, drops_chat_id, request_message_id, status, created_at)
+                    VALUES (?, ?, ?, 'pending', ?)''',
+                     [(office_chat_id, drops_chat_id, request_message_id, int(time.time()))] * count)
+    rows = conn.execute('''SELECT request_id FROM num_requests
+                        WHERE office_chat_id = ? AND request_message_id = ?
+                        ORDER BY request_id DESC LIMIT ?''',
+                        (office_chat_id, request_message_id, count)).fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def delete_requests(conn, office_chat_id, request_message_id, request_id=None):
+    if request_id is None:
+        conn.execute('DELETE FROM num_requests WHERE office_chat_id = ? AND request_message_id = ?',
+                     (office_chat_id, request_message_id))
+    else:
+        conn.execute('''DELETE FROM num_requests
+                        WHERE request_id = ? AND office_chat_id = ? AND request_message_id = ?''',
+                     (request_id, office_chat_id, request_message_id))
+
+
+class PendingRequests:
+    """FIFO-очереди ожидающих запросов номеров по чатам дропов поверх таблицы num_requests.
+    Изменения очереди одного чата дропов (push, assign) идут под его блокировкой locks"""
+
+    def __init__(self, db):
+        self.db = db
+        self._queues = {}
+        self.locks = KeyedLock()
+        # request_id, взятые take и еще не подтвержденные в БД -> эпоха sync на момент take
+        self._taken = {}
+        self._epoch = 0
+
+    def _rebuild(self, rows):
+        queues = {}
+        for row in rows:
+            request = PendingRequest(*row)
+            queues.setdefault(request.drops_chat_id, deque()).append(request)
+        self._queues = queues
+
+    def load(self):
+        """Восстановление очередей из БД при старте"""
+        self._rebuild(self.db.run_sync(load_pending))
+        return self
+
+    async def reload(self):
+        self._rebuild(await self.db.run(load_pending))
+
+    def count(self, drops_chat_id) -> int:
+        queue = self._queues.get(drops_chat_id)
+        return len(queue) if queue else 0
+
+    async def push(self, office_chat_id, drops_chat_id, request_message_id) -> PendingRequest:
+        return (await self.push_many(office_chat_id, drops_chat_id, request_message_id, 1))[0]
+
+    async def push_many(self, office_chat_id, drops_chat_id, request_message_id, count):
+        """count запросов от одного сообщения одной транзакцией"""
+        async with self.locks(drops_chat_id):
+            request_ids = await self.db.transaction(insert_requests, office_chat_id, drops_chat_id,
+                                                    request_message_id, count)
+            requests = [PendingRequest(request_id, office_chat_id, drops_chat_id, request_message_id)
+                        for request_id in request_ids]
+            self._queues.setdefault(drops_chat_id, deque()).extend(requests)
+            return requests
+
+    async def assign(self, drops_chat_id, send, save, *args):
+        """Выдача самого старого запроса: take -> await send(request) -> db.write(save, request, результат, *args)
+        -> db.flush() целиком под блокировкой чата дропов. Возвращает (запрос, результат send) или None,
+        если запросов нет. Запись фиксируется до возврата: ответ на отправленное сообщение (фото с кодом)
+        может прийти раньше конца апдейта. Ошибка send или фиксации возвращает запрос на место.
+        В send - только то, что должно идти строго по очереди (сообщение в офис), остальное - после"""
+        async with self.locks(drops_chat_id):
+            request = self.take(drops_chat_id)
+            if request is None:
+                return None
+            try:
+                result = await send(request)
+            except Exception:
+                self.restore(request)
+                raise
+            self.db.on_rollback(self.restore, request)
+            await self.db.write(save, request, result, *args)
+            await self.db.flush()
+            return request, result
+
+    def take(self, drops_chat_id):
+        """Извлекает самый старый запрос; перевод в 'fulfilled' сохраняет вызывающий код"""
+        queue = self._queues.get(drops_chat_id)
+        if not queue:
+            return None
+        request = queue.popleft()
+        self._taken[request.request_id] = self._epoch
+        return request
+
+    def restore(self, request: PendingRequest):
+        """Возвращает невыполненный запрос на его место по request_id: откаты единиц работы
+        приходят в произвольном порядке, голова очереди - только частный случай"""
+        self._taken.pop(request.request_id, None)
+        queue = self._queues.setdefault(request.drops_chat_id, deque())
+        if not queue or request < queue[0]:
+            queue.appendleft(request)
+        else:
+            # PendingRequest сравнивается по request_id - первому полю
+            queue.insert(bisect.bisect_left(queue, request), request)
+
+    async def sync(self, owns):
+        """Шард: подхватывает ожидающие запросы своих чатов дропов, созданные другим шардом
+        (/n, пришедший до обновления маршрутизации), и забывает очереди чужих чатов.
+        Взятые этим процессом запросы, чья запись еще не зафиксирована, не возвращаются.
+        Возвращает чаты дропов, в которые добавлены запросы"""
+        epoch = self._epoch
+        self._epoch += 1
+        rows = await self.db.run(load_pending)
+        in_db = {row[0] for row in rows}
+        # не в БД среди ожидающих и взяты до чтения - запись зафиксирована
+        self._taken = {request_id: taken_at for request_id, taken_at in self._taken.items()
+                       if request_id in in_db or taken_at > epoch}
+
+        found = {}
+        for row in rows:
+            request = PendingRequest(*row)
+            found.setdefault(request.drops_chat_id, []).append(request)
+        adopted = set()
+        for drops_chat_id, requests in found.items():
+            if not owns(drops_chat_id):
+                continue
+            # под блокировкой чата нет незавершенного push_many: его запросы уже в очереди
+            async with self.locks(drops_chat_id):
+                known = {request.request_id for request in self._queues.get(drops_chat_id, ())}
+                for request in requests:
+                    if request.request_id not in known and request.request_id not in self._taken:
+                        self.restore(request)
+                        adopted.add(drops_chat_id)
+        for drops_chat_id in [chat for chat in self._queues if not owns(chat)]:
+            async with self.locks(drops_chat_id):
+                self._queues.pop(drops_chat_id, None)
+        return adopted
+
+    async def discard_message(self, office_chat_id, request_message_id, request_id=None):
+        """Удаляет запросы недоступного сообщения офиса (id сообщений уникальны только в чате);
+        request_id - только этот запрос: остальные запросы пакета /n N живы и выдаются без ответа.
+        Удаление идет в единице работы апдейта. Без блокировки:
+        вызывается из send внутри assign, когда блокировка чата уже занята"""
+        await self.db.write(delete_requests, office_chat_id, request_message_id, request_id)
+
+        def discarded(request):
+            return (request.office_chat_id == office_chat_id
+                    and request.request_message_id == request_message_id
+                    and request_id in (None, request.request_id))
+
+        for drops_chat_id, queue in self._queues.items():
+            if any(discarded(request) for request in queue):
+                self._queues[drops_chat_id] = deque(request for request in queue if not discarded(request))
@@ -0,0 +1,25 @@
+import re
+from typing import List, Union
+
+
+PHONE_RE = re.compile(r'(?:\+7|7|8)?[\s\-]?\(?([0-9]{3})\)?[\s\-]?([0-9]{3})[\s\-]?([0-9]{2})[\s\-]?([0-9]{2})')
+DIGIT_RUN_RE = re.compile(r'[0-9]{3}')
+MIN_LENGTH = 10
+
+
+def extract_phones(text: str) -> List[str]:
+    """Все номера из текста в формате +7XXXXXXXXXX, без повторов, в порядке появления"""
+    if not text or len(text) < MIN_LENGTH or not DIGIT_RUN_RE.search(text):
+        return []
+
+    phones = []
+    for groups in PHONE_RE.findall(text):
+        phone = '+7%s%s%s%s' % groups
+        if phone not in phones:
+            phones.append(phone)
+    return phones
+
+
+def extract_phone(text: str) -> Union[str, None]:
+    phones = extract_phones(text)
+    return phones[0] if phones else None
@@ -0,0 +1,142 @@
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+class StackSampler:
+    """Сэмплирующий профайлер обработчиков.
+
+    Для выбранной доли апдейтов middleware регистрирует кадр своей корутины; фоновый поток
+    каждые interval секунд снимает стек потока event loop и, если в нем есть такой кадр,
+    записывает стек ниже него в счетчик обработчика. Асинхронные обработчики чередуются,
+    поэтому в отличие от cProfile в выборку попадает только время, когда обработчик
+    действительно выполнялся. Пока event loop занят, поток-сэмплер получает GIL не чаще
+    sys.getswitchinterval() (5 мс), поэтому короткие участки видны только статистически."""
+
+    def __init__(self):
+        self.enabled = False
+        self.rate = 0.0
+        self.interval = 0.005
+        self.trace_memory = False
+        self.started_at = None
+        self.stacks = {}
+        self.updates = Counter()
+        self.cpu_time = Counter()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def should_sample(self) -> bool:
+        return self.enabled and random.random() < self.rate
+
+    def enter(self, frame, handler_name):
+        self._active[frame] = handler_name
+        self.updates[handler_name] += 1
+
+    def exit(self, frame):
+        self._active.pop(frame, None)
+
+    def start(self, rate, interval=0.005, trace_memory=True):
+        """Вызывается из потока event loop - его стек и будет сниматься"""
+        if self.enabled:
+            self.rate = rate
+            return
+        self.rate = rate
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.stacks = {}
+        self.updates = Counter()
+        self.cpu_time = Counter()
+        self.started_at = time.time()
+        self._target = threading.get_ident()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        self.enabled = True
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._active.clear()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._sample(frame, now - last)
+            last = now
+
+    def _sample(self, frame, weight):
+        """weight - фактическое время с прошлого сэмпла, им оценивается время обработчика на CPU"""
+        stack = []
+        while frame is not None:
+            handler_name = self._active.get(frame)
+            if handler_name is not None:
+                stack.append(handler_name)
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                    self.cpu_time[handler_name] += weight
+                return
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+
+    def handler_samples(self):
+        totals = Counter()
+        with self._lock:
+            for key, count in self.stacks.items():
+                totals[key.split(";", 1)[0]] += count
+        return totals
+
+    def summary_lines(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        lines = [f"Профилирование: {'включено' if self.enabled else 'выключено'}, доля апдейтов {self.rate:.0%}, "
+                 f"интервал {self.interval * 1000:.0f} мс, длительность {elapsed:.0f} с"]
+        samples = self.handler_samples()
+        for handler_name, count in self.updates.most_common():
+            lines.append(f"  {handler_name}: апдейтов {count}, сэмплов {samples.get(handler_name, 0)} "
+                         f"(~{self.cpu_time.get(handler_name, 0) * 1000:.0f} мс на CPU)")
+        return lines
+
+    def dump(self, directory, top_allocations=25):
+        """Свертка стеков (flamegraph.pl, speedscope) и top аллокаций tracemalloc; возвращает пути файлов"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        paths = []
+
+        folded_path = os.path.join(directory, f"profile_{stamp}_{os.getpid()}.folded")
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for key, count in stacks:
+                f.write(f"{key} {count}\n")
+        paths.append(folded_path)
+
+        report_path = os.path.join(directory, f"profile_{stamp}_{os.getpid()}.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.summary_lines()) + "\n")
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                f.write(f"\ntracemalloc: сейчас {current / 1024:.0f} КБ, пик {peak / 1024:.0f} КБ\n")
+                f.write(f"Топ-{top_allocations} мест аллокаций:\n")
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:top_allocations]:
+                    f.write(f"{stat}\n")
+        paths.append(report_path)
+        return paths
@@ -0,0 +1,78 @@
+"""Отправка записанных апдейтов в локальный webhook бота (RUN_MODE = "webhook").
+
+Файл апдейтов - JSON Lines (один Update на строку) или сохраненный ответ getUpdates ({"ok": true, "result": [...]}).
+Печатает статус, задержку и метод, который бот вернул в теле ответа.
+
+Запуск: python replay_updates.py updates.jsonl [--url http://127.0.0.1:8080/webhook] [--secret S] [--concurrency 1]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict) and "result" in data:
+        return data["result"]
+    if isinstance(data, list):
+        return data
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def post_update(session, url, headers, update):
+    started = time.perf_counter()
+    async with session.post(url, json=update, headers=headers) as response:
+        body = await response.text()
+    elapsed = (time.perf_counter() - started) * 1000
+    method = None
+    if body:
+        try:
+            method = json.loads(body).get("method")
+        except ValueError:
+            pass
+    return update.get("update_id"), response.status, elapsed, method
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("updates", help="файл с апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных запросов")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        async def replay(update):
+            async with slots:
+                return await post_update(session, args.url, headers, update)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(replay(update) for update in updates))
+        total = time.perf_counter() - started
+
+    for update_id, status, elapsed, method in results:
+        print(f"update {update_id}: HTTP {status}, {elapsed:.1f} мс" + (f", ответ: {method}" if method else ""))
+
+    latencies = [elapsed for _, _, elapsed, _ in results]
+    if latencies:
+        print(f"\nАпдейтов: {len(results)}, ошибок HTTP: {sum(1 for r in results if r[1] != 200)}, "
+              f"ответов методом: {sum(1 for r in results if r[3])}")
+        print(f"Задержка: ср. {statistics.mean(latencies):.1f} мс, макс. {max(latencies):.1f} мс, "
+              f"{len(results) / total:.1f} апдейтов/с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+import html
+
+
+MESSAGE_LIMIT = 4096
+
+
+STAT_FIELDS = ("registered", "failed", "slet")
+
+
+def bump_daily_stat(conn, day, drops_chat_id, office_chat_id, field):
+    """+1 к счетчику суток; вызывается внутри транзакции перехода статуса"""
+    if field not in STAT_FIELDS:
+        raise ValueError(f"неизвестный счетчик {field}")
+    conn.execute(f'''INSERT INTO daily_stats (day, drops_chat_id, office_chat_id, {field})
+                    VALUES (?, ?, ?, 1)
+                    ON CONFLICT (day, drops_chat_id, office_chat_id) DO UPDATE SET {field} = {field} + 1''',
+                 (day, drops_chat_id or 0, office_chat_id or 0))
+
+
+def unbump_daily_stat(conn, day, drops_chat_id, office_chat_id, field):
+    """-1 при отмене перехода (✅ <-> ❌): строка офиса, иначе строка чата с ненулевым счетчиком
+    (старые регистрации сведены миграцией с офисом 0); ниже нуля не опускается"""
+    if field not in STAT_FIELDS:
+        raise ValueError(f"неизвестный счетчик {field}")
+    row = conn.execute(f'''SELECT office_chat_id FROM daily_stats
+                        WHERE day = ? AND drops_chat_id = ? AND {field} > 0
+                        ORDER BY office_chat_id = ? DESC LIMIT 1''',
+                       (day, drops_chat_id or 0, office_chat_id or 0)).fetchone()
+    if row:
+        conn.execute(f'''UPDATE daily_stats SET {field} = {field} - 1
+                        WHERE day = ? AND drops_chat_id = ? AND office_chat_id = ?''',
+                     (day, drops_chat_id or 0, row[0]))
+
+
+def load_day_stats(conn, day):
+    """{чат дропов: (встало, не встало, слётов)} за сутки - O(чатов), без сканирования phone_messages"""
+    rows = conn.execute('''SELECT drops_chat_id, SUM(registered), SUM(failed), SUM(slet)
+                        FROM daily_stats WHERE day = ?
+                        AND drops_chat_id IN (SELECT chat_id FROM drops_chats)
+                        GROUP BY drops_chat_id''', (day,)).fetchall()
+    return {drops_chat_id: (registered, failed, slet) for drops_chat_id, registered, failed, slet in rows}
+
+
+def sum_stats(stats):
+    return tuple(sum(values) for values in zip(*stats.values())) if stats else (0, 0, 0)
+
+
+def load_day_registrations(conn, day_start, day_end):
+    """Регистрации за сутки по всем чатам дропов одним запросом (idx_phone_messages_registration);
+    номера, переведенные в ❌ после ✅, не попадают"""
+    return conn.execute('''SELECT chat_id, phone, registration_time, username, first_name, last_name, user_id
+                        FROM phone_messages
+                        WHERE registration_time >= ? AND registration_time < ?
+                        AND chat_id IN (SELECT chat_id FROM drops_chats)
+                        AND status IS NOT 'fail'
+                        ORDER BY chat_id, registration_time''', (day_start, day_end)).fetchall()
+
+
+def user_mention(username, first_name, user_id):
+    if username:
+        return f"@{html.escape(username)}"
+    if first_name:
+        return html.escape(first_name)
+    return f"ID: {user_id}"
+
+
+def daily_report_lines(rows, report_date, totals):
+    """Строки сводного отчета; время берется из 'YYYY-MM-DD HH:MM:SS' срезом, без strptime.
+    totals - (встало, не встало, слётов) из daily_stats; «Всего регистраций» считается по rows,
+    чтобы итог совпадал с перечисленными строками"""
+    _, failed, slet = totals
+    registered = len(rows)
+    if not rows and not any(totals):
+        yield "📊 Отчет за день:"
+        yield "Регистраций не было"
+        return
+
+    yield f"📊 Сводный отчет за {report_date.strftime('%d.%m.%Y')}:"
+    yield ""
+    for _, phone, reg_time, username, first_name, last_name, user_id in rows:
+        yield f"📱 {phone} {reg_time[11:16]} {user_mention(username, first_name, user_id)}"
+    yield ""
+    yield f"📈 Всего регистраций: {registered}"
+    if failed:
+        yield f"❌ Не встало: {failed}"
+    if slet:
+        yield f"🔴 Слётов: {slet}"
+
+
+def text_length(text: str) -> int:
+    """Длина в единицах UTF-16 - так Telegram считает лимит (эмодзи занимают 2)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def chunk_lines(lines, limit=MESSAGE_LIMIT):
+    """Склейка строк в сообщения не длиннее limit; строки не разрываются, если помещаются целиком"""
+    chunk = []
+    size = 0
+    for line in lines:
+        length = text_length(line)
+        while length > limit:
+            if chunk:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+            yield line[:limit // 2]
+            line = line[limit // 2:]
+            length = text_length(line)
+        extra = length + (1 if chunk else 0)
+        if chunk and size + extra > limit:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+            extra = length
+        chunk.append(line)
+        size += extra
+    if chunk:
+        yield "\n".join(chunk)
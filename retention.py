@@ -0,0 +1,179 @@
+"""Архивация старых строк num_requests и phone_messages в отдельный файл SQLite.
+
+Строки старше max_age (по created_at) переносятся пачками: каждая пачка - короткая транзакция
+в потоке БД (INSERT в archive + DELETE из main), между пачками поток БД обслуживает обработчики.
+Ожидающие запросы не трогаются. Таблицы архива повторяют таблицы основной БД;
+/export подключает архив (export.write_export, archive_path) и выгружает обе части.
+
+В WAL транзакция над двумя файлами не атомарна: после сбоя между фиксациями строка может
+остаться в обоих - повторный перенос ее пропускает (INSERT OR IGNORE по ключу).
+
+Освобожденные страницы возвращаются incremental_vacuum, если БД создана с auto_vacuum=INCREMENTAL;
+старую БД переводит разовый VACUUM: python retention.py --db bot_db.sqlite --convert (бот остановлен).
+
+Запуск вручную: python retention.py --db bot_db.sqlite [--archive bot_db_archive.sqlite] [--days 30]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from db import Database
+
+
+logger = logging.getLogger(__name__)
+
+# таблица, какие строки можно переносить, уникальный ключ строки в архиве
+RETENTION_TABLES = (
+    ("num_requests", "status != 'pending'", ("request_id",)),
+    ("phone_messages", "1", ("phone", "created_at")),
+)
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def archive_path_for(db_path):
+    return f"{os.path.splitext(db_path)[0]}_archive.sqlite"
+
+
+def attach_archive(conn, path):
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    for table, _, key in RETENTION_TABLES:
+        columns = [(row[1], row[2]) for row in conn.execute(f'PRAGMA main.table_info({table})')]
+        definitions = ", ".join(f"{name} {column_type}" for name, column_type in columns)
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS archive.{table} (
+                        {definitions}, archived_at INTEGER, UNIQUE ({", ".join(key)}))''')
+        # колонки, добавленные миграциями после создания архива
+        existing = {row[1] for row in conn.execute(f'PRAGMA archive.table_info({table})')}
+        for name, column_type in columns:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {column_type}')
+    conn.execute('''CREATE INDEX IF NOT EXISTS archive.idx_phone_messages_registration
+                    ON phone_messages (chat_id, registration_time)''')
+    conn.commit()
+
+
+def detach_archive(conn):
+    conn.execute('DETACH DATABASE archive')
+
+
+def move_batch(conn, table, condition, cutoff, batch_size) -> int:
+    """Одна пачка самых старых по rowid строк: копия в архив и удаление одной транзакцией"""
+    columns = ", ".join(row[1] for row in conn.execute(f'PRAGMA main.table_info({table})'))
+    batch = f'''SELECT rowid FROM main.{table}
+                WHERE created_at < ? AND {condition}
+                ORDER BY rowid LIMIT ?'''
+    conn.execute('BEGIN')
+    try:
+        conn.execute(f'''INSERT OR IGNORE INTO archive.{table} ({columns}, archived_at)
+                        SELECT {columns}, ? FROM main.{table} WHERE rowid IN ({batch})''',
+                     (int(time.time()), cutoff, batch_size))
+        moved = conn.execute(f'DELETE FROM main.{table} WHERE rowid IN ({batch})',
+                             (cutoff, batch_size)).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+
+def space_stats(conn):
+    """(page_size, page_count, freelist_count, auto_vacuum) основной БД"""
+    return tuple(conn.execute(f'PRAGMA main.{name}').fetchone()[0]
+                 for name in ("page_size", "page_count", "freelist_count", "auto_vacuum"))
+
+
+def vacuum_step(conn, pages) -> int:
+    """Возвращает до pages свободных страниц файлу; результат - сколько свободных осталось"""
+    conn.execute(f'PRAGMA main.incremental_vacuum({int(pages)})').fetchall()
+    return conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+
+
+def checkpoint(conn):
+    conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+
+
+async def run_retention(db, archive_path, max_age, batch_size=500, pause=0.05, vacuum_pages=256):
+    """Перенос строк старше max_age секунд в archive_path и incremental vacuum.
+    Каждая пачка и шаг vacuum - отдельный вызов потока БД с паузой pause между ними.
+    Возвращает отчет: перенесено по таблицам, пачек, освобождено байт, свободных страниц, секунд"""
+    started = time.perf_counter()
+    cutoff = int(time.time() - max_age)
+    report = {"moved": {}, "batches": 0, "reclaimed_bytes": 0, "free_pages": 0, "incremental": False}
+
+    await db.run(attach_archive, archive_path)
+    try:
+        for table, condition, _ in RETENTION_TABLES:
+            moved = 0
+            while True:
+                count = await db.run(move_batch, table, condition, cutoff, batch_size)
+                moved += count
+                if count:
+                    report["batches"] += 1
+                if count < batch_size:
+                    break
+                await asyncio.sleep(pause)
+            report["moved"][table] = moved
+    finally:
+        await db.run(detach_archive)
+
+    page_size, pages_before, free_pages, auto_vacuum = await db.run(space_stats)
+    report["incremental"] = auto_vacuum == AUTO_VACUUM_INCREMENTAL
+    if report["incremental"]:
+        while free_pages:
+            left = await db.run(vacuum_step, vacuum_pages)
+            if left >= free_pages:
+                break
+            free_pages = left
+            await asyncio.sleep(pause)
+        await db.run(checkpoint)
+        _, pages_after, free_pages, _ = await db.run(space_stats)
+        report["reclaimed_bytes"] = (pages_before - pages_after) * page_size
+    report["free_pages"] = free_pages
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def report_line(report) -> str:
+    moved = ", ".join(f"{table}: {count}" for table, count in report["moved"].items())
+    line = (f"Архивация: перенесено {moved} ({report['batches']} пачек) за {report['seconds']:.1f} с, "
+            f"освобождено {report['reclaimed_bytes'] / 1024:.0f} КБ")
+    if not report["incremental"] and report["free_pages"]:
+        line += (f"; свободных страниц {report['free_pages']} - auto_vacuum выключен, "
+                 "место переиспользуется без уменьшения файла (retention.py --convert)")
+    return line
+
+
+def convert_to_incremental(conn):
+    """Разовый перевод существующей БД на auto_vacuum=INCREMENTAL; VACUUM перезаписывает весь файл"""
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('VACUUM')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="bot_db.sqlite")
+    parser.add_argument("--archive", help="файл архива (по умолчанию <db>_archive.sqlite)")
+    parser.add_argument("--days", type=float, default=30, help="переносить строки старше стольких суток")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--convert", action="store_true",
+                        help="перевести БД на auto_vacuum=INCREMENTAL (VACUUM, бот должен быть остановлен)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    db = Database(args.db).open()
+    try:
+        if args.convert:
+            started = time.perf_counter()
+            size = os.path.getsize(args.db)
+            await db.run(convert_to_incremental)
+            logger.info("auto_vacuum=INCREMENTAL за %.1f с, размер %d -> %d байт",
+                        time.perf_counter() - started, size, os.path.getsize(args.db))
+        report = await run_retention(db, args.archive or archive_path_for(args.db), args.days * 86400, args.batch)
+        logger.info(report_line(report))
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
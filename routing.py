@@ -0,0 +1,59 @@
+from collections import namedtuple
+
+
+Snapshot = namedtuple("Snapshot", ["office_to_drops", "drops_to_offices", "topics"])
+
+
+def load_snapshot(conn) -> Snapshot:
+    office_to_drops = {}
+    drops_to_offices = {}
+    for office_chat, drops_chat in conn.execute('''SELECT oc.chat_id, dc.chat_id
+                                                FROM office_chats oc
+                                                JOIN drops_chats dc ON dc.user_id = oc.user_id
+                                                ORDER BY oc.id'''):
+        office_to_drops.setdefault(office_chat, drops_chat)
+        drops_to_offices.setdefault(drops_chat, []).append(office_chat)
+    for (drops_chat,) in conn.execute('SELECT chat_id FROM drops_chats'):
+        drops_to_offices.setdefault(drops_chat, [])
+
+    topics = {}
+    for chat_id, topic_name, topic_id in conn.execute('''SELECT chat_id, topic_name, topic_id
+                                                      FROM number_topics
+                                                      WHERE is_active = 1
+                                                      ORDER BY id'''):
+        topics[(chat_id, topic_name)] = topic_id
+    return Snapshot(office_to_drops, drops_to_offices, topics)
+
+
+class ChatTopology:
+    """Кэш маршрутизации офис -> дропы и тем чатов в памяти процесса"""
+
+    def __init__(self):
+        self._snapshot = Snapshot({}, {}, {})
+
+    def load(self, db):
+        """Синхронная загрузка при старте"""
+        self._snapshot = db.run_sync(load_snapshot)
+        return self
+
+    async def reload(self, db):
+        """Перечитывает таблицы и атомарно подменяет снимок"""
+        self._snapshot = await db.run(load_snapshot)
+
+    def is_office_chat(self, chat_id) -> bool:
+        return chat_id in self._snapshot.office_to_drops
+
+    def is_drops_chat(self, chat_id) -> bool:
+        return chat_id in self._snapshot.drops_to_offices
+
+    def get_drops_chat_for_office(self, office_chat_id):
+        return self._snapshot.office_to_drops.get(office_chat_id)
+
+    def get_office_chats_for_drops(self, drops_chat_id):
+        return list(self._snapshot.drops_to_offices.get(drops_chat_id, ()))
+
+    def get_topic(self, chat_id, topic_name):
+        return self._snapshot.topics.get((chat_id, topic_name))
+
+    def drops_chats(self):
+        return list(self._snapshot.drops_to_offices)
@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import DeleteMessage, EditMessageText, SendDocument, SendMessage, SendPhoto
+
+
+PRIORITY_REPLY = 0
+PRIORITY_NORMAL = 1
+PRIORITY_COUNTER = 2
+PRIORITY_REPORT = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_REPLY: "ответы",
+    PRIORITY_NORMAL: "обычные",
+    PRIORITY_COUNTER: "счетчики",
+    PRIORITY_REPORT: "отчеты",
+}
+
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 20
+
+UNTHROTTLED_METHODS = (DeleteMessage,)
+# раз в столько секунд из словаря лимитов удаляются полные корзины простаивающих чатов
+BUCKET_PRUNE_INTERVAL = 60
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now) -> float:
+        """Сколько ждать до появления токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now) -> bool:
+        """Полная корзина ничем не отличается от новой - ее можно удалить"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "method", "chat_id", "future", "enqueued")
+
+    def __init__(self, priority, seq, method, chat_id, future):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.chat_id = chat_id
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundDispatcher:
+    """Единая очередь исходящих запросов к Bot API с лимитами Telegram и приоритетами.
+    _queue - куча запросов, готовых к проверке; запросы чата, упершегося в лимит или с запросом
+    в полете, откладываются в _held до его освобождения, поэтому выбор следующего - O(log n)"""
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE):
+        self.bot = bot
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._queue = []
+        self._held = {}
+        self._release_at = []
+        self._pruned_at = time.monotonic()
+        self._seq = itertools.count()
+        self._inflight_chats = set()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._running = set()
+        self._paused_until = 0.0
+        self._waits = {priority: deque(maxlen=1000) for priority in PRIORITY_NAMES}
+        self.stats = {"sent": 0, "errors": 0, "retry_after": 0, "paused_seconds": 0.0}
+
+    def __call__(self, method, priority=PRIORITY_REPLY):
+        """Постановка готового метода aiogram (например, message.answer(...)) в очередь"""
+        return self.call(method, priority)
+
+    async def call(self, method, priority=PRIORITY_REPLY):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, _Job(priority, next(self._seq), method, getattr(method, "chat_id", None), future))
+        self._wakeup.set()
+        return await future
+
+    def send_message(self, chat_id, text, priority=PRIORITY_REPLY, **kwargs):
+        return self.call(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, priority=PRIORITY_REPLY, **kwargs):
+        return self.call(EditMessageText(text=text, chat_id=chat_id, message_id=message_id, **kwargs), priority)
+
+    def delete_message(self, chat_id, message_id, priority=PRIORITY_REPLY):
+        return self.call(DeleteMessage(chat_id=chat_id, message_id=message_id), priority)
+
+    def send_photo(self, chat_id, photo, priority=PRIORITY_REPLY, **kwargs):
+        return self.call(SendPhoto(chat_id=chat_id, photo=photo, **kwargs), priority)
+
+    def send_document(self, chat_id, document, priority=PRIORITY_REPLY, **kwargs):
+        return self.call(SendDocument(chat_id=chat_id, document=document, **kwargs), priority)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _chat_delay(self, job, now) -> float:
+        if job.chat_id is None or isinstance(job.method, UNTHROTTLED_METHODS):
+            return 0.0
+        return self._chat_bucket(job.chat_id).delay(now)
+
+    def _hold(self, job):
+        heapq.heappush(self._held.setdefault(job.chat_id, []), job)
+
+    def _release(self, chat_id):
+        """Отложенные запросы чата возвращаются в общую кучу и проверяются заново"""
+        for job in self._held.pop(chat_id, ()):
+            heapq.heappush(self._queue, job)
+
+    def _schedule_release(self, chat_id, now):
+        delay = self._chat_bucket(chat_id).delay(now)
+        if delay > 0:
+            heapq.heappush(self._release_at, (now + delay, chat_id))
+        else:
+            self._release(chat_id)
+
+    def _release_due(self, now):
+        while self._release_at and self._release_at[0][0] <= now:
+            _, chat_id = heapq.heappop(self._release_at)
+            if chat_id not in self._inflight_chats:
+                self._release(chat_id)
+
+    def _prune_buckets(self, now):
+        if now - self._pruned_at < BUCKET_PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if bucket.is_full(now) and chat_id not in self._held and chat_id not in self._inflight_chats]:
+            del self._chat_buckets[chat_id]
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._release_due(now)
+            self._prune_buckets(now)
+            if not self._queue:
+                await self._wait(self._release_at[0][0] - now if self._release_at else None)
+                continue
+
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            picked = heapq.heappop(self._queue)
+            if picked.future.done():
+                continue
+            # пока чат в полете или ждет лимита, его запросы откладываются вместе и не крутятся в куче
+            if picked.chat_id in self._inflight_chats:
+                self._hold(picked)
+                continue
+            chat_delay = self._chat_delay(picked, now)
+            if chat_delay > 0:
+                if picked.chat_id not in self._held:
+                    heapq.heappush(self._release_at, (now + chat_delay, picked.chat_id))
+                self._hold(picked)
+                continue
+
+            self._global.consume(now)
+            if picked.chat_id is not None and not isinstance(picked.method, UNTHROTTLED_METHODS):
+                self._chat_bucket(picked.chat_id).consume(now)
+            self._waits[picked.priority].append(now - picked.enqueued)
+            if picked.chat_id is not None:
+                self._inflight_chats.add(picked.chat_id)
+            task = asyncio.create_task(self._execute(picked))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job):
+        try:
+            result = await self.bot(job.method)
+        except TelegramRetryAfter as e:
+            self.stats["retry_after"] += 1
+            self.stats["paused_seconds"] += e.retry_after
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            heapq.heappush(self._queue, job)
+        except Exception as e:
+            self.stats["errors"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._inflight_chats.discard(job.chat_id)
+            if job.chat_id in self._held:
+                self._schedule_release(job.chat_id, time.monotonic())
+            self._wakeup.set()
+
+    def queue_depth(self):
+        depth = {priority: 0 for priority in PRIORITY_NAMES}
+        for jobs in (self._queue, *self._held.values()):
+            for job in jobs:
+                if not job.future.done():
+                    depth[job.priority] += 1
+        return depth
+
+    def wait_stats(self):
+        """{приоритет: (среднее, p95, максимум)} ожидания в очереди, секунды"""
+        result = {}
+        for priority, waits in self._waits.items():
+            if waits:
+                ordered = sorted(waits)
+                p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+                result[priority] = (sum(ordered) / len(ordered), p95, ordered[-1])
+        return result
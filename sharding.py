@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+import zlib
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+CHAT_EVENTS = ("message", "edited_message", "channel_post", "edited_channel_post",
+               "my_chat_member", "chat_member", "chat_join_request", "message_reaction")
+USER_EVENTS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+
+def update_chat_id(update: dict):
+    """chat_id апдейта Bot API в виде словаря; для событий без чата - id пользователя"""
+    for key in CHAT_EVENTS:
+        event = update.get(key)
+        if event:
+            return event.get("chat", {}).get("id")
+    callback = update.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        if message:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+    for key in USER_EVENTS:
+        event = update.get(key)
+        if event:
+            return (event.get("from") or event.get("user") or {}).get("id")
+    return None
+
+
+class ShardRouter:
+    """Выбор шарда по chat_id: офисный чат уходит на шард своего чата дропов,
+    поэтому очередь запросов, счетчик и офисы одного чата дропов обслуживает один процесс"""
+
+    def __init__(self, topology, shards: int):
+        self.topology = topology
+        self.shards = shards
+
+    def key(self, chat_id):
+        if chat_id is None:
+            return 0
+        return self.topology.get_drops_chat_for_office(chat_id) or chat_id
+
+    def shard(self, key) -> int:
+        return zlib.crc32(str(key).encode()) % self.shards
+
+    def route(self, update: dict):
+        """(номер шарда по чату дропов, ключ упорядочивания - собственный чат апдейта).
+        Внутри шарда апдейты разных чатов группы идут параллельно: медленное фото в одном
+        офисе не задерживает прием номеров в чате дропов"""
+        chat_id = update_chat_id(update)
+        return self.shard(self.key(chat_id)), chat_id if chat_id is not None else 0
+
+
+class ChatOrderedRunner:
+    """Обработка параллельно между ключами и строго по порядку внутри ключа"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._queues = {}
+        self._tasks = set()
+        self.processed = 0
+
+    def submit(self, key, item):
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(item)
+            return
+        self._queues[key] = deque([item])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                item = queue.popleft()
+                try:
+                    await self.handler(item)
+                except Exception as e:
+                    logger.exception("Ошибка обработки апдейта (ключ %s): %s", key, e)
+                self.processed += 1
+        finally:
+            del self._queues[key]
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+async def consume_shard(queue, runner: ChatOrderedRunner, poll_interval=0.5):
+    """Чтение (ключ, апдейт) из очереди процесса до None"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            item = await loop.run_in_executor(None, queue.get, True, poll_interval)
+        except queue_module.Empty:
+            continue
+        if item is None:
+            break
+        key, update = item
+        runner.submit(key, update)
+    await runner.join()
+
+
+def start_workers(target, shards: int, *args):
+    """Процессы-обработчики target(index, queue, *args); spawn - без наследования потоков и соединений"""
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(shards)]
+    processes = []
+    for index in range(shards):
+        process = context.Process(target=target, args=(index, queues[index], *args), name=f"shard-{index}")
+        process.start()
+        processes.append(process)
+    return processes, queues
+
+
+def stop_workers(processes, queues, timeout=30):
+    for queue in queues:
+        queue.put(None)
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning("Шард %s не завершился за %s с, останавливаем", process.name, timeout)
+            process.terminate()
+
+
+async def poll_updates(bot, dispatch, allowed_updates=None, timeout=30):
+    """Long polling в процессе приема: апдейты не обрабатываются, а раздаются по шардам"""
+    from aiogram.methods import GetUpdates
+
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot(GetUpdates(offset=offset, timeout=timeout, allowed_updates=allowed_updates),
+                                request_timeout=timeout + 10)
+        except Exception as e:
+            logger.error("Ошибка getUpdates: %s, повтор через %s с", e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            offset = update.update_id + 1
+            dispatch(update.model_dump(mode="json", exclude_unset=True))
+
+
+async def serve_webhook(dispatch, host, port, path, secret=None):
+    """Webhook в процессе приема: сырой JSON апдейта сразу уходит в шард, ответ 200 без тела"""
+    from aiohttp import web
+
+    async def handle(request):
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401)
+        dispatch(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
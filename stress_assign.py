@@ -0,0 +1,193 @@
+"""Стресс-тест выдачи запросов номеров (PendingRequests.assign) при конкурентных апдейтах.
+
+Во временной БД создаются запросы в нескольких чатах дропов, затем на каждый чат одновременно
+приходит больше номеров, чем запросов. Каждый номер обрабатывается как апдейт в своей единице
+работы: pending.assign -> "отправка" в офис со случайной задержкой и долей ошибок -> запись.
+Можно включить ошибки фиксации (--commit-fail) и групповую фиксацию (--group-commit-ms).
+
+Проверки: ни один запрос не выдан дважды; выполненные запросы в БД совпадают с успешными
+выдачами; очереди в памяти совпадают с БД после перезагрузки; каждый запрос либо выполнен
+ровно один раз, либо ждет. Порядок доставки в офис (FIFO) проверяется и при ошибках фиксации:
+assign фиксирует запись под блокировкой. --no-lock показывает, как без блокировки чата
+перемешивается порядок.
+
+Запуск: python stress_assign.py [--chats 8] [--requests 40] [--phones 60] [--send-fail 0.1]
+                                [--commit-fail 0] [--group-commit-ms 0] [--rounds 3] [--no-lock]
+Код выхода 1 - найдены нарушения.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from db import Database
+from pending import PendingRequests
+
+
+class SendFailed(Exception):
+    pass
+
+
+class SaveFailed(Exception):
+    pass
+
+
+class NoLock:
+    """Подмена pending.locks для сравнения: блокировка чата ничего не делает"""
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        yield
+
+    def __len__(self):
+        return 0
+
+
+def create_assignments(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS stress_assignments (
+                    request_id INTEGER,
+                    phone TEXT)''')
+    conn.commit()
+
+
+def save_assignment(conn, request, delivered, phone, fail):
+    if fail:
+        raise SaveFailed(phone)
+    conn.execute('''UPDATE num_requests SET status = 'fulfilled' WHERE request_id = ?''', (request.request_id,))
+    conn.execute('INSERT INTO stress_assignments (request_id, phone) VALUES (?, ?)', (request.request_id, phone))
+
+
+def load_state(conn):
+    statuses = dict(conn.execute('SELECT request_id, status FROM num_requests').fetchall())
+    assignments = conn.execute('SELECT request_id, phone FROM stress_assignments').fetchall()
+    return statuses, assignments
+
+
+async def run_round(args, db, pending, rng, round_no):
+    chats = [-100100000 - i for i in range(args.chats)]
+    for i, chat in enumerate(chats):
+        # запросы приходят от нескольких сообщений, как пакеты /n N
+        for message in range(args.requests // 10 or 1):
+            await pending.push_many(-100200000 - i, chat, round_no * 1000 + message, 10)
+
+    delivered = {chat: [] for chat in chats}
+    committed = []
+    outcomes = Counter()
+
+    async def handle_phone(chat, phone):
+        await asyncio.sleep(rng.random() * args.spread_ms / 1000)
+
+        async def send(request):
+            await asyncio.sleep(rng.random() * args.latency_ms / 1000)
+            if rng.random() < args.send_fail:
+                raise SendFailed(phone)
+            delivered[chat].append(request.request_id)
+            return request.request_id
+
+        try:
+            async with db.unit_of_work():
+                assigned = await pending.assign(chat, send, save_assignment, phone,
+                                                rng.random() < args.commit_fail)
+        except SendFailed:
+            outcomes["send_failed"] += 1
+            return
+        except SaveFailed:
+            outcomes["commit_failed"] += 1
+            return
+        if assigned is None:
+            outcomes["no_request"] += 1
+            return
+        outcomes["assigned"] += 1
+        committed.append((assigned[0].request_id, phone))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle_phone(chat, f"{round_no}-{chat}-{n}")
+                           for chat in chats for n in range(args.phones)))
+    elapsed = time.perf_counter() - started
+
+    memory = {chat: [request.request_id for request in pending._queues.get(chat, ())] for chat in chats}
+    statuses, assignments = await db.run(load_state)
+    await pending.reload()
+    reloaded = {chat: [request.request_id for request in pending._queues.get(chat, ())] for chat in chats}
+
+    violations = []
+    doubles = [request_id for request_id, n in Counter(r for r, _ in assignments).items() if n > 1]
+    if doubles:
+        violations.append(f"запросы выданы дважды: {sorted(doubles)[:10]}")
+    if sorted(assignments) != sorted(committed):
+        violations.append(f"записи в БД ({len(assignments)}) не совпадают с успешными выдачами ({len(committed)})")
+    fulfilled = {request_id for request_id, status in statuses.items() if status == 'fulfilled'}
+    if fulfilled != {request_id for request_id, _ in assignments}:
+        violations.append("статус fulfilled расходится с выдачами")
+    if memory != reloaded:
+        violations.append("очереди в памяти расходятся с БД")
+    waiting = {request_id for queue in memory.values() for request_id in queue}
+    lost = set(statuses) - fulfilled - waiting
+    if lost or waiting & fulfilled:
+        violations.append(f"потеряно {len(lost)}, одновременно выполнено и ждет {len(waiting & fulfilled)}")
+
+    out_of_order = sum(1 for queue in delivered.values() for a, b in zip(queue, queue[1:]) if b < a)
+    if out_of_order and not args.no_lock:
+        violations.append(f"нарушен порядок доставки в офис: {out_of_order}")
+
+    print(f"раунд {round_no}: {sum(outcomes.values())} номеров за {elapsed:.2f} с, "
+          + ", ".join(f"{name}={n}" for name, n in sorted(outcomes.items()))
+          + f", вне порядка={out_of_order}, блокировок осталось={len(pending.locks)}")
+
+    # следующий раунд начинается с чистой таблицы
+    await db.execute('DELETE FROM num_requests')
+    await db.execute('DELETE FROM stress_assignments')
+    await pending.reload()
+    return violations
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=8, help="чатов дропов")
+    parser.add_argument("--requests", type=int, default=40, help="запросов на чат (пакетами по 10)")
+    parser.add_argument("--phones", type=int, default=60, help="номеров на чат")
+    parser.add_argument("--latency-ms", type=float, default=5, help="максимальная задержка отправки в офис")
+    parser.add_argument("--spread-ms", type=float, default=20, help="разброс прихода номеров")
+    parser.add_argument("--send-fail", type=float, default=0.1, help="доля ошибок отправки")
+    parser.add_argument("--commit-fail", type=float, default=0.0, help="доля ошибок фиксации")
+    parser.add_argument("--group-commit-ms", type=float, default=0)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-lock", action="store_true", help="без блокировки чата дропов (для сравнения)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db = Database(path, group_commit_window=args.group_commit_ms / 1000).open()
+    try:
+        db.run_sync(create_assignments)
+        pending = PendingRequests(db).load()
+        if args.no_lock:
+            pending.locks = NoLock()
+        violations = []
+        for round_no in range(1, args.rounds + 1):
+            violations += await run_round(args, db, pending, rng, round_no)
+        if db.group_commit is not None:
+            print(f"групповая фиксация: {db.group_commit.units} единиц в {db.group_commit.batches} транзакциях")
+    finally:
+        await db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    if violations:
+        print("НАРУШЕНИЯ:")
+        for violation in violations:
+            print(f"  {violation}")
+        sys.exit(1)
+    print("нарушений нет")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())